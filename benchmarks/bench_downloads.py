@@ -0,0 +1,88 @@
+"""
+Throughput benchmark of the PDF download path.
+
+Downloads the same set of PDFs from the local stub server twice, once with
+the old writer (an aiofiles write for every 1 KiB chunk) and once with the
+DownloadPipeline, and prints the throughput and the CPU time spent per MB:
+
+    python benchmarks/bench_downloads.py [--pdf-size BYTES] [--count N]
+
+The stub server runs in the same process, so its CPU time is included in
+both measurements.
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+import aiohttp
+from aiofiles import open as aio_open
+
+from sortgs.downloads import DOWNLOAD_WORKERS, DownloadPipeline
+from sortgs.pdfstore import PdfStore
+
+from stub_server import StubServer
+
+PDF_SIZE = 20 * 2**20
+COUNT = 16
+
+
+async def legacy_download(session, url, path):
+    """The download loop used before the buffered writer."""
+    async with session.get(url) as response:
+        async with aio_open(path, 'wb') as file:
+            async for chunk in response.content.iter_chunked(1024):
+                if chunk:
+                    await file.write(chunk)
+
+
+async def run_legacy(urls, pdf_dir):
+    connector = aiohttp.TCPConnector(limit=DOWNLOAD_WORKERS)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        semaphore = asyncio.Semaphore(DOWNLOAD_WORKERS)
+
+        async def download(i, url):
+            async with semaphore:
+                await legacy_download(session, url, os.path.join(pdf_dir, f'paper_{i:04d}.pdf'))
+
+        await asyncio.gather(*(download(i, url) for i, url in enumerate(urls)))
+
+
+async def run_pipeline(urls, pdf_dir):
+    # The stub server is a single host, lift the per-host limit to match the legacy run
+    store = PdfStore(os.path.join(pdf_dir, os.pardir, 'store'))
+    async with DownloadPipeline(pdf_dir, limit_per_host=DOWNLOAD_WORKERS, store=store) as downloads:
+        for i, url in enumerate(urls):
+            await downloads.submit(f'paper_{i:04d}', 'title', url)
+    if not all(status is True for status in downloads.status.values()):
+        raise RuntimeError('Some downloads failed')
+
+
+def bench(run, urls, megabytes):
+    with tempfile.TemporaryDirectory() as tmp:
+        pdf_dir = os.path.join(tmp, 'PDFs')
+        os.makedirs(pdf_dir)
+        wall, cpu = time.perf_counter(), time.process_time()
+        asyncio.run(run(urls, pdf_dir))
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+    return megabytes / wall, cpu * 1000 / megabytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='PDF download throughput benchmark')
+    parser.add_argument('--pdf-size', type=int, default=PDF_SIZE, help=f'Size of each PDF in bytes. Default is {PDF_SIZE}')
+    parser.add_argument('--count', type=int, default=COUNT, help=f'Number of PDFs downloaded. Default is {COUNT}')
+    args = parser.parse_args()
+
+    with StubServer(pdf_size=args.pdf_size, latency=0) as server:
+        urls = [f'{server.base_url}/pdf/{i}.pdf' for i in range(args.count)]
+        megabytes = args.count * len(server.pdf_payload) / 2**20
+        print(f'{args.count} PDFs of {args.pdf_size / 2**20:.1f} MiB')
+        for name, run in [('legacy', run_legacy), ('pipeline', run_pipeline)]:
+            throughput, cpu_per_mb = bench(run, urls, megabytes)
+            print(f'{name:>9}: {throughput:8.1f} MiB/s, {cpu_per_mb:6.2f} ms CPU per MiB')
+
+
+if __name__ == '__main__':
+    main()
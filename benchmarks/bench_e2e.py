@@ -0,0 +1,158 @@
+"""
+End-to-end benchmark of sortgs against the local stub server.
+
+Runs the sortgs command line in a subprocess for each --nresults value,
+with Google Scholar and the publisher sites replaced by stub_server.py,
+and writes the measurements as JSON:
+
+    python benchmarks/bench_e2e.py --output bench.json
+    python benchmarks/bench_e2e.py --baseline bench.json  # exits 1 on regression
+
+Pacing is relaxed by default (--rate 1000) so the numbers reflect sortgs
+itself rather than the politeness delays used against the real Scholar.
+"""
+from importlib.metadata import version, PackageNotFoundError
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+
+from sortgs.parser import BACKEND, parse_page
+
+from pages import render_page, rows_for
+from stub_server import KEYWORD, LATENCY, PDF_SIZE, StubServer
+
+NRESULTS = [10, 100, 1000]
+TOLERANCE = 0.2  # Relative slowdown tolerated when comparing to a baseline
+
+# Points sortgs at the stub server, then runs its command line
+RUNNER = 'import sys, sortgs.sortgs as s; s.GSCHOLAR_URL = sys.argv.pop(1); s.main()'
+
+
+def sortgs_version():
+    try:
+        return version('sortgs')
+    except PackageNotFoundError:
+        return None
+
+
+def parse_time_per_page(server, nresults):
+    """Returns the mean time (s) spent parsing the pages of a run."""
+    rows = rows_for(server.rows, 0, nresults)
+    pages = [render_page(KEYWORD, rows, start, base=server.base_url) for start in range(0, nresults, 10)]
+    start = time.perf_counter()
+    for page in pages:
+        parse_page(page)
+    return (time.perf_counter() - start) / len(pages)
+
+
+def run_sortgs(server, nresults, extra_args):
+    """Runs sortgs once and returns (seconds, peak RSS in bytes, number of rows saved)."""
+    with tempfile.TemporaryDirectory() as csvpath:
+        cmd = [sys.executable, '-c', RUNNER, server.scholar_url, KEYWORD,
+               '--nresults', str(nresults), '--csvpath', csvpath] + extra_args
+        # A fresh cache directory, so every run starts cold
+        env = dict(os.environ, XDG_CACHE_HOME=os.path.join(csvpath, 'cache'))
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        _, status, rusage = os.wait4(proc.pid, 0)
+        seconds = time.perf_counter() - start
+        proc.returncode = os.waitstatus_to_exitcode(status)
+        if proc.returncode != 0:
+            raise RuntimeError(f'sortgs exited with code {proc.returncode}: {" ".join(cmd)}')
+
+        # ru_maxrss is in KiB on Linux and in bytes on macOS
+        peak_rss = rusage.ru_maxrss if sys.platform == 'darwin' else rusage.ru_maxrss * 1024
+        fpath_csv = os.path.join(csvpath, KEYWORD.replace(' ', '_') + '.csv')
+        with open(fpath_csv, encoding='utf-8') as f:
+            nrows = sum(1 for _ in f) - 1
+    return seconds, peak_rss, nrows
+
+
+def bench(server, nresults, extra_args):
+    before = server.stats.copy()
+    seconds, peak_rss, nrows = run_sortgs(server, nresults, extra_args)
+    served = server.stats - before
+    return {
+        'nresults': nresults,
+        'results': nrows,
+        'seconds': round(seconds, 3),
+        'pages': served['pages'],
+        'pages_per_s': round(served['pages'] / seconds, 2),
+        'parse_ms_per_page': round(parse_time_per_page(server, nresults) * 1000, 3),
+        'pdfs': served['pdfs'],
+        'download_mb': round(served['pdf_bytes'] / 2**20, 2),
+        'download_mb_per_s': round(served['pdf_bytes'] / 2**20 / seconds, 2),
+        'landing_pages': served['landings'],
+        'peak_rss_mb': round(peak_rss / 2**20, 1),
+    }
+
+
+def compare(report, baseline, tolerance):
+    """Returns a list of regressions of `report` against `baseline`."""
+    regressions = []
+    previous = {run['nresults']: run for run in baseline['runs']}
+    for run in report['runs']:
+        old = previous.get(run['nresults'])
+        if old is None:
+            continue
+        for key in ['seconds', 'parse_ms_per_page', 'peak_rss_mb']:
+            if run[key] > old[key] * (1 + tolerance):
+                regressions.append(f'nresults={run["nresults"]}: {key} went from {old[key]} to {run[key]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end sortgs benchmark against a local stub server')
+    parser.add_argument('--nresults', type=int, nargs='+', default=NRESULTS, help=f'Runs to time. Default is {NRESULTS}')
+    parser.add_argument('--latency', type=float, default=LATENCY, help=f'Stub server latency in seconds. Default is {LATENCY}')
+    parser.add_argument('--pdf-size', type=int, default=PDF_SIZE, help=f'Size of each PDF payload in bytes. Default is {PDF_SIZE}')
+    parser.add_argument('--rate', type=float, default=1000, help='Value of --rate passed to sortgs. Default is 1000')
+    parser.add_argument('--max-concurrency', type=int, help='Value of --max-concurrency passed to sortgs')
+    parser.add_argument('--output', type=str, help='File to write the JSON report to. Default is stdout')
+    parser.add_argument('--baseline', type=str, help='JSON report of an earlier run to compare against')
+    parser.add_argument('--tolerance', type=float, default=TOLERANCE, help=f'Relative slowdown tolerated against the baseline. Default is {TOLERANCE}')
+    args = parser.parse_args()
+
+    extra_args = ['--rate', str(args.rate)]
+    if args.max_concurrency:
+        extra_args += ['--max-concurrency', str(args.max_concurrency)]
+
+    with StubServer(pdf_size=args.pdf_size, latency=args.latency) as server:
+        runs = []
+        for nresults in args.nresults:
+            runs.append(bench(server, nresults, extra_args))
+            print(f'nresults={nresults}: {runs[-1]["seconds"]} s', file=sys.stderr)
+
+    report = {
+        'sortgs_version': sortgs_version(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'parser_backend': BACKEND,
+        'latency': args.latency,
+        'pdf_size': args.pdf_size,
+        'sortgs_args': extra_args,
+        'runs': runs,
+    }
+    output = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print('Regression:', regression, file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,57 @@
+"""
+Micro-benchmark of the result page parser.
+
+Parses every saved example page with each installed parser backend and
+prints the time spent per page:
+
+    python benchmarks/bench_parser.py [--repeat N]
+"""
+import argparse
+import statistics
+import time
+
+from sortgs.parser import BACKENDS, parse_page
+
+from pages import example_pages
+
+
+def available_backends():
+    backends = []
+    for backend in BACKENDS:
+        try:
+            parse_page(b'<html></html>', backend=backend)
+        except Exception:
+            continue
+        backends.append(backend)
+    return backends
+
+
+def bench(pages, backend, repeat):
+    """Returns the per-page parse times (s) of a backend, best of `repeat`."""
+    times = []
+    for _, _, page in pages:
+        best = float('inf')
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_page(page, backend=backend)
+            best = min(best, time.perf_counter() - start)
+        times.append(best)
+    return times
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Parser micro-benchmark')
+    parser.add_argument('--repeat', type=int, default=5, help='Runs per page, the best one is kept')
+    args = parser.parse_args()
+
+    pages = example_pages()
+    size = statistics.mean(len(page) for _, _, page in pages) / 1024
+    print(f'{len(pages)} pages, {size:.0f} KiB per page on average')
+    for backend in available_backends():
+        times = bench(pages, backend, args.repeat)
+        print(f'{backend:>12}: {statistics.mean(times) * 1000:7.2f} ms/page '
+              f'(median {statistics.median(times) * 1000:.2f} ms, max {max(times) * 1000:.2f} ms)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Google Scholar style result pages built from the saved example results.
+
+The CSV files in examples/ hold real results (authors, titles, citations,
+years and sources) saved by earlier sortgs runs. They are laid out here
+with the same markup Scholar uses for its result pages, including the
+page chrome around the results, so parsing them costs about as much as
+parsing a live page.
+"""
+import csv
+import html
+import os
+import zlib
+
+EXAMPLES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'examples')
+RESULTS_PER_PAGE = 10
+
+PAGE_HEAD = '''<!doctype html><html><head><title>{query} - Google Scholar</title>
+<meta http-equiv="Content-Type" content="text/html;charset=UTF-8">
+<style>{style}</style><script>{script}</script></head>
+<body><div id="gs_top"><div id="gs_hdr"><form id="gs_hdr_frm" action="/scholar">
+<input type="text" name="q" value="{query}"></form></div>
+<div id="gs_bdy"><div id="gs_bdy_sb">{sidebar}</div>
+<div id="gs_bdy_ccl">{header}<div id="gs_res_ccl"><div id="gs_res_ccl_mid">'''
+PAGE_TAIL = '''</div><div id="gs_n"><center><table><tr>{pager}</tr></table></center></div>
+</div></div></div></div><div id="gs_ftr">{footer}</div></body></html>'''
+
+RESULT = '''<div class="gs_r gs_or gs_scl" data-cid="{cid}" data-did="{cid}" data-lid="" data-aid="{cid}" data-rp="{rp}">
+{download}<div class="gs_ri"><h3 class="gs_rt" ontouchstart="gs_evt_dsp(event)"><a id="{cid}" href="{source}" data-clk="hl=en&amp;sa=T&amp;ct=res&amp;cd={rp}&amp;d={cid}">{title}</a></h3>
+<div class="gs_a">{gs_a}</div>
+<div class="gs_rs">{snippet}</div>
+<div class="gs_fl gs_flb"><a href="javascript:void(0)" class="gs_or_sav gs_or_btn" role="button"><svg viewBox="0 0 15 16" class="gs_or_svg"><path d="M7.5 11.57l3.824 2.308-1.015-4.35 3.379-2.926-4.45-.378L7.5 2.122 5.761 6.224l-4.449.378 3.379 2.926-1.015 4.35z"></path></svg><span class="gs_or_btn_lbl">Save</span></a> <a href="javascript:void(0)" class="gs_or_cit gs_or_btn gs_nph" role="button" aria-controls="gs_cit" aria-haspopup="true"><span>Cite</span></a> <a href="/scholar?cites={cid}&amp;as_sdt=2005&amp;sciodt=0,5&amp;hl=en">Cited by {citations}</a> <a href="/scholar?q=related:{cid}:scholar.google.com/&amp;scioq=&amp;hl=en&amp;as_sdt=0,5">Related articles</a> <a href="/scholar?cluster={cid}&amp;hl=en&amp;as_sdt=0,5" class="gs_nph">All 12 versions</a></div>
+</div></div>'''
+DOWNLOAD = '''<div class="gs_ggs gs_fl"><div class="gs_ggsd"><div class="gs_or_ggsm" ontouchstart="gs_evt_dsp(event)" tabindex="-1"><a href="{href}" data-clk="hl=en&amp;sa=T&amp;oi=gga"><span class="gs_ctg2">[{kind}]</span> {host}</a></div></div></div>'''
+
+
+def load_examples(examples_dir=EXAMPLES_DIR):
+    """Returns {keyword: rows} for every CSV file in examples/, rows in rank order."""
+    examples = {}
+    for fname in sorted(os.listdir(examples_dir)):
+        if not fname.endswith('.csv'):
+            continue
+        with open(os.path.join(examples_dir, fname), encoding='utf-8') as f:
+            rows = sorted(csv.DictReader(f), key=lambda row: int(row['Rank']))
+        examples[fname[:-4].replace('_', ' ')] = rows
+    return examples
+
+
+def host_of(url):
+    return url.split('/')[2] if url.count('/') >= 2 else 'example.org'
+
+
+def paper_cid(title):
+    return f'{zlib.crc32(title.encode("utf-8")):010d}'
+
+
+def render_result(row, rp, base=None):
+    cid = paper_cid(row['Title'])
+    source = row['Source'] or f'https://example.org/{cid}'
+    host = host_of(source)
+    # Alternate between direct PDFs, HTML landing pages and no download badge.
+    # With `base`, both point to the stub server instead of the publisher.
+    download = ''
+    if rp % 3 == 0:
+        href = f'{base}/pdf/{cid}.pdf' if base else f'https://{host}/{cid}.pdf'
+        download = DOWNLOAD.format(href=href, kind='PDF', host=host)
+    elif rp % 3 == 1:
+        href = f'{base}/landing/{cid}' if base else source
+        download = DOWNLOAD.format(href=href, kind='HTML', host=host)
+    gs_a = f'{html.escape(row["Author"])} - Journal of {host}, {row["Year"]} - {host}'
+    snippet = html.escape(f'{row["Title"]}. ' * 6)
+    return RESULT.format(cid=cid, rp=rp, source=html.escape(source), title=html.escape(row['Title']),
+                         gs_a=gs_a, snippet=snippet, citations=row['Citations'], download=download)
+
+
+def rows_for(rows, start, count=RESULTS_PER_PAGE):
+    """
+    Returns `count` rows from `start`, cycling over `rows` so that any number
+    of results can be served. Repeated rows get a distinct title.
+    """
+    out = []
+    for n in range(start, start + count):
+        row = rows[n % len(rows)]
+        if n >= len(rows):
+            row = dict(row, Title=f'{row["Title"]} ({n // len(rows)})')
+        out.append(row)
+    return out
+
+
+def render_page(query, rows, start=0, base=None, total=None):
+    """
+    Returns the result page with the rows from `start` to `start + 10`.
+    With `total`, the page reports that many results above the list.
+    """
+    results = ''.join(render_result(row, rp, base)
+                      for rp, row in enumerate(rows[start:start + RESULTS_PER_PAGE], start))
+    style = '.gs_r{position:relative;}' * 800
+    script = 'var gs_ie=false;function gs_evt_dsp(e){return e;}' * 300
+    sidebar = ''.join(f'<a href="/scholar?as_ylo={y}&amp;q={html.escape(query)}">Since {y}</a>'
+                      for y in range(1990, 2025))
+    pager = ''.join(f'<td><a href="/scholar?start={n * 10}&amp;q={html.escape(query)}">{n + 1}</a></td>'
+                    for n in range(10))
+    footer = '<a href="/intl/en/scholar/about.html">About</a>' * 20
+    header = ''
+    if total is not None:
+        header = f'<div id="gs_ab_md"><div class="gs_ab_mdw">About {total:,} results (<b>0.04</b> sec)</div></div>'
+    return (PAGE_HEAD.format(query=html.escape(query), style=style, script=script, sidebar=sidebar, header=header)
+            + results + PAGE_TAIL.format(pager=pager, footer=footer)).encode('utf-8')
+
+
+def example_pages(base=None):
+    """Returns a list of (keyword, start, page) for all saved example results."""
+    pages = []
+    for keyword, rows in load_examples().items():
+        for start in range(0, len(rows), RESULTS_PER_PAGE):
+            pages.append((keyword, start, render_page(keyword, rows, start, base)))
+    return pages
@@ -0,0 +1,164 @@
+"""
+Local stand-in for Google Scholar and the publisher sites it links to.
+
+    /scholar?start=N&q=...   result pages laid out from the saved examples,
+                             filtered by as_ylo/as_yhi when given
+    /pdf/<id>.pdf            PDF payloads of a fixed size, with ETag and Range support
+    /landing/<id>            external HTML landing pages linking to a PDF
+
+The server runs its own event loop in a background thread so it can serve
+a sortgs process while the caller waits on it:
+
+    with StubServer(latency=0.1) as server:
+        sortgs.sortgs.GSCHOLAR_URL = server.scholar_url
+        ...
+    server.stats  # requests and bytes served
+"""
+from collections import Counter
+import asyncio
+import re
+import threading
+import zlib
+
+from aiohttp import web
+
+from pages import load_examples, render_page, rows_for
+
+KEYWORD = 'machine learning'
+PDF_SIZE = 256 * 1024  # Bytes per PDF payload
+LATENCY = 0.1  # Seconds before each response is sent
+LAST_MODIFIED = 'Mon, 01 Jan 2024 00:00:00 GMT'
+RANGE_RE = re.compile(r'bytes=(\d+)-')
+
+LANDING = '''<!doctype html><html><head><title>Article {cid}</title></head><body>
+<nav>{nav}</nav><article><h1>Article {cid}</h1><p>{text}</p>
+<a href="/pdf/{cid}.pdf" class="download">Download PDF</a><p>{text}</p></article>
+<footer>{nav}</footer></body></html>'''
+
+
+def make_pdf(size=PDF_SIZE):
+    body = b'%PDF-1.4\n'
+    filler = b'0 0 obj << /Length 44 >> stream BT /F1 12 Tf 72 712 Td (sortgs) Tj ET endstream endobj\n'
+    body += filler * max(0, (size - 16) // len(filler))
+    return body + b'\n%%EOF\n'
+
+
+class StubServer:
+    def __init__(self, keyword=KEYWORD, pdf_size=PDF_SIZE, latency=LATENCY, host='127.0.0.1', port=0):
+        self.rows = load_examples()[keyword]
+        self.pdf_payload = make_pdf(pdf_size)
+        self.pdf_etag = f'"{zlib.crc32(self.pdf_payload):08x}"'
+        self.latency = latency
+        self.host = host
+        self.port = port
+        self.stats = Counter()
+        self._loop = None
+        self._runner = None
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def scholar_url(self):
+        """Template to use in place of sortgs.sortgs.GSCHOLAR_URL."""
+        return self.base_url + '/scholar?start={}&q={}&hl=en&as_sdt=0,5'
+
+    async def _delay(self):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+    async def scholar(self, request):
+        await self._delay()
+        start = int(request.query.get('start', 0))
+        query = request.query.get('q', KEYWORD)
+        if 'as_ylo' in request.query or 'as_yhi' in request.query:
+            # Only the saved results of those years, like a real year filter
+            first = int(request.query.get('as_ylo', 0))
+            last = int(request.query.get('as_yhi', 9999))
+            rows = [row for row in self.rows if first <= int(row['Year']) <= last]
+            body = render_page(query, rows, start, base=self.base_url, total=len(rows))
+        else:
+            rows = rows_for(self.rows, 0, start + 10)
+            body = render_page(query, rows, start, base=self.base_url)
+        self.stats['pages'] += 1
+        self.stats['page_bytes'] += len(body)
+        return web.Response(body=body, content_type='text/html', charset='utf-8')
+
+    async def pdf(self, request):
+        """Serves PDFs with an ETag and Last-Modified date, honouring conditional and Range requests."""
+        await self._delay()
+        headers = {'ETag': self.pdf_etag, 'Last-Modified': LAST_MODIFIED, 'Accept-Ranges': 'bytes'}
+        if request.headers.get('If-None-Match') == self.pdf_etag:
+            self.stats['pdfs_not_modified'] += 1
+            return web.Response(status=304, headers=headers)
+
+        body = self.pdf_payload
+        status = 200
+        match = RANGE_RE.fullmatch(request.headers.get('Range', ''))
+        if match and request.headers.get('If-Range', self.pdf_etag) == self.pdf_etag:
+            start = int(match.group(1))
+            if start >= len(body):
+                return web.Response(status=416, headers={'Content-Range': f'bytes */{len(body)}'})
+            headers['Content-Range'] = f'bytes {start}-{len(body) - 1}/{len(body)}'
+            body = body[start:]
+            status = 206
+        self.stats['pdfs'] += 1
+        self.stats['pdf_bytes'] += len(body)
+        return web.Response(status=status, body=body, content_type='application/pdf', headers=headers)
+
+    async def landing(self, request):
+        await self._delay()
+        cid = request.match_info['cid']
+        nav = ''.join(f'<a href="/section/{n}">Section {n}</a>' for n in range(200))
+        self.stats['landings'] += 1
+        return web.Response(text=LANDING.format(cid=cid, nav=nav, text='Lorem ipsum. ' * 500),
+                            content_type='text/html')
+
+    def start(self):
+        started = threading.Event()
+        errors = []
+
+        def run():
+            self._loop = asyncio.new_event_loop()
+            asyncio.set_event_loop(self._loop)
+            try:
+                app = web.Application()
+                app.router.add_get('/scholar', self.scholar)
+                app.router.add_get('/pdf/{name}', self.pdf)
+                app.router.add_get('/landing/{cid}', self.landing)
+                self._runner = web.AppRunner(app, access_log=None)
+                self._loop.run_until_complete(self._runner.setup())
+                site = web.TCPSite(self._runner, self.host, self.port)
+                self._loop.run_until_complete(site.start())
+                self.port = self._runner.addresses[0][1]
+            except Exception as e:
+                errors.append(e)
+                self._loop.close()
+                return
+            finally:
+                started.set()
+            self._loop.run_forever()
+            self._loop.run_until_complete(self._runner.cleanup())
+            self._loop.close()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        started.wait()
+        if errors:
+            self._loop = None
+            raise errors[0]
+        return self
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+            self._loop = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -1 +1,11 @@
-from sortgs.sortgs import main
\ No newline at end of file
+from sortgs.sortgs import main
+
+# The library API imports asyncio and aiohttp, so it is only loaded when used
+API = ['ScholarClient', 'Search', 'asearch', 'search']
+
+
+def __getattr__(name):
+    if name in API:
+        from sortgs import client
+        return getattr(client, name)
+    raise AttributeError(f"module 'sortgs' has no attribute '{name}'")
@@ -0,0 +1,225 @@
+"""
+Pool of headless browsers for result pages that Scholar guards with a robot check.
+
+Browsers are started on the first fallback fetch, and the rest of the pool
+is warmed up in the background while that page loads. Up to `size` pages
+are loaded at the same time, each in its own browser. Idle browsers are
+checked before they are reused and replaced when they stopped answering.
+
+Cookies of the aiohttp session are copied into the browsers before a page
+is loaded (see `share_cookies`), so Scholar sees the same visitor. When a
+headless browser still gets a captcha, a visible browser is opened for it
+to be solved by hand, one at a time, and its cookies are shared with the
+whole pool afterwards.
+
+    with BrowserPool(size=2, robot_kw=ROBOT_KW) as browsers:
+        content = browsers.fetch(url)  # bytes, from any thread
+"""
+from urllib.parse import urlsplit
+import atexit
+import queue
+import threading
+
+POOL_SIZE = 2  # Browsers loading pages at the same time
+PAGE_TIMEOUT = 10  # Seconds to wait for the page body
+WARM_UP_URL = 'about:blank'
+
+
+def default_factory(headless=True):
+    from sortgs.sortgs import setup_driver
+    return setup_driver(headless=headless)
+
+
+def load_page(driver, url, robot_kw=(), timeout=PAGE_TIMEOUT, reload=True):
+    """Returns the body of `url` as bytes, and whether it is a robot check."""
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support import expected_conditions as EC
+    from selenium.webdriver.support.ui import WebDriverWait
+
+    if reload:
+        driver.get(url)
+    # Wait for a specific element that indicates the page has loaded
+    WebDriverWait(driver, timeout).until(EC.presence_of_element_located((By.TAG_NAME, 'body')))
+    el = driver.find_element(By.TAG_NAME, 'body')
+    content = el.get_attribute('innerHTML')
+    return content.encode('utf-8'), any(kw in el.text for kw in robot_kw)
+
+
+class BrowserPool:
+    """
+    Thread-safe pool of at most `size` headless browsers.
+
+    `factory(headless)` returns a new Selenium driver. With `interactive`
+    off, robot-check pages are returned as they are instead of asking for
+    the captcha to be solved.
+    """
+
+    def __init__(self, size=POOL_SIZE, robot_kw=(), interactive=True, factory=None, timeout=PAGE_TIMEOUT):
+        if size < 1:
+            raise ValueError('size must be at least 1')
+        self.size = size
+        self.robot_kw = list(robot_kw)
+        self.interactive = interactive
+        self.factory = factory or default_factory
+        self.timeout = timeout
+        self._idle = queue.LifoQueue()  # The most recently used browsers first
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._drivers = []
+        self._starting = 0
+        self._cookies = {}  # {(domain, name): value}
+        self._version = 0  # Bumped when the cookies change
+        self._synced = {}  # {id(driver): cookie version it has}
+        self._visible = None
+        self._solve_lock = threading.Lock()
+        self._closed = False
+        atexit.register(self.close)
+
+    def __call__(self, url):
+        return self.fetch(url)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    @property
+    def started(self):
+        """Number of browsers running."""
+        with self._lock:
+            return len(self._drivers)
+
+    def share_cookies(self, url, cookies):
+        """Sets `cookies` ({name: value}) for the domain of `url` in every browser of the pool."""
+        self._set_cookies(urlsplit(url).hostname, cookies)
+
+    def _set_cookies(self, domain, cookies):
+        with self._lock:
+            for name, value in cookies.items():
+                if self._cookies.get((domain, name)) != value:
+                    self._cookies[(domain, name)] = value
+                    self._version += 1
+
+    def warm_up(self):
+        """Starts browsers in the background until the pool is full."""
+        while self._reserve():
+            threading.Thread(target=self._start, daemon=True).start()
+
+    def _reserve(self):
+        """Books the start of a new browser, if the pool has room for it."""
+        with self._lock:
+            if self._closed or len(self._drivers) + self._starting >= self.size:
+                return False
+            self._starting += 1
+            return True
+
+    def _start(self, idle=True):
+        try:
+            driver = self.factory(headless=True)
+            driver.get(WARM_UP_URL)
+        except Exception as e:
+            with self._lock:
+                self._starting -= 1
+            if idle:
+                print(f'Browser could not start: {e}')
+                return None
+            raise
+        with self._lock:
+            self._starting -= 1
+            self._drivers.append(driver)
+            closed = self._closed
+        if closed:
+            self._discard(driver)
+            return None
+        if idle:
+            self._idle.put(driver)
+        return driver
+
+    def _healthy(self, driver):
+        try:
+            driver.execute_script('return 1')
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, driver):
+        with self._lock:
+            if driver in self._drivers:
+                self._drivers.remove(driver)
+            self._synced.pop(id(driver), None)
+        try:
+            driver.quit()
+        except Exception:
+            pass
+
+    def _acquire(self):
+        while True:
+            try:
+                driver = self._idle.get_nowait()
+            except queue.Empty:
+                if self._reserve():
+                    driver = self._start(idle=False)
+                    self.warm_up()
+                    return driver
+                # Another browser is starting or in use, wait for it
+                try:
+                    driver = self._idle.get(timeout=1)
+                except queue.Empty:
+                    continue  # It may have failed to start
+            if self._healthy(driver):
+                return driver
+            self._discard(driver)
+
+    def _sync_cookies(self, driver, url):
+        with self._lock:
+            if self._synced.get(id(driver)) == self._version:
+                return
+            cookies = list(self._cookies.items())
+            version = self._version
+        for (domain, name), value in cookies:
+            driver.execute_cdp_cmd('Network.setCookie', {'name': name, 'value': value, 'domain': domain, 'path': '/'})
+        with self._lock:
+            self._synced[id(driver)] = version
+
+    def fetch(self, url):
+        """Returns the content of `url` (bytes) loaded in one of the browsers."""
+        if self._closed:
+            raise RuntimeError('The browser pool is closed')
+        with self._slots:
+            driver = self._acquire()
+            try:
+                self._sync_cookies(driver, url)
+                content, robot = load_page(driver, url, self.robot_kw, self.timeout)
+            except Exception:
+                self._discard(driver)
+                raise
+            self._idle.put(driver)
+        if robot and self.interactive:
+            content = self._solve(url)
+        return content
+
+    def _solve(self, url):
+        """Loads `url` in a visible browser until its captcha is solved by hand."""
+        with self._solve_lock:
+            if self._visible is None:
+                self._visible = self.factory(headless=False)
+            driver = self._visible
+            content, robot = load_page(driver, url, self.robot_kw, self.timeout)
+            while robot:
+                input("Solve captcha manually and press enter here to continue...")
+                content, robot = load_page(driver, url, self.robot_kw, self.timeout, reload=False)
+            for cookie in driver.get_cookies():
+                self._set_cookies(cookie['domain'].lstrip('.'), {cookie['name']: cookie['value']})
+        return content
+
+    def close(self):
+        """Quits every browser of the pool."""
+        with self._lock:
+            self._closed = True
+            drivers = list(self._drivers)
+        if self._visible is not None:
+            drivers.append(self._visible)
+            self._visible = None
+        for driver in drivers:
+            self._discard(driver)
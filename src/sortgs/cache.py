@@ -0,0 +1,116 @@
+"""
+On-disk cache of Google Scholar result pages.
+
+Pages are stored gzip-compressed under the SHA-256 of their full URL, so
+re-running a keyword or resuming a run reads them back without a network
+round trip. Entries expire after a TTL. When the cache grows past its size
+limit, the least recently used pages are evicted first: the modification
+time of an entry records when it was stored and its access time when it
+was last read.
+"""
+import gzip
+import hashlib
+import os
+import tempfile
+import time
+
+PAGES_DIR = 'pages'
+PAGE_TTL = 24 * 3600  # Seconds a cached result page stays valid
+MAX_CACHE_SIZE = 200 * 2**20  # Bytes of compressed pages kept on disk
+EVICT_TO = 0.9  # Fraction of MAX_CACHE_SIZE left after an eviction, so it doesn't run on every write
+
+
+class PageCache:
+    """
+    Content-addressed cache of result pages.
+
+        cache = PageCache(cache_dir)
+        content = cache.get(url)  # None if missing or expired
+        cache.put(url, content)
+
+    With `refresh=True` cached pages are ignored but fresh pages are still
+    stored, which updates the cache.
+    """
+
+    def __init__(self, cache_dir, ttl=PAGE_TTL, max_size=MAX_CACHE_SIZE, refresh=False):
+        self.pages_dir = os.path.join(cache_dir, PAGES_DIR)
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self.hits = 0
+        self.misses = 0
+        self._size = None
+
+    def _path(self, url):
+        key = hashlib.sha256(url.encode('utf-8')).hexdigest()
+        return os.path.join(self.pages_dir, key[:2], key + '.gz')
+
+    def get(self, url):
+        """Returns the cached content of `url`, or None."""
+        path = self._path(url)
+        if self.refresh:
+            self.misses += 1
+            return None
+        try:
+            stored = os.stat(path).st_mtime
+            if time.time() - stored > self.ttl:
+                self.misses += 1
+                return None
+            with open(path, 'rb') as f:
+                content = gzip.decompress(f.read())
+            os.utime(path, (time.time(), stored))  # Mark as recently used
+        except (OSError, EOFError):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return content
+
+    def put(self, url, content):
+        """Stores the content of `url`, evicting old pages if the cache is full."""
+        path = self._path(url)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = gzip.compress(content)
+        size = self.size()
+        try:
+            size -= os.stat(path).st_size
+        except OSError:
+            pass
+
+        # Write to a temporary file first so readers never see a partial page
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+        self._size = size + len(data)
+
+        if self._size > self.max_size:
+            self.evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.pages_dir):
+            return
+        for shard in os.scandir(self.pages_dir):
+            if shard.is_dir():
+                for entry in os.scandir(shard.path):
+                    if entry.name.endswith('.gz'):
+                        yield entry
+
+    def size(self):
+        """Returns the total size of the cached pages, in bytes."""
+        if self._size is None:
+            self._size = sum(entry.stat().st_size for entry in self._entries())
+        return self._size
+
+    def evict(self):
+        """Removes least recently used pages until the cache is back under its size limit."""
+        entries = sorted(((entry.stat().st_atime, entry.stat().st_size, entry.path) for entry in self._entries()))
+        size = sum(entry_size for _, entry_size, _ in entries)
+        for _, entry_size, path in entries:
+            if size <= self.max_size * EVICT_TO:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            size -= entry_size
+        self._size = size
@@ -0,0 +1,520 @@
+"""
+Library interface of sortgs.
+
+    import sortgs
+    df = sortgs.search('machine learning', nresults=50)
+
+    async for paper in sortgs.asearch('machine learning', nresults=50):
+        print(paper.rank, paper.title)
+
+A `ScholarClient` keeps its HTTP session, rate limit and caches open between
+searches, so a long-lived process only pays for them once:
+
+    async with sortgs.ScholarClient(rate=1) as client:
+        df = await client.asearch_frame('machine learning')
+        async for paper in client.asearch('deep learning'):
+            ...
+
+    with sortgs.ScholarClient() as client:  # Blocking calls
+        df = client.search('machine learning')
+
+The command line runs its searches through the same client.
+"""
+from contextlib import AsyncExitStack
+import asyncio
+import os
+
+from sortgs import sortgs as cli
+from sortgs.cache import PageCache
+from sortgs.dedup import DiskPaperIndex, PaperIndex, paper_keys
+from sortgs.downloads import MAX_STATUS, NO_LINK, DownloadPipeline
+from sortgs.fetcher import PageFetcher
+from sortgs.localindex import INDEX_FNAME, LocalIndex
+from sortgs.metrics import metrics
+from sortgs.parser import ParsePool, get_total_results
+from sortgs.pdfstore import PdfStore, STORE_DNAME
+from sortgs.planner import FIRST_YEAR, RESULTS_PER_PAGE, allocate, bisect_slices, year_slices
+from sortgs.ratecontrol import MAX_RATE, STATE_FNAME, RateController
+from sortgs.records import Paper, PaperTable
+from sortgs.resolver import CACHE_FNAME, LinkResolver
+
+
+class Search:
+    """
+    Papers found by a search of one or more keywords.
+
+    A search runs queries, a keyword and a year range each, with '' as the
+    range when the years are not split (see sortgs.planner). Papers found by
+    several queries keep the ID of their first result.
+
+    Without `keep_papers`, papers are numbered and ranked but not kept, for
+    crawls whose results go straight to the output files (see sortgs.sinks)
+    and must not be held in memory. `found` counts them either way.
+    """
+
+    def __init__(self, keywords, nresults=cli.NRESULTS, start_year=None, end_year=None, lang=cli.LANG, slices=None,
+                 keep_papers=True):
+        if isinstance(keywords, str):
+            keywords = [keywords]
+        self.keywords = list(dict.fromkeys(keywords))
+        self.nresults = nresults
+        self.start_year = start_year
+        self.end_year = end_year or cli.now.year
+        self.lang = lang
+        self.slices = slices
+        self.keep_papers = keep_papers
+        self.papers = PaperTable()
+        self.found = 0
+        # Large crawls keep the keys of the papers seen on disk
+        self.index = PaperIndex() if keep_papers else DiskPaperIndex()
+        self.budgets = None  # {query: number of results to fetch}, in crawl order
+        self.done = {}  # {query: number of results found}
+        self._order = {}  # {query: (number of queries of its keyword, position)}
+        self._next_id = 1
+        self.known = {}  # {ID: Paper} of an earlier output being refreshed
+        self._untitled = {}  # {(author, source): ID} of known papers without a title
+
+    def set_budgets(self, budgets):
+        self.budgets = budgets
+        self.done = dict.fromkeys(budgets, 0)
+        for keyword in self.keywords:
+            queries = [query for query in budgets if query[0] == keyword]
+            for i, query in enumerate(queries):
+                self._order[query] = (len(queries), i)
+
+    def add(self, paper):
+        """Gives `paper` its ID and its rank within its query, and keeps it."""
+        if paper.id is None:
+            paper.id = self.index.find(paper.title, paper.year, paper.source)
+        if paper.id is None:
+            paper.id = f'paper_{self._next_id:04d}'
+        self._next_id = max(self._next_id, int(paper.id.split('_')[-1]) + 1)
+        self.index.add(paper.id, paper.title, paper.year, paper.source)
+        self.done[paper.query] += 1
+        paper.rank = self.done[paper.query]
+        self.found += 1
+        if self.keep_papers:
+            self.papers.append(paper)
+
+    def replay(self, rows):
+        """Adds the papers of checkpoint rows and returns them. Rows of queries not planned are skipped."""
+        papers = []
+        for row in rows:
+            paper = Paper.from_row(row, keyword=self.keywords[0])
+            if paper.query in self.budgets:
+                self.add(paper)
+                papers.append(paper)
+        return papers
+
+    def load_known(self, rows):
+        """
+        Loads the rows of an earlier output of the search. Papers found again
+        keep their ID and download link, and their link is not resolved nor
+        their PDF downloaded again.
+        """
+        for row in rows:
+            paper = Paper.from_row(row, keyword=self.keywords[0])
+            self.known[paper.id] = paper
+            self.index.add(paper.id, paper.title, paper.year, paper.source)
+            if not paper_keys(paper.title, paper.year, paper.source):
+                # Only its authors and the page it was found on tell it apart
+                self._untitled.setdefault((paper.author, paper.source), paper.id)
+            self._next_id = max(self._next_id, int(paper.id.split('_')[-1]) + 1)
+
+    def find_known(self, record):
+        """Returns the known paper of a parsed record, or None."""
+        if not self.known:
+            return None
+        paper_id = self.index.find(record['title'], record['year'], record['link'])
+        if paper_id is None:
+            paper_id = self._untitled.pop((record['author'], record['link']), None)
+        return self.known.get(paper_id)
+
+    def interleaved_rank(self, paper):
+        """
+        Rank of `paper` among the results of its keyword. The year ranges of a
+        keyword are interleaved: the first result of every range, then the
+        second, and so on.
+        """
+        n_queries, i = self._order[paper.query]
+        return (paper.rank - 1) * n_queries + i + 1
+
+    def row(self, paper):
+        """Returns the output row of `paper`, before repeated papers are dropped."""
+        row = paper.to_row()
+        row['Rank'] = self.interleaved_rank(paper)
+        # Avoid years that are higher than the end year
+        row['cit/year'] = round(paper.citations / (self.end_year + 1 - min(paper.year, self.end_year)))
+        return row
+
+    def to_frame(self):
+        """
+        Returns the results of every keyword, indexed by rank, with each paper
+        once per keyword. The integer columns share memory with the papers, so
+        only call it once the search is over.
+        """
+        data = self.papers.to_frame()
+        data['Rank'] = [self.interleaved_rank(paper) for paper in self.papers]
+        data = data.sort_values('Rank', kind='stable').drop_duplicates(['Keyword', 'ID'])
+        data['Rank'] = data.groupby('Keyword').cumcount() + 1
+        if self.slices:
+            data = data[data['Rank'] <= self.nresults]
+        data = data.drop(columns='Slice').set_index('Rank')
+
+        data['cit/year'] = data['Citations'] / (self.end_year + 1 - data['Year'].clip(upper=self.end_year))
+        data['cit/year'] = data['cit/year'].round(0).astype(int)
+        return data
+
+
+class ScholarClient:
+    """
+    Searches Google Scholar over a shared session, rate limit and caches.
+
+    Pages are cached in `cache_dir` for `cache_ttl` hours (0 disables the
+    page cache). PDFs are only downloaded when a `pdf_dir` is given. When
+    Scholar answers with a robot check, `fallback(url)` is run in a thread
+    and its bytes are used instead, see sortgs.fetcher.PageFetcher, by up
+    to `fallback_concurrency` threads; sortgs.browser.BrowserPool is meant
+    for it.
+
+    Requests start at `rate` pages per second, or at the rate reached by
+    the last run, and adapt to Scholar's answers up to `max_rate` unless
+    `adaptive` is off (see sortgs.ratecontrol). `controller.metrics` counts
+    the requests and throttled answers.
+
+    Pages are parsed by `parse_workers` threads or processes while the next
+    ones are fetched (see sortgs.parser.ParsePool), 0 parses them on the
+    event loop. By default, threads parse the pages when selectolax is
+    installed, and the event loop otherwise.
+
+    Every paper found and the results of every query are kept in the
+    index of `cache_dir` (see sortgs.localindex). With `index_ttl`, queries
+    whose results were recorded less than `index_ttl` hours ago are answered
+    from the index instead of Scholar.
+
+    With `low_memory`, the download status of only the last MAX_STATUS
+    papers is kept (see sortgs.downloads.DownloadPipeline), for crawls whose
+    papers aren't kept either (see Search).
+    """
+
+    def __init__(self, max_concurrency=cli.MAX_CONCURRENCY, rate=None, max_rate=MAX_RATE, adaptive=True,
+                 cache_dir=cli.CACHE_DIR, cache_ttl=cli.CACHE_TTL, refresh=False, pdf_dir=None, fallback=None,
+                 fallback_concurrency=1, parse_workers=None, index_ttl=None, low_memory=False,
+                 debug=False):
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.max_rate = max_rate
+        self.adaptive = adaptive
+        self.cache_dir = cache_dir
+        self.cache_ttl = cache_ttl
+        self.refresh = refresh
+        self.pdf_dir = pdf_dir
+        self.fallback = fallback
+        self.fallback_concurrency = fallback_concurrency
+        self.parse_workers = parse_workers
+        self.index_ttl = index_ttl
+        self.low_memory = low_memory
+        self.debug = debug
+        self.index = None
+        self.fetcher = None
+        self.parser = None
+        self.downloads = None
+        self.resolver = None
+        self.controller = None  # Created on the event loop of the first search, kept for the next ones
+        self._stack = None
+        self._loop = None  # Event loop of the blocking calls
+        self._store = None
+        self._downloading = {}  # {ID: Paper} queued for download, whose PDF hash goes to the index
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self._loop is not None:
+            self._loop.run_until_complete(self.close())
+            self._loop.close()
+            self._loop = None
+
+    async def open(self):
+        if self._stack is not None:
+            return
+        page_cache = None
+        if self.cache_ttl > 0:
+            page_cache = PageCache(self.cache_dir, ttl=self.cache_ttl * 3600, refresh=self.refresh)
+        if self.controller is None:
+            self.controller = RateController.load(os.path.join(self.cache_dir, STATE_FNAME), rate=self.rate,
+                                                  max_rate=self.max_rate, adaptive=self.adaptive)
+        self._stack = AsyncExitStack()
+        self.index = self._stack.enter_context(LocalIndex(os.path.join(self.cache_dir, INDEX_FNAME)))
+        self.parser = self._stack.enter_context(ParsePool(self.parse_workers))
+        self.fetcher = await self._stack.enter_async_context(
+            PageFetcher(max_concurrency=self.max_concurrency, robot_kw=cli.ROBOT_KW, fallback=self.fallback,
+                        fallback_concurrency=self.fallback_concurrency, cache=page_cache, controller=self.controller))
+        if self.pdf_dir is not None:
+            self._store = PdfStore(os.path.join(self.cache_dir, STORE_DNAME))
+            self.downloads = await self._stack.enter_async_context(
+                DownloadPipeline(self.pdf_dir, store=self._store, max_status=MAX_STATUS if self.low_memory else None,
+                                 on_done=self._index_pdf))
+        # Landing pages don't queue behind the PDF downloads for a connection
+        self.resolver = await self._stack.enter_async_context(
+            LinkResolver(cache_path=os.path.join(self.cache_dir, CACHE_FNAME)))
+
+    async def close(self):
+        """Closes the sessions, after the pending PDF downloads are done, and saves the rate reached."""
+        if self._stack is not None:
+            await self._stack.aclose()
+            self.controller.save()
+            self._stack = None
+            self.fetcher = self.downloads = self.resolver = self.parser = self.index = None
+
+    async def _submit(self, paper):
+        """Queues the PDF of `paper` for download."""
+        if paper.id in self._downloading:
+            return
+        # Kept before it is queued, as a stored PDF may be done before submit returns
+        self._downloading[paper.id] = paper
+        if not await self.downloads.submit(paper.id, paper.title, paper.download_link):
+            del self._downloading[paper.id]
+
+    def _index_pdf(self, paper_id, download_link, downloaded):
+        # The index is closed after the downloads are over
+        paper = self._downloading.pop(paper_id, None)
+        entry = self._store.lookup(download_link) if downloaded else None
+        if paper is not None and entry is not None:
+            self.index.set_pdfs([(paper, entry['sha256'])])
+
+    def query_params(self, search, query):
+        """Returns the keyword, start year, end year and languages of `query`."""
+        keyword, key = query
+        if key:
+            start_year, end_year = (int(year) for year in key.split('-'))
+        else:
+            start_year, end_year = search.start_year, search.end_year
+        return keyword, start_year, end_year, search.lang
+
+    def query_url(self, search, query, n):
+        """Returns the URL of the result page of `query` starting at result `n`."""
+        keyword, start_year, end_year, lang = self.query_params(search, query)
+        url_template = cli.get_url_template(start_year, end_year, lang, self.debug)
+        return url_template.format(str(n), keyword.replace(' ', '+'))
+
+    async def plan(self, search):
+        """Sets the number of results to fetch for every query of `search`."""
+        if search.slices is None:
+            search.set_budgets({(keyword, ''): search.nresults for keyword in search.keywords})
+            return
+
+        budgets = {}
+        for keyword in search.keywords:
+            if search.slices == 'year':
+                keyword_slices = year_slices(search.start_year, search.end_year)
+            else:
+                async def count_results(start_year, end_year):
+                    content = await self.fetcher.fetch(self.query_url(search, (keyword, f'{start_year}-{end_year}'), 0))
+                    return get_total_results(content)
+                keyword_slices = await bisect_slices(search.start_year or FIRST_YEAR, search.end_year, count_results)
+            print(f"Searching {keyword} in {len(keyword_slices)} year ranges: {', '.join(s.key for s in keyword_slices)}")
+            for year_slice, budget in zip(keyword_slices, allocate(keyword_slices, search.nresults)):
+                budgets[(keyword, year_slice.key)] = budget
+        search.set_budgets(budgets)
+
+    async def crawl(self, search):
+        """
+        Yields the list of new papers of every result page of `search`.
+
+        Pages of all queries are fetched concurrently but handed over in
+        order, one page of every query in turn, so that year ranges are
+        crawled together. A query stops at its first page that isn't full.
+        Queries already partly done, e.g. replayed from a checkpoint, go on
+        from their last result. With `index_ttl`, queries found in the index
+        are handed over first, a page each, and not fetched.
+        """
+        await self.open()
+        if search.budgets is None:
+            with metrics.timer('plan'):
+                await self.plan(search)
+
+        exhausted = set()
+        from_index = set()
+        if self.index_ttl is not None:
+            for query, budget in search.budgets.items():
+                if search.done[query] == 0:
+                    page = await self._from_index(search, query, budget)
+                    if page is not None:
+                        from_index.add(query)
+                        exhausted.add(query)
+                        yield page
+
+        resume_from = dict(search.done)
+        url_queries = {}
+
+        def plan_urls():
+            for n in range(0, max(search.budgets.values(), default=0), RESULTS_PER_PAGE):
+                for query, budget in search.budgets.items():
+                    if resume_from[query] <= n < budget and query not in exhausted:
+                        url = self.query_url(search, query, n)
+                        url_queries[url] = query
+                        yield url
+
+        async def parse(content, url):
+            with metrics.timer('parse'):
+                return await self.parser.parse(content, url)
+
+        # Pages are parsed in the workers while the links of earlier pages are resolved
+        async for url, records in self.fetcher.iter_pages(plan_urls(), parse=parse):
+            if self.debug:
+                print("Opening URL:", url)
+            keyword, key = url_queries.pop(url)
+
+            metrics.count('results_parsed', len(records))
+            if len(records) < RESULTS_PER_PAGE:
+                exhausted.add((keyword, key))
+            known = [search.find_known(record) for record in records]
+            # Resolve the PDF links behind 'HTML' badges of the new papers of the page concurrently
+            download_links = await asyncio.gather(*(self._download_link(record, paper)
+                                                    for record, paper in zip(records, known)))
+
+            page = []
+            for record, known_paper, download_link in zip(records, known, download_links):
+                paper_id = known_paper.id if known_paper is not None else None
+                paper = Paper(paper_id, record['author'], record['title'], record['citations'], record['year'],
+                              record['publisher'], record['venue'], record['link'], download_link, 0, keyword, key)
+                search.add(paper)
+                if self.downloads is not None and known_paper is None:
+                    await self._submit(paper)
+                page.append(paper)
+            with metrics.timer('index'):
+                self.index.add_papers(page)
+            yield page
+
+        # The results of the queries are complete
+        with metrics.timer('index'):
+            self.record_queries(search, exhausted, skip=from_index)
+
+    def record_queries(self, search, exhausted, skip=()):
+        """
+        Records the results of the queries of `search` in the index, but those
+        of `skip`. Nothing is recorded for searches that don't keep their papers.
+        """
+        if not search.keep_papers:
+            return
+        results = {query: [] for query in search.budgets if query not in skip}
+        for paper in search.papers:
+            if paper.query in results:
+                results[paper.query].append(paper)
+        for query, papers in results.items():
+            self.index.record_query(*self.query_params(search, query), papers, exhausted=query in exhausted)
+
+    async def resume(self, search, rows):
+        """
+        Adds the papers of checkpoint rows to `search` and returns them, see
+        Search.replay. Their PDFs that weren't downloaded when the rows were
+        saved are queued again.
+        """
+        await self.open()
+        papers = search.replay(rows)
+        if self.downloads is not None:
+            statuses = {row['ID']: row.get('Download Status') for row in rows}
+            for paper in papers:
+                if statuses.get(paper.id) not in (True, NO_LINK):
+                    await self._submit(paper)
+        return papers
+
+    async def _from_index(self, search, query, budget):
+        """Adds the papers of `query` recorded in the index to `search` and returns them, or None."""
+        with metrics.timer('index'):
+            found = self.index.lookup(*self.query_params(search, query), budget, self.index_ttl * 3600)
+        if found is None:
+            return None
+        metrics.count('results_from_index', len(found))
+        page = []
+        for paper, pdf_sha256 in found:
+            paper.slice = query[1]
+            search.add(paper)
+            if self.downloads is not None:
+                # The PDF is only downloaded if the store lost it
+                if pdf_sha256 is None or not self.downloads.reuse(paper.id, pdf_sha256):
+                    await self._submit(paper)
+            page.append(paper)
+        return page
+
+    async def fetch_records(self, url):
+        """Returns the records of one result page, with the PDF links behind 'HTML' badges resolved."""
+        await self.open()
+        content = await self.fetcher.fetch(url)
+        with metrics.timer('parse'):
+            records = await self.parser.parse(content, url)
+        metrics.count('results_parsed', len(records))
+        download_links = await asyncio.gather(*(self._download_link(record, None) for record in records))
+        for record, download_link in zip(records, download_links):
+            record['download_link'] = download_link
+        return records
+
+    async def _download_link(self, record, known_paper):
+        if known_paper is not None:
+            return known_paper.download_link
+        with metrics.timer('resolve'):
+            return await cli.get_download_link(self.resolver, record)
+
+    async def asearch(self, keywords, nresults=cli.NRESULTS, start_year=None, end_year=None, lang=cli.LANG,
+                      slices=None):
+        """
+        Yields the papers found for `keywords` (a keyword or a list) as soon as
+        their page is parsed. A paper found again by the same keyword is not
+        yielded twice. `rank` is the rank of a paper within its query.
+        """
+        search = Search(keywords, nresults, start_year, end_year, lang, slices)
+        seen = set()
+        async for page in self.crawl(search):
+            for paper in page:
+                if (paper.keyword, paper.id) not in seen:
+                    seen.add((paper.keyword, paper.id))
+                    yield paper
+
+    async def asearch_frame(self, keywords, nresults=cli.NRESULTS, start_year=None, end_year=None, lang=cli.LANG,
+                            slices=None, sortby=cli.SORTBY):
+        """
+        Returns the results of `keywords` as a DataFrame indexed by rank and
+        sorted by the `sortby` column, like the saved CSV. A list of keywords
+        adds a Keyword column.
+        """
+        search = Search(keywords, nresults, start_year, end_year, lang, slices)
+        async for _ in self.crawl(search):
+            pass
+        data = search.to_frame()
+        if isinstance(keywords, str):
+            data = data.drop(columns='Keyword')
+        return cli.sort_results(data, sortby)
+
+    def search(self, keywords, **kwargs):
+        """Blocking form of `asearch_frame`. The client stays open between calls, until the with block ends."""
+        if self._loop is None:
+            self._loop = asyncio.new_event_loop()
+        return self._loop.run_until_complete(self.asearch_frame(keywords, **kwargs))
+
+
+def search(keywords, nresults=cli.NRESULTS, start_year=None, end_year=None, lang=cli.LANG, slices=None,
+           sortby=cli.SORTBY, **client_args):
+    """
+    Searches `keywords` and returns the results as a DataFrame. `client_args`
+    are passed to ScholarClient; use a ScholarClient directly to keep it
+    open across searches.
+    """
+    with ScholarClient(**client_args) as client:
+        return client.search(keywords, nresults=nresults, start_year=start_year, end_year=end_year, lang=lang,
+                             slices=slices, sortby=sortby)
+
+
+async def asearch(keywords, nresults=cli.NRESULTS, start_year=None, end_year=None, lang=cli.LANG, slices=None,
+                  **client_args):
+    """Yields the papers found for `keywords` as they are parsed, see ScholarClient.asearch."""
+    async with ScholarClient(**client_args) as client:
+        async for paper in client.asearch(keywords, nresults, start_year, end_year, lang, slices):
+            yield paper
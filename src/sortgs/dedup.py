@@ -0,0 +1,83 @@
+"""
+Deduplication of papers returned by several queries.
+
+A paper is identified by its normalized title and year, and by its source
+URL. Two results sharing either key are the same paper, so it keeps a single
+ID and its PDF is only downloaded once.
+
+`PaperIndex` keeps the keys in memory, `DiskPaperIndex` in a temporary
+SQLite database, for crawls too large to hold a key per paper in memory.
+"""
+import json
+import re
+import sqlite3
+import unicodedata
+
+NON_ALNUM_RE = re.compile(r'[^0-9a-z]+')
+
+
+def normalize_title(title):
+    """Lowercases `title` and drops accents, punctuation and extra spaces."""
+    title = unicodedata.normalize('NFKD', title)
+    title = ''.join(c for c in title if not unicodedata.combining(c))
+    return NON_ALNUM_RE.sub(' ', title.lower()).strip()
+
+
+def paper_keys(title, year, link):
+    """Returns the keys identifying a paper, skipping placeholder values."""
+    keys = []
+    if title and title != 'Could not catch title':
+        normalized = normalize_title(title)
+        if normalized:
+            keys.append(('title', normalized, year))
+    if link and link.startswith(('http://', 'https://')):
+        keys.append(('link', link))
+    return keys
+
+
+class PaperIndex:
+    """
+    Maps papers already seen to their ID.
+
+        index = PaperIndex()
+        paper_id = index.find(title, year, link)  # None for a new paper
+        index.add(paper_id, title, year, link)
+    """
+
+    def __init__(self):
+        self._ids = {}
+
+    def find(self, title, year, link):
+        for key in paper_keys(title, year, link):
+            if key in self._ids:
+                return self._ids[key]
+        return None
+
+    def add(self, paper_id, title, year, link):
+        # Keys not seen yet also point to the paper, so a later result can
+        # match it through either its title or its URL
+        for key in paper_keys(title, year, link):
+            self._ids.setdefault(key, paper_id)
+
+
+class DiskPaperIndex:
+    """PaperIndex kept in a temporary SQLite database, which SQLite removes once closed."""
+
+    def __init__(self):
+        # An empty name opens a private database on disk, with a bounded page cache
+        self.db = sqlite3.connect('')
+        self.db.execute('CREATE TABLE ids (key TEXT PRIMARY KEY, id TEXT NOT NULL) WITHOUT ROWID')
+
+    def close(self):
+        self.db.close()
+
+    def find(self, title, year, link):
+        for key in paper_keys(title, year, link):
+            row = self.db.execute('SELECT id FROM ids WHERE key = ?', (json.dumps(key),)).fetchone()
+            if row is not None:
+                return row[0]
+        return None
+
+    def add(self, paper_id, title, year, link):
+        self.db.executemany('INSERT OR IGNORE INTO ids VALUES (?, ?)',
+                            [(json.dumps(key), paper_id) for key in paper_keys(title, year, link)])
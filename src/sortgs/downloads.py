@@ -0,0 +1,383 @@
+"""
+PDF download pipeline.
+
+A single aiohttp session, with one pooled connector, lives for the whole run.
+Parsed papers are put in a bounded queue and a pool of workers downloads
+them in the background while the scraper moves on to the next result page.
+PDFs go to a content-addressed store (see sortgs.pdfstore), so a PDF
+already downloaded by an earlier run or query costs a conditional request.
+"""
+from collections import deque
+import asyncio
+import hashlib
+import os
+
+import aiohttp
+from aiofiles import open as aio_open
+
+from sortgs.metrics import metrics
+from sortgs.pdfstore import PdfStore
+
+MAX_RETRIES = 4
+RETRY_DELAY = 2
+DOWNLOAD_WORKERS = 8  # Concurrent PDF downloads
+LIMIT_PER_HOST = 2  # Concurrent connections to the same host
+QUEUE_SIZE = 100  # Papers waiting to be downloaded before the scraper is paused
+CHUNK_SIZE = 64 * 1024  # Bytes read from the network at a time
+WRITE_BUFFER = 1024 * 1024  # Bytes collected before each write to disk
+MAX_PDF_SIZE = 200 * 2**20  # Larger downloads are dropped
+MAX_IN_FLIGHT = 16 * 2**20  # Bytes held in write buffers by all downloads together
+MAX_STATUS = 10000  # Statuses of finished downloads kept by low memory runs
+# Time out on a stalled connection rather than on the total time, which large PDFs may need
+DOWNLOAD_TIMEOUT = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=10)
+
+STORE_DIR = '.store'  # Store inside the PDF folder, when none is given
+
+PENDING = 'Pending'
+NO_LINK = 'No Link'
+
+
+class PdfTooLarge(Exception):
+    pass
+
+
+class ByteBudget:
+    """
+    Caps the number of bytes held in memory by all downloads together.
+
+    A single reservation larger than the whole budget is let through when
+    nothing else is reserved, so it can't wait forever.
+    """
+
+    def __init__(self, limit=MAX_IN_FLIGHT):
+        self.limit = limit
+        self.in_flight = 0
+        self._released = asyncio.Condition()
+
+    def try_acquire(self, size):
+        if self.in_flight and self.in_flight + size > self.limit:
+            return False
+        self.in_flight += size
+        return True
+
+    async def acquire(self, size):
+        async with self._released:
+            await self._released.wait_for(lambda: self.try_acquire(size))
+
+    async def release(self, size):
+        async with self._released:
+            self.in_flight -= size
+            self._released.notify_all()
+
+
+class BufferedFileWriter:
+    """
+    Writes a download to disk in large blocks.
+
+    Chunks are collected in a reusable buffer and written once it holds
+    `buffer_size` bytes, so a large PDF costs a few hundred writes (each a
+    thread-pool hop with aiofiles) instead of one per network chunk. The
+    buffered bytes are reserved from `budget`; a writer that has to wait for
+    the budget writes its own buffer out first, so writers never wait on
+    each other's unwritten data.
+    """
+
+    def __init__(self, file, digest, budget=None, buffer_size=WRITE_BUFFER, max_size=MAX_PDF_SIZE, size=0):
+        self.file = file
+        self.digest = digest
+        self.budget = budget
+        self.buffer_size = buffer_size
+        self.max_size = max_size
+        self.size = size
+        self._buffer = bytearray()
+
+    async def write(self, chunk):
+        self.size += len(chunk)
+        if self.size > self.max_size:
+            raise PdfTooLarge(f'PDF larger than {self.max_size} bytes')
+        if self.budget is not None and not self.budget.try_acquire(len(chunk)):
+            await self.flush()
+            await self.budget.acquire(len(chunk))
+        self.digest.update(chunk)
+        self._buffer += chunk
+        if len(self._buffer) >= self.buffer_size:
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer:
+            return
+        try:
+            await self.file.write(self._buffer)
+            metrics.count('pdf_bytes', len(self._buffer))
+        finally:
+            await self.discard()
+
+    async def discard(self):
+        """Drops the buffered bytes without writing them."""
+        if self.budget is not None and self._buffer:
+            await self.budget.release(len(self._buffer))
+        self._buffer.clear()
+
+
+def parse_content_range(value):
+    """Returns (start, total size) from a 'bytes start-end/total' header, None when unknown."""
+    try:
+        _, _, rest = value.partition(' ')
+        first_byte, total = rest.split('-')[0], rest.rsplit('/', 1)[-1]
+        return int(first_byte), int(total) if total.isdigit() else None
+    except (AttributeError, ValueError):
+        return None, None
+
+
+def _link(store, sha256, path):
+    if path is not None:
+        store.link(sha256, path)
+
+
+async def fetch_pdf(session, url, path, store, budget=None, chunk_size=CHUNK_SIZE, max_size=MAX_PDF_SIZE):
+    """
+    Downloads `url` into the store and links it to `path`, unless `path` is None.
+
+    Returns True once the PDF is stored, False if the URL doesn't serve a
+    PDF, and None if the download is incomplete and should be retried. The
+    partial file is kept, so the next attempt resumes where this one stopped.
+    PDFs larger than `max_size` are dropped.
+    """
+    headers = {}
+    known = store.lookup(url)
+    if known is not None:
+        if not known.get('etag') and not known.get('last_modified'):
+            # Nothing to revalidate with, PDFs hardly ever change
+            _link(store, known['sha256'], path)
+            print(f"Reused stored PDF: {path or url}")
+            return True
+        if known.get('etag'):
+            headers['If-None-Match'] = known['etag']
+        if known.get('last_modified'):
+            headers['If-Modified-Since'] = known['last_modified']
+
+    partial = store.partial(url)
+    offset = partial.size
+    if offset and partial.validator:
+        headers['Range'] = f'bytes={offset}-'
+        headers['If-Range'] = partial.validator
+
+    async with session.get(url, timeout=DOWNLOAD_TIMEOUT, headers=headers) as response:
+        if response.status == 304 and known is not None:
+            _link(store, known['sha256'], path)
+            print(f"PDF not modified: {path or url}")
+            return True
+        if response.status == 416:
+            partial.remove()  # Saved part doesn't match the file anymore, start over
+            return None
+        if response.status >= 500:
+            response.raise_for_status()
+        if response.status not in (200, 206):
+            print(f"Skipping non-PDF content: {url}")
+            return False
+
+        etag = response.headers.get('ETag')
+        last_modified = response.headers.get('Last-Modified')
+        if response.status == 206:
+            first_byte, total = parse_content_range(response.headers.get('Content-Range'))
+            if first_byte != offset:
+                partial.remove()
+                return None
+            digest = partial.sha256()
+            mode = 'ab'
+        else:
+            total = response.content_length
+            if total is not None and total > max_size:
+                print(f"Skipping PDF larger than {max_size} bytes: {url}")
+                return False
+            partial.start(etag or last_modified)
+            offset = 0
+            digest = hashlib.sha256()
+            mode = 'wb'
+
+            # Detect PDFs from content, the Content-Type is often misleading
+            first_chunk = await response.content.read(1024)
+            if b"%PDF" not in first_chunk:
+                print(f"Skipping non-PDF content: {url}")
+                partial.remove()
+                return False
+
+        # The partial file is only moved into the store once it is complete
+        async with aio_open(partial.path, mode) as file:
+            writer = BufferedFileWriter(file, digest, budget, max_size=max_size, size=offset)
+            try:
+                if mode == 'wb':
+                    await writer.write(first_chunk)
+                async for chunk in response.content.iter_chunked(chunk_size):
+                    await writer.write(chunk)
+            except PdfTooLarge:
+                print(f"Skipping PDF larger than {max_size} bytes: {url}")
+                await writer.discard()
+                partial.remove()
+                return False
+            finally:
+                # Keep what was received, a later attempt resumes after it
+                await writer.flush()
+
+    # A PDF ends with %%EOF, possibly followed by a line break
+    size = partial.size
+    if total is not None and size != total:
+        print(f"Incomplete download of {url}: {size} of {total} bytes")
+        return None
+    if b'%%EOF' not in partial.tail():
+        if total is not None:
+            print(f"Skipping invalid PDF: {url}")
+            partial.remove()
+            return False
+        print(f"Incomplete download of {url}: no end of file marker")
+        return None
+
+    entry = store.add(url, partial, digest.hexdigest(), etag, last_modified)
+    _link(store, entry['sha256'], path)
+    print(f"Downloaded PDF: {path or url}")
+    return True
+
+
+async def download_pdf_async(session, url, path, store, **kwargs):
+    """
+    Downloads the PDF asynchronously from a URL to the specified path, with retries.
+    Keyword arguments are passed on to fetch_pdf.
+    """
+    with metrics.timer('download'):
+        for attempt in range(MAX_RETRIES):
+            try:
+                downloaded = await fetch_pdf(session, url, path, store, **kwargs)
+                if downloaded is not None:
+                    metrics.count('pdfs_saved' if downloaded else 'pdfs_skipped')
+                    return downloaded
+            except aiohttp.ClientError as e:
+                print(f"Network error during attempt {attempt + 1} for {url}: {e}")
+            except asyncio.TimeoutError:
+                print(f"Timeout during attempt {attempt + 1} for {url}.")
+            except Exception as e:
+                print(f"Unexpected error during attempt {attempt + 1} for {url}: {e}")
+
+            if attempt < MAX_RETRIES - 1:
+                print(f"Retrying in {RETRY_DELAY} seconds...")
+                metrics.count('download_retries')
+                await asyncio.sleep(RETRY_DELAY)
+
+    print(f"Failed to download PDF from {url} after {MAX_RETRIES} attempts.")
+    metrics.count('pdfs_failed')
+    return False
+
+
+class DownloadPipeline:
+    """
+    Downloads PDFs in the background for the lifetime of a run.
+
+        async with DownloadPipeline(pdf_save_dir) as downloads:
+            await downloads.submit(paper_id, title, download_link)
+        downloads.status[paper_id]  # True, False or 'No Link'
+
+    Each paper ID is downloaded at most once. `submit` only blocks when
+    `queue_size` papers are already waiting, so scraping keeps going while
+    downloads run. Leaving the context waits for the queue to drain.
+
+    `store` is the PdfStore the files are kept in. By default it lives in a
+    hidden folder of `pdf_save_dir`. Downloads read `chunk_size` bytes at a
+    time, are dropped above `max_size` bytes and together hold at most
+    `max_in_flight` bytes in their write buffers.
+
+    `on_done(paper_id, download_link, downloaded)` is called after each
+    download. With `max_status`, only the status of the last `max_status`
+    finished papers is kept, so long runs don't hold one per paper; a paper
+    submitted again after its status was dropped is found in the store.
+    """
+
+    def __init__(self, pdf_save_dir, workers=DOWNLOAD_WORKERS, limit_per_host=LIMIT_PER_HOST,
+                 queue_size=QUEUE_SIZE, store=None, chunk_size=CHUNK_SIZE, max_size=MAX_PDF_SIZE,
+                 max_in_flight=MAX_IN_FLIGHT, max_status=None, on_done=None):
+        self.pdf_save_dir = pdf_save_dir
+        self.store = store or PdfStore(os.path.join(pdf_save_dir, STORE_DIR))
+        self.chunk_size = chunk_size
+        self.max_size = max_size
+        self.budget = ByteBudget(max_in_flight)
+        self.workers = workers
+        self.limit_per_host = limit_per_host
+        self.queue_size = queue_size
+        self.status = {}
+        self.max_status = max_status
+        self.on_done = on_done
+        self.session = None
+        self._queue = None
+        self._tasks = []
+        self._finished = deque()  # Papers with a final status, oldest first
+        self._url_locks = {}  # {download link: [lock, papers waiting for it]}
+
+    async def __aenter__(self):
+        os.makedirs(self.pdf_save_dir, exist_ok=True)
+        connector = aiohttp.TCPConnector(limit=self.workers, limit_per_host=self.limit_per_host,
+                                         ttl_dns_cache=300)
+        self.session = aiohttp.ClientSession(connector=connector)
+        self._queue = asyncio.Queue(maxsize=self.queue_size)
+        self._tasks = [asyncio.ensure_future(self._worker()) for _ in range(self.workers)]
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            await self._queue.join()
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        await self.session.close()
+
+    def get_status(self, paper_id):
+        return self.status.get(paper_id, PENDING)
+
+    def _set_status(self, paper_id, status):
+        self.status[paper_id] = status
+        if status != PENDING and self.max_status is not None:
+            self._finished.append(paper_id)
+            while len(self._finished) > self.max_status:
+                self.status.pop(self._finished.popleft(), None)
+
+    async def submit(self, paper_id, title, download_link):
+        """Queues a paper for download, unless it was already submitted. Returns True if it was queued."""
+        if paper_id in self.status:
+            return False
+        if not download_link:
+            print(f"No download link available for {title}.")
+            self._set_status(paper_id, NO_LINK)
+            return False
+        self.status[paper_id] = PENDING
+        await self._queue.put((paper_id, download_link))
+        return True
+
+    def reuse(self, paper_id, sha256):
+        """Gives a paper the stored PDF with hash `sha256` instead of downloading it. False if it isn't stored."""
+        if paper_id in self.status:
+            return True
+        if not os.path.exists(self.store.object_path(sha256)):
+            return False
+        self.store.link(sha256, os.path.join(self.pdf_save_dir, f"{paper_id}.pdf"))
+        self._set_status(paper_id, True)
+        return True
+
+    async def _worker(self):
+        while True:
+            paper_id, download_link = await self._queue.get()
+            try:
+                pdf_save_path = os.path.join(self.pdf_save_dir, f"{paper_id}.pdf")
+                # Papers sharing a PDF link take turns, the second one finds it in the store
+                url_lock = self._url_locks.setdefault(download_link, [asyncio.Lock(), 0])
+                url_lock[1] += 1
+                try:
+                    async with url_lock[0]:
+                        downloaded = await download_pdf_async(
+                            self.session, download_link, pdf_save_path, self.store, budget=self.budget,
+                            chunk_size=self.chunk_size, max_size=self.max_size)
+                finally:
+                    url_lock[1] -= 1
+                    if not url_lock[1]:
+                        del self._url_locks[download_link]
+                self._set_status(paper_id, downloaded)
+                if self.on_done is not None:
+                    self.on_done(paper_id, download_link, downloaded)
+            finally:
+                self._queue.task_done()
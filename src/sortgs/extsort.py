@@ -0,0 +1,65 @@
+"""
+External sort of rows that don't need to fit in memory.
+
+Rows are collected in runs of `run_size`; each run is sorted and spilled to
+a temporary JSON lines file, and the runs are merged back lazily with
+heapq.merge. Only one run and one row per spilled run are held in memory.
+"""
+import heapq
+import json
+import os
+import tempfile
+
+RUN_SIZE = 10000  # Rows sorted in memory at a time
+
+
+def _spill(run, tmp_dir):
+    fd, fpath = tempfile.mkstemp(dir=tmp_dir, suffix='.jsonl')
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        for row in run:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+    return fpath
+
+
+def _read_run(fpath):
+    try:
+        with open(fpath, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+    finally:
+        _remove(fpath)
+
+
+def _remove(fpath):
+    try:
+        os.remove(fpath)
+    except OSError:
+        pass
+
+
+def external_sort(rows, key, reverse=False, run_size=RUN_SIZE, tmp_dir=None):
+    """
+    Yields `rows` (JSON serializable dicts) sorted by `key`.
+
+    The sort is stable. Rows are only spilled to disk when there are more
+    than `run_size` of them.
+    """
+    runs = []
+    run = []
+    try:
+        for row in rows:
+            run.append(row)
+            if len(run) >= run_size:
+                run.sort(key=key, reverse=reverse)
+                runs.append(_spill(run, tmp_dir))
+                run = []
+        run.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from run
+            return
+        # The last run stays in memory, after the spilled ones so ties keep their order
+        yield from heapq.merge(*(_read_run(fpath) for fpath in runs), run, key=key, reverse=reverse)
+        runs = []
+    finally:
+        for fpath in runs:
+            _remove(fpath)
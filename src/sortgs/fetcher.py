@@ -0,0 +1,230 @@
+"""
+Concurrent fetching of Google Scholar result pages.
+
+Several result pages are requested at once over a single aiohttp session.
+A semaphore caps the number of requests in flight and a token bucket caps
+the request rate, so pages overlap their network waits instead of adding
+them up, without hitting Scholar any harder than the old sequential loop.
+"""
+from collections import deque
+import asyncio
+import random
+import re
+
+from sortgs.metrics import metrics
+from sortgs.sortgs import MAX_CONCURRENCY, RATE  # Defaults of the command line too
+
+JITTER = 1.0  # Extra random delay (s) added after each token, at most 1/rate
+
+
+def parse_retry_after(value):
+    """Returns the seconds of a Retry-After header given in seconds, or None."""
+    try:
+        return max(0.0, float(value))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Asynchronous token bucket allowing `rate` acquisitions per second."""
+
+    def __init__(self, rate=RATE, capacity=1, jitter=JITTER):
+        if rate <= 0:
+            raise ValueError('rate must be positive')
+        self.rate = rate
+        self.capacity = capacity
+        self.jitter = jitter
+        self._tokens = capacity
+        self._updated = None
+        self._paused_until = None
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now):
+        if self._updated is not None:
+            elapsed = now - self._updated
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+        self._updated = now
+
+    def pause(self, seconds):
+        """Holds every acquisition for `seconds` from now."""
+        until = asyncio.get_running_loop().time() + seconds
+        self._paused_until = max(self._paused_until or until, until)
+
+    async def acquire(self):
+        """Waits until a token is available and takes it."""
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            while self._paused_until is not None and loop.time() < self._paused_until:
+                await asyncio.sleep(self._paused_until - loop.time())
+            while True:
+                self._refill(loop.time())
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    break
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+            if self.jitter:
+                # Keep request spacing irregular, as the random sleeps used to
+                await asyncio.sleep(random.uniform(0, min(self.jitter, 1 / self.rate)))
+
+
+class PageFetcher:
+    """
+    Fetches result pages concurrently under a concurrency cap and a rate limit.
+
+    Use it as an async context manager so the underlying session is closed:
+
+        async with PageFetcher(max_concurrency=4, rate=0.5) as fetcher:
+            async for url, content in fetcher.iter_pages(urls):
+                ...
+
+    `robot_kw` lists strings that identify a robot-check page. When one of
+    them is found, `fallback(url)` is run in a worker thread and its return
+    value (bytes) is used as the page content instead. Up to
+    `fallback_concurrency` fallbacks run at the same time. A fallback with a
+    `share_cookies(url, cookies)` method, like sortgs.browser.BrowserPool,
+    first gets the session cookies of the URL.
+
+    With a `controller` (see sortgs.ratecontrol.RateController), the rate
+    follows the answers: robot checks and 429/503 answers slow it down and
+    pause requests before the page is tried again, up to the controller's
+    `max_retries`, and only then is the fallback run.
+
+    With a `cache` (see sortgs.cache.PageCache), cached pages are returned
+    right away, without waiting for the rate limit, and fetched pages are
+    stored unless they are robot checks or errors.
+    """
+
+    def __init__(self, max_concurrency=MAX_CONCURRENCY, rate=RATE, jitter=JITTER,
+                 robot_kw=(), fallback=None, fallback_concurrency=1, session=None, cache=None, controller=None):
+        if max_concurrency < 1:
+            raise ValueError('max_concurrency must be at least 1')
+        self.max_concurrency = max_concurrency
+        self.controller = controller
+        self.bucket = controller.bucket if controller is not None else TokenBucket(rate, jitter=jitter)
+        self.robot_kw = list(robot_kw)
+        # Pages are searched as bytes, as if they were decoded from ISO-8859-1
+        self._robot_re = re.compile(b'|'.join(re.escape(kw.encode('ISO-8859-1')) for kw in self.robot_kw)) \
+            if self.robot_kw else None
+        self.fallback = fallback
+        self.cache = cache
+        self.session = session
+        self._own_session = session is None
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._fallback_slots = asyncio.Semaphore(fallback_concurrency)
+
+    async def __aenter__(self):
+        if self.session is None:
+            import aiohttp
+            self.session = aiohttp.ClientSession()
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        if self._own_session and self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def is_robot_check(self, content):
+        return self._robot_re is not None and self._robot_re.search(content) is not None
+
+    def throttle_reason(self, status, content):
+        """Returns why an answer was throttled ('429', '503' or 'robot'), or None when it is clean."""
+        if status in (429, 503):
+            return str(status)
+        if self.is_robot_check(content):
+            return 'robot'
+        return None
+
+    async def _get(self, url):
+        async with self._semaphore:
+            with metrics.timer('page.wait'):
+                await self.bucket.acquire()
+            with metrics.timer('page.request'):
+                async with self.session.get(url) as response:
+                    content = await response.read()
+            metrics.count('pages_requested')
+            metrics.count('page_bytes', len(content))
+            return response.status, response.headers.get('Retry-After'), content
+
+    async def fetch(self, url):
+        """Returns the raw content of a single result page."""
+        if self.cache is not None:
+            content = self.cache.get(url)
+            if content is not None:
+                metrics.count('pages_cached')
+                return content
+
+        status, retry_after, content = await self._get(url)
+        if self.controller is not None:
+            for attempt in range(self.controller.max_retries + 1):
+                reason = self.throttle_reason(status, content)
+                if reason is None:
+                    self.controller.success()
+                    break
+                self.controller.throttled(reason, parse_retry_after(retry_after))
+                metrics.count(f'throttled_{reason}')
+                if attempt == self.controller.max_retries or not self.controller.adaptive:
+                    break
+                metrics.count('page_retries')
+                status, retry_after, content = await self._get(url)
+        else:
+            reason = self.throttle_reason(status, content)
+            if reason is not None:
+                metrics.count(f'throttled_{reason}')
+        ok = status == 200
+
+        if self.fallback is not None and self.is_robot_check(content):
+            metrics.count('fallbacks')
+            async with self._fallback_slots:
+                if hasattr(self.fallback, 'share_cookies'):
+                    cookies = self.session.cookie_jar.filter_cookies(url)
+                    self.fallback.share_cookies(url, {name: morsel.value for name, morsel in cookies.items()})
+                loop = asyncio.get_running_loop()
+                try:
+                    with metrics.timer('page.fallback'):
+                        content = await loop.run_in_executor(None, self.fallback, url)
+                    ok = True
+                except Exception as e:
+                    print(e)
+
+        if self.cache is not None and ok and not self.is_robot_check(content):
+            self.cache.put(url, content)
+        return content
+
+    async def _fetch_parsed(self, url, parse):
+        return await parse(await self.fetch(url), url)
+
+    async def iter_pages(self, urls, parse=None):
+        """
+        Yields (url, content) for every URL, in the same order as `urls`.
+
+        At most `max_concurrency` pages are fetched ahead of the consumer.
+        Pages still in flight are cancelled if the consumer stops early.
+        With `parse`, a coroutine function of (content, url), each page is
+        parsed as soon as it is fetched and its result is yielded instead of
+        the content, so pages fetched ahead are parsed ahead too.
+        """
+        urls = iter(urls)
+        pending = deque()
+
+        def schedule():
+            url = next(urls, None)
+            if url is not None:
+                task = self.fetch(url) if parse is None else self._fetch_parsed(url, parse)
+                pending.append((url, asyncio.ensure_future(task)))
+
+        try:
+            for _ in range(self.max_concurrency):
+                schedule()
+            while pending:
+                url, task = pending.popleft()
+                content = await task
+                schedule()
+                yield url, content
+        finally:
+            for _, task in pending:
+                task.cancel()
+            if pending:
+                await asyncio.gather(*(task for _, task in pending), return_exceptions=True)
@@ -0,0 +1,366 @@
+"""
+Crawls shared by several sortgs processes through a job table.
+
+The search is split into idempotent work units kept in a SQLite table
+next to the results: one 'plan' unit that sets the pages to fetch, one
+'page' unit per query, year range and page offset, one 'pdf' unit per
+download link found, and a final 'merge' unit. Each process started on the
+same folder is a worker: it leases units, runs them and stores their
+result. A lease is renewed while its worker lives; units of a worker that
+crashed are taken over by another once their lease expires. The merge
+unit is only handed out once every other unit is done, so a single worker
+writes the output, and it is only done once the output is written: if the
+merging worker dies on the way, another one merges again.
+
+    jobs = JobTable('results/jobs.sqlite')
+    for job in jobs.claim(['page']):
+        jobs.complete(job, records, new_jobs=[('pdf', 'pdf|' + url, {'url': url})])
+"""
+import asyncio
+import json
+import os
+import socket
+import sqlite3
+import threading
+import time
+
+from sortgs.downloads import download_pdf_async
+from sortgs.metrics import metrics
+from sortgs.planner import RESULTS_PER_PAGE
+from sortgs.records import Paper
+
+JOBS_FNAME = 'jobs.sqlite'
+LEASE = 120  # Seconds a worker holds a unit without renewing it
+POLL_INTERVAL = 2  # Seconds between two looks for work while other workers are busy
+MAX_ATTEMPTS = 3  # Attempts of a unit before it is given up
+
+PENDING, LEASED, DONE, FAILED = 'pending', 'leased', 'done', 'failed'
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    kind TEXT NOT NULL, key TEXT UNIQUE NOT NULL, payload TEXT,
+    state TEXT NOT NULL DEFAULT 'pending', worker TEXT, lease_until REAL, attempts INTEGER NOT NULL DEFAULT 0,
+    result TEXT);
+CREATE INDEX IF NOT EXISTS jobs_by_state ON jobs (state, kind);
+'''
+
+
+class Job:
+    __slots__ = ('id', 'kind', 'key', 'payload')
+
+    def __init__(self, id, kind, key, payload):
+        self.id = id
+        self.kind = kind
+        self.key = key
+        self.payload = json.loads(payload)
+
+
+class JobTable:
+    """Lease-based table of work units, shared by processes on one machine."""
+
+    def __init__(self, fpath, lease=LEASE, worker=None):
+        self.fpath = fpath
+        self.lease = lease
+        self.worker = worker or f'{socket.gethostname()}:{os.getpid()}'
+        # Transactions are opened by hand, claims take the write lock right away
+        self.db = sqlite3.connect(fpath, timeout=60, isolation_level=None)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        self._holding = None  # (thread, stop event) renewing the leases, see hold
+
+    def close(self):
+        self.db.close()
+
+    def _transaction(self):
+        return _Transaction(self.db)
+
+    def add(self, jobs):
+        """Adds (kind, key, payload) units; units already known by their key are left as they are."""
+        with self._transaction():
+            self._add(jobs)
+
+    def _add(self, jobs):
+        self.db.executemany('INSERT OR IGNORE INTO jobs (kind, key, payload) VALUES (?, ?, ?)',
+                            [(kind, key, json.dumps(payload)) for kind, key, payload in jobs])
+
+    def get(self, key):
+        """Returns the state and result of a unit, or None if it doesn't exist."""
+        row = self.db.execute('SELECT state, result FROM jobs WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        return row[0], json.loads(row[1]) if row[1] is not None else None
+
+    def payload(self, key):
+        row = self.db.execute('SELECT payload FROM jobs WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row is not None else None
+
+    def claim(self, kinds, n=1, last=False):
+        """
+        Leases up to `n` pending units of `kinds`, or units whose lease
+        expired. With `last`, units are only handed out once every unit of
+        another kind is done or failed.
+        """
+        now = time.time()
+        kind_list = ', '.join('?' for _ in kinds)
+        condition = ''
+        if last:
+            condition = (f"AND NOT EXISTS (SELECT 1 FROM jobs AS other WHERE other.kind NOT IN ({kind_list}) "
+                         f"AND other.state IN ('{PENDING}', '{LEASED}'))")
+        with self._transaction():
+            rows = self.db.execute(f'''
+                SELECT id, kind, key, payload FROM jobs
+                WHERE kind IN ({kind_list})
+                    AND (state = '{PENDING}' OR (state = '{LEASED}' AND lease_until < ?)) {condition}
+                ORDER BY id LIMIT ?''', list(kinds) + [now] + (list(kinds) if last else []) + [n]).fetchall()
+            self.db.executemany(f'''
+                UPDATE jobs SET state = '{LEASED}', worker = ?, lease_until = ?, attempts = attempts + 1
+                WHERE id = ?''', [(self.worker, now + self.lease, row[0]) for row in rows])
+        return [Job(*row) for row in rows]
+
+    def renew(self):
+        """Extends the leases of every unit this worker holds."""
+        with self._transaction():
+            self.db.execute(f"UPDATE jobs SET lease_until = ? WHERE worker = ? AND state = '{LEASED}'",
+                            (time.time() + self.lease, self.worker))
+
+    def hold(self):
+        """
+        Renews the leases of this worker from a thread until `release`, for
+        work done outside of an event loop, such as writing the output.
+        """
+        if self._holding is not None:
+            return
+        stop = threading.Event()
+
+        def renew():
+            # SQLite connections stay in the thread that opened them
+            jobs = JobTable(self.fpath, self.lease, self.worker)
+            try:
+                while not stop.wait(self.lease / 3):
+                    jobs.renew()
+            finally:
+                jobs.close()
+
+        thread = threading.Thread(target=renew, daemon=True)
+        thread.start()
+        self._holding = (thread, stop)
+
+    def release(self):
+        """Stops renewing the leases held with `hold`."""
+        if self._holding is not None:
+            thread, stop = self._holding
+            stop.set()
+            thread.join()
+            self._holding = None
+
+    def complete(self, job, result=None, new_jobs=()):
+        """
+        Stores the result of `job` and adds the units it led to, at once.
+        Returns False when the lease was lost to another worker, whose
+        result is kept instead.
+        """
+        with self._transaction():
+            cursor = self.db.execute(f'''
+                UPDATE jobs SET state = '{DONE}', result = ?, lease_until = NULL
+                WHERE id = ? AND worker = ? AND state = '{LEASED}' ''', (json.dumps(result), job.id, self.worker))
+            if cursor.rowcount:
+                self._add(new_jobs)
+        return bool(cursor.rowcount)
+
+    def fail(self, job):
+        """Gives `job` back, or gives it up after MAX_ATTEMPTS attempts."""
+        with self._transaction():
+            self.db.execute(f'''
+                UPDATE jobs SET state = CASE WHEN attempts >= ? THEN '{FAILED}' ELSE '{PENDING}' END,
+                    lease_until = NULL
+                WHERE id = ? AND worker = ? AND state = '{LEASED}' ''', (MAX_ATTEMPTS, job.id, self.worker))
+
+    def skip(self, kind, keys):
+        """Marks pending units that turned out not to be needed as done, without result."""
+        with self._transaction():
+            self.db.executemany(f"UPDATE jobs SET state = '{DONE}' WHERE kind = ? AND key = ? AND state = '{PENDING}'",
+                                [(kind, key) for key in keys])
+
+    def results(self, kind):
+        """Returns {key: (payload, result)} of the done units of `kind`."""
+        rows = self.db.execute(f"SELECT key, payload, result FROM jobs WHERE kind = ? AND state = '{DONE}'", (kind,))
+        return {key: (json.loads(payload), json.loads(result) if result is not None else None)
+                for key, payload, result in rows}
+
+    def counts(self, kinds):
+        """Returns {state: number of units} of `kinds`."""
+        kind_list = ', '.join('?' for _ in kinds)
+        return dict(self.db.execute(f'SELECT state, COUNT(*) FROM jobs WHERE kind IN ({kind_list}) GROUP BY state',
+                                    list(kinds)).fetchall())
+
+    def remove(self):
+        """Closes and deletes the table, once the search is over."""
+        self.release()
+        self.close()
+        for suffix in ('', '-wal', '-shm'):
+            try:
+                os.remove(self.fpath + suffix)
+            except OSError:
+                pass
+
+
+class _Transaction:
+    def __init__(self, db):
+        self.db = db
+
+    def __enter__(self):
+        self.db.execute('BEGIN IMMEDIATE')
+
+    def __exit__(self, exc_type, exc, tb):
+        self.db.execute('ROLLBACK' if exc_type is not None else 'COMMIT')
+
+
+def page_key(keyword, key, n):
+    return f'page|{keyword}|{key}|{n}'
+
+
+def search_signature(search):
+    """Arguments that every worker of a job table must share."""
+    return {'keywords': search.keywords, 'nresults': search.nresults, 'start_year': search.start_year,
+            'end_year': search.end_year, 'lang': search.lang, 'slices': search.slices}
+
+
+async def _renew_leases(jobs):
+    while True:
+        await asyncio.sleep(jobs.lease / 3)
+        jobs.renew()
+
+
+async def _plan(client, search, jobs):
+    """Sets the budgets of `search`, planning the page units if no other worker did."""
+    signature = search_signature(search)
+    jobs.add([('plan', 'plan', signature)])
+    if jobs.payload('plan') != json.loads(json.dumps(signature)):
+        raise ValueError(f'{jobs.fpath} belongs to another search, remove it or use another --csvpath')
+    while True:
+        for job in jobs.claim(['plan']):
+            await client.plan(search)
+            units = [('page', page_key(keyword, key, n), {'keyword': keyword, 'slice': key, 'n': n, 'budget': budget,
+                                                         'url': client.query_url(search, (keyword, key), n)})
+                     for (keyword, key), budget in search.budgets.items()
+                     for n in range(0, budget, RESULTS_PER_PAGE)]
+            budgets = [[keyword, key, budget] for (keyword, key), budget in search.budgets.items()]
+            jobs.complete(job, budgets, new_jobs=units + [('merge', 'merge', {})])
+            return
+        state = jobs.get('plan')
+        if state[0] == DONE:
+            search.set_budgets({(keyword, key): budget for keyword, key, budget in state[1]})
+            return
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def _run_page(client, jobs, job):
+    """Fetches a result page, and adds the downloads of its PDFs."""
+    page = job.payload
+    records = await client.fetch_records(page['url'])
+    if len(records) < RESULTS_PER_PAGE:
+        # The query has no more results, its later pages are not fetched
+        jobs.skip('page', [page_key(page['keyword'], page['slice'], n)
+                           for n in range(page['n'] + RESULTS_PER_PAGE, page['budget'], RESULTS_PER_PAGE)])
+    pdfs = []
+    if client.downloads is not None:
+        pdfs = [('pdf', 'pdf|' + record['download_link'], {'url': record['download_link']})
+                for record in records if record['download_link']]
+    jobs.complete(job, records, new_jobs=pdfs)
+
+
+async def _run_pdf(client, jobs, job):
+    """Downloads a PDF into the store, the merge links it to the papers."""
+    url = job.payload['url']
+    downloads = client.downloads
+    entry = None
+    if await download_pdf_async(downloads.session, url, None, downloads.store, budget=downloads.budget):
+        entry = downloads.store.lookup(url)
+    jobs.complete(job, entry['sha256'] if entry is not None else None)
+
+
+async def _work(client, jobs, kinds):
+    """Runs units of `kinds` until none is left to any worker."""
+    while True:
+        claimed = jobs.claim(kinds)
+        if not claimed:
+            counts = jobs.counts(kinds)
+            if not counts.get(PENDING) and not counts.get(LEASED):
+                return
+            # Units held by other workers, they may add more or let their lease expire
+            await asyncio.sleep(POLL_INTERVAL)
+            continue
+        job = claimed[0]
+        try:
+            if job.kind == 'page':
+                await _run_page(client, jobs, job)
+            else:
+                await _run_pdf(client, jobs, job)
+        except Exception as e:
+            print(f"Failed {job.key}: {e}")
+            metrics.count('units_failed')
+            jobs.fail(job)
+
+
+def _merge(client, search, jobs):
+    """
+    Adds the results of every page to `search`, in the order of
+    ScholarClient.crawl, and links the downloaded PDFs to their papers.
+    """
+    pages = jobs.results('page')
+    pdfs = {payload['url']: sha256 for payload, sha256 in jobs.results('pdf').values()}
+    exhausted = set()
+    for n in range(0, max(search.budgets.values(), default=0), RESULTS_PER_PAGE):
+        for query, budget in search.budgets.items():
+            if n >= budget or query in exhausted:
+                continue
+            keyword, key = query
+            records = pages.get(page_key(keyword, key, n), (None, None))[1]
+            if records is None:
+                print(f"Results of {keyword} {key} stop at {n}: the page could not be fetched")
+                exhausted.add(query)
+                continue
+            if len(records) < RESULTS_PER_PAGE:
+                exhausted.add(query)
+            for record in records:
+                search.add(Paper(None, record['author'], record['title'], record['citations'], record['year'],
+                                 record['publisher'], record['venue'], record['link'], record['download_link'], 0,
+                                 keyword, key))
+
+    with metrics.timer('index'):
+        client.index.add_papers(search.papers)
+        client.record_queries(search, exhausted)
+    if client.downloads is not None:
+        linked = [(paper, pdfs.get(paper.download_link)) for paper in search.papers]
+        linked = [(paper, sha256) for paper, sha256 in linked
+                  if sha256 is not None and client.downloads.reuse(paper.id, sha256)]
+        client.index.set_pdfs(linked)
+
+
+async def run_worker(client, search, jobs):
+    """
+    Works on the search with the other workers of `jobs`, running up to
+    `client.max_concurrency` units at a time. Returns the merge unit when
+    this worker merged the results into `search`, None when another one did.
+    The merge unit stays leased, and its lease renewed (see JobTable.hold),
+    until the caller completes it once the output is written.
+    """
+    await client.open()
+    renewing = asyncio.ensure_future(_renew_leases(jobs))
+    try:
+        with metrics.timer('plan'):
+            await _plan(client, search, jobs)
+        kinds = ['page', 'pdf'] if client.downloads is not None else ['page']
+        await asyncio.gather(*(_work(client, jobs, kinds) for _ in range(client.max_concurrency)))
+        while True:
+            for job in jobs.claim(['merge'], last=True):
+                jobs.hold()
+                _merge(client, search, jobs)
+                return job
+            # The merging worker removes the table once the results are written
+            if not os.path.exists(jobs.fpath) or jobs.get('merge')[0] == DONE:
+                return None
+            await asyncio.sleep(POLL_INTERVAL)
+    finally:
+        renewing.cancel()
@@ -0,0 +1,95 @@
+"""
+Append-only checkpoint journal used to resume interrupted runs.
+
+Each result page is written as a single JSON line holding the rows parsed
+from it, so a checkpoint costs only the size of the new page no matter how
+many results were collected before. Lines are flushed right away and
+fsynced in batches. A line cut short by a crash is ignored on replay.
+"""
+import json
+import os
+
+JOURNAL_FNAME = 'temp_results.jsonl'
+FSYNC_EVERY = 5  # Pages written between two fsync calls
+
+
+class CheckpointJournal:
+    """
+    Journal of parsed result pages.
+
+        journal = CheckpointJournal(path)
+        for row in journal.replay():      # rows saved by a previous run
+            ...
+        journal.append(start, new_rows)   # after each page
+        journal.close()
+        journal.remove()                  # once the final output is saved
+    """
+
+    def __init__(self, path, fname=JOURNAL_FNAME, fsync_every=FSYNC_EVERY):
+        self.fpath = os.path.join(path, fname)
+        self.fsync_every = fsync_every
+        self._file = None
+        self._unsynced = 0
+
+    def exists(self):
+        return os.path.exists(self.fpath)
+
+    def replay(self):
+        """Yields the rows saved so far, in the order they were written, reading a page at a time."""
+        if not self.exists():
+            return
+        with open(self.fpath, 'rb') as f:
+            for line in f:
+                if not line.endswith(b'\n'):
+                    break  # Partial write from an interrupted run
+                try:
+                    page = json.loads(line)
+                except ValueError:
+                    break
+                yield from page['rows']
+
+    def append(self, start, rows):
+        """Appends the rows of the result page starting at `start`."""
+        if self._file is None:
+            self._truncate_partial_line()
+            self._file = open(self.fpath, 'ab')
+        line = json.dumps({'start': start, 'rows': rows}, ensure_ascii=False)
+        self._file.write(line.encode('utf-8') + b'\n')
+        self._file.flush()
+        self._unsynced += 1
+        if self._unsynced >= self.fsync_every:
+            self.sync()
+
+    def sync(self):
+        if self._file is not None and self._unsynced:
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
+
+    def close(self):
+        if self._file is not None:
+            self.sync()
+            self._file.close()
+            self._file = None
+
+    def remove(self):
+        self.close()
+        if self.exists():
+            os.remove(self.fpath)
+
+    def _truncate_partial_line(self):
+        # Drop a trailing partial line so new pages start on a fresh line
+        if not self.exists():
+            return
+        with open(self.fpath, 'rb+') as f:
+            end = f.seek(0, os.SEEK_END)
+            pos = end
+            while pos > 0:
+                block = min(pos, 65536)
+                pos -= block
+                f.seek(pos)
+                newline = f.read(block).rfind(b'\n')
+                if newline != -1:
+                    pos += newline + 1
+                    break
+            if pos != end:
+                f.truncate(pos)
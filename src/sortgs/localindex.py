@@ -0,0 +1,189 @@
+"""
+Persistent index of every paper seen, across runs and keywords.
+
+Parsed papers are upserted into a SQLite database, with their latest
+citations, their download link and the hash of their PDF once it is
+downloaded. Titles are searchable with full text search (FTS5, or LIKE when
+SQLite is built without it), and year and citations are indexed.
+
+The ranked results of every query (keyword, years and languages) are kept
+too, so a query asked again can be answered from the index while its
+results are recent enough, without a request to Scholar:
+
+    index = LocalIndex('~/.cache/sortgs/papers.sqlite')
+    index.add_papers(papers)  # after each page
+    index.record_query('deep learning', 2015, 2020, 'All', papers, exhausted=False)
+    found = index.lookup('deep learning', 2015, 2020, 'All', 100, max_age=7 * 24 * 3600)  # None if stale
+    rows = index.search('transformer', start_year=2018)
+"""
+import os
+import sqlite3
+import time
+
+from sortgs.dedup import normalize_title, paper_keys
+from sortgs.records import Paper
+
+INDEX_FNAME = 'papers.sqlite'
+SEARCH_LIMIT = 100  # Papers returned by a title search
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS papers (
+    id INTEGER PRIMARY KEY,
+    key TEXT UNIQUE NOT NULL,
+    title TEXT, author TEXT, year INTEGER, venue TEXT, publisher TEXT, citations INTEGER,
+    source TEXT, download_link TEXT, pdf_sha256 TEXT, first_seen REAL, last_seen REAL);
+CREATE INDEX IF NOT EXISTS papers_by_year ON papers (year);
+CREATE INDEX IF NOT EXISTS papers_by_citations ON papers (citations);
+CREATE TABLE IF NOT EXISTS queries (
+    id INTEGER PRIMARY KEY,
+    keyword TEXT NOT NULL, start_year INTEGER NOT NULL, end_year INTEGER NOT NULL, lang TEXT NOT NULL,
+    results INTEGER, exhausted INTEGER, fetched REAL,
+    UNIQUE (keyword, start_year, end_year, lang));
+CREATE TABLE IF NOT EXISTS query_results (
+    query_id INTEGER NOT NULL, rank INTEGER NOT NULL, paper_id INTEGER NOT NULL,
+    PRIMARY KEY (query_id, rank)) WITHOUT ROWID;
+'''
+
+# The full text index follows the papers table through triggers
+FTS_SCHEMA = '''
+CREATE VIRTUAL TABLE IF NOT EXISTS papers_fts USING fts5(title, content='papers', content_rowid='id');
+CREATE TRIGGER IF NOT EXISTS papers_fts_insert AFTER INSERT ON papers BEGIN
+    INSERT INTO papers_fts (rowid, title) VALUES (new.id, new.title);
+END;
+CREATE TRIGGER IF NOT EXISTS papers_fts_update AFTER UPDATE OF title ON papers BEGIN
+    INSERT INTO papers_fts (papers_fts, rowid, title) VALUES ('delete', old.id, old.title);
+    INSERT INTO papers_fts (rowid, title) VALUES (new.id, new.title);
+END;
+'''
+
+PAPER_COLUMNS = ['title', 'author', 'year', 'venue', 'publisher', 'citations', 'source', 'download_link']
+
+
+def paper_key(paper):
+    """Returns the text key of a paper in the index: its first dedup key, or its authors and source."""
+    keys = paper_keys(paper.title, paper.year, paper.source)
+    if not keys:
+        return f'untitled|{paper.author}|{paper.source}'
+    return '|'.join(str(part) for part in keys[0])
+
+
+def lang_key(lang):
+    return lang if isinstance(lang, str) else ','.join(sorted(lang))
+
+
+class LocalIndex:
+    def __init__(self, fpath):
+        self.fpath = os.path.expanduser(fpath)
+        os.makedirs(os.path.dirname(self.fpath) or '.', exist_ok=True)
+        # Other runs may be writing to the same index
+        self.db = sqlite3.connect(self.fpath, timeout=30)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.executescript(SCHEMA)
+        try:
+            self.db.executescript(FTS_SCHEMA)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite without FTS5
+        self.db.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        self.db.close()
+
+    def add_papers(self, papers):
+        """Upserts `papers` (sortgs.records.Paper), keeping the latest citations and the known download link."""
+        now = time.time()
+        with self.db:
+            self.db.executemany('''
+                INSERT INTO papers (key, title, author, year, venue, publisher, citations, source, download_link,
+                                    first_seen, last_seen)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET
+                    author = excluded.author, venue = excluded.venue, publisher = excluded.publisher,
+                    citations = excluded.citations, source = excluded.source,
+                    download_link = COALESCE(excluded.download_link, download_link),
+                    last_seen = excluded.last_seen''',
+                [(paper_key(paper),) + tuple(getattr(paper, column) for column in PAPER_COLUMNS) + (now, now)
+                 for paper in papers])
+
+    def set_pdfs(self, pdfs):
+        """Records the hash of the downloaded PDF of papers, given as (paper, sha256) pairs, see sortgs.pdfstore."""
+        with self.db:
+            self.db.executemany('UPDATE papers SET pdf_sha256 = ? WHERE key = ?',
+                                [(sha256, paper_key(paper)) for paper, sha256 in pdfs])
+
+    def record_query(self, keyword, start_year, end_year, lang, papers, exhausted):
+        """
+        Saves `papers`, the results of a query in rank order. `exhausted` is
+        set when Scholar has no more results for the query.
+        """
+        self.add_papers(papers)
+        params = (keyword, start_year or 0, end_year, lang_key(lang))
+        with self.db:
+            self.db.execute('''
+                INSERT INTO queries (keyword, start_year, end_year, lang, results, exhausted, fetched)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (keyword, start_year, end_year, lang) DO UPDATE SET
+                    results = excluded.results, exhausted = excluded.exhausted, fetched = excluded.fetched''',
+                params + (len(papers), int(exhausted), time.time()))
+            query_id, = self.db.execute('SELECT id FROM queries WHERE keyword = ? AND start_year = ? AND end_year = ? '
+                                        'AND lang = ?', params).fetchone()
+            self.db.execute('DELETE FROM query_results WHERE query_id = ?', (query_id,))
+            self.db.executemany('''
+                INSERT INTO query_results (query_id, rank, paper_id)
+                SELECT ?, ?, id FROM papers WHERE key = ?''',
+                [(query_id, rank, paper_key(paper)) for rank, paper in enumerate(papers, 1)])
+
+    def lookup(self, keyword, start_year, end_year, lang, nresults, max_age):
+        """
+        Returns the first `nresults` papers of a query recorded less than
+        `max_age` seconds ago, in rank order and without ID, as (paper, PDF
+        hash) pairs. None when the query is unknown, stale or has fewer
+        results than wanted while Scholar had more.
+        """
+        query = self.db.execute('''
+            SELECT id, results, exhausted, fetched FROM queries
+            WHERE keyword = ? AND start_year = ? AND end_year = ? AND lang = ?''',
+            (keyword, start_year or 0, end_year, lang_key(lang))).fetchone()
+        if query is None:
+            return None
+        query_id, results, exhausted, fetched = query
+        if time.time() - fetched > max_age or (results < nresults and not exhausted):
+            return None
+        rows = self.db.execute(f'''
+            SELECT {", ".join(PAPER_COLUMNS)}, pdf_sha256 FROM query_results JOIN papers ON papers.id = paper_id
+            WHERE query_id = ? ORDER BY rank LIMIT ?''', (query_id, nresults)).fetchall()
+        return [(Paper(None, author, title, citations, year, publisher, venue, source, download_link, 0, keyword, ''),
+                 pdf_sha256)
+                for title, author, year, venue, publisher, citations, source, download_link, pdf_sha256 in rows]
+
+    def search(self, text, start_year=None, end_year=None, limit=SEARCH_LIMIT):
+        """
+        Returns the papers whose title has all the words of `text`, most cited
+        first, as dicts with the columns of the papers table.
+        """
+        words = normalize_title(text).split()
+        conditions, params = [], []
+        if words and self.fts:
+            conditions.append('id IN (SELECT rowid FROM papers_fts WHERE papers_fts MATCH ?)')
+            params.append(' '.join(f'"{word}"' for word in words))
+        elif words:
+            for word in words:
+                conditions.append('title LIKE ?')
+                params.append(f'%{word}%')
+        if start_year:
+            conditions.append('year >= ?')
+            params.append(start_year)
+        if end_year:
+            conditions.append('year <= ?')
+            params.append(end_year)
+        where = ' AND '.join(conditions) or '1'
+        cursor = self.db.execute(f'SELECT * FROM papers WHERE {where} ORDER BY citations DESC LIMIT ?',
+                                 params + [limit])
+        columns = [description[0] for description in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor]
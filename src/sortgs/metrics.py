@@ -0,0 +1,134 @@
+"""
+Lightweight metrics of a run: time spent per stage and counters.
+
+Every module records into the shared `metrics` registry:
+
+    from sortgs.metrics import metrics
+
+    with metrics.timer('parse'):
+        records = parse_page(content, url)
+    metrics.count('page_bytes', len(content))
+
+Timers measure wall time, so stages that run concurrently (page requests,
+downloads) can add up to more than the length of the run. Recording is a
+couple of perf_counter calls and dict updates, cheap enough to stay on.
+The registry prints as a table (`summary`) and exports to JSON or to the
+Prometheus textfile format (`write`), along with the peak memory (RSS) of
+the process.
+"""
+from collections import Counter
+from contextlib import contextmanager
+import json
+import os
+import re
+import sys
+import time
+
+PREFIX = 'sortgs'  # Prefix of the Prometheus metric names
+
+
+def peak_rss():
+    """Returns the peak resident memory of the process in bytes, or None where it isn't known (Windows)."""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024  # Kilobytes but on macOS
+
+
+class StageTimer:
+    """Number of calls, total and longest time (s) of a stage."""
+    __slots__ = ('calls', 'total', 'longest')
+
+    def __init__(self):
+        self.calls = 0
+        self.total = 0.0
+        self.longest = 0.0
+
+    def add(self, seconds):
+        self.calls += 1
+        self.total += seconds
+        self.longest = max(self.longest, seconds)
+
+
+class Metrics:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self.started = time.perf_counter()
+        self.timers = {}
+        self.counters = Counter()
+
+    def add_time(self, stage, seconds):
+        if stage not in self.timers:
+            self.timers[stage] = StageTimer()
+        self.timers[stage].add(seconds)
+
+    @contextmanager
+    def timer(self, stage):
+        """Times the block as one call of `stage`, also when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(stage, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        self.counters[name] += n
+
+    def to_dict(self):
+        return {
+            'elapsed': time.perf_counter() - self.started,
+            'peak_rss': peak_rss(),
+            'stages': {stage: {'calls': t.calls, 'total': t.total, 'max': t.longest}
+                       for stage, t in sorted(self.timers.items())},
+            'counters': dict(sorted(self.counters.items())),
+        }
+
+    def summary(self):
+        """Returns a table of the stages, slowest first, followed by the counters."""
+        peak = peak_rss()
+        lines = [f'Run time: {time.perf_counter() - self.started:.2f} s'
+                 + (f', peak memory: {peak / 2**20:.1f} MB' if peak is not None else ''),
+                 f'{"Stage":<24}{"Calls":>8}{"Total (s)":>12}{"Mean (ms)":>12}{"Max (ms)":>12}']
+        for stage, t in sorted(self.timers.items(), key=lambda item: -item[1].total):
+            lines.append(f'{stage:<24}{t.calls:>8}{t.total:>12.3f}{1000 * t.total / t.calls:>12.2f}'
+                         f'{1000 * t.longest:>12.2f}')
+        for name, n in sorted(self.counters.items()):
+            lines.append(f'{name:<24}{n:>8}')
+        return '\n'.join(lines)
+
+    def to_prometheus(self):
+        """Returns the metrics in the Prometheus text format, e.g. for the node exporter textfile collector."""
+        def name(*parts):
+            return re.sub(r'[^a-zA-Z0-9_]', '_', '_'.join((PREFIX,) + parts))
+
+        lines = [f'# TYPE {name("stage_seconds_total")} counter']
+        lines += [f'{name("stage_seconds_total")}{{stage="{stage}"}} {t.total}' for stage, t in sorted(self.timers.items())]
+        lines.append(f'# TYPE {name("stage_calls_total")} counter')
+        lines += [f'{name("stage_calls_total")}{{stage="{stage}"}} {t.calls}' for stage, t in sorted(self.timers.items())]
+        for counter, n in sorted(self.counters.items()):
+            lines.append(f'# TYPE {name(counter, "total")} counter')
+            lines.append(f'{name(counter, "total")} {n}')
+        peak = peak_rss()
+        if peak is not None:
+            lines.append(f'# TYPE {name("peak_rss_bytes")} gauge')
+            lines.append(f'{name("peak_rss_bytes")} {peak}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, fpath):
+        """Writes the metrics to `fpath`: Prometheus text for .prom files, JSON otherwise."""
+        if fpath.endswith('.prom'):
+            text = self.to_prometheus()
+        else:
+            text = json.dumps(self.to_dict(), indent=2)
+        # Written whole, so a collector never reads half a file
+        tmp_path = fpath + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, fpath)
+
+
+metrics = Metrics()
@@ -0,0 +1,249 @@
+"""
+Parsing of Google Scholar result pages.
+
+Every result block (div.gs_or) is visited once: the title link, the gs_a
+line (authors - venue, year - publisher) and the download badge are each
+looked up a single time, and the number of citations is taken from the
+block text with a precompiled regex.
+
+selectolax or lxml are used when installed, otherwise BeautifulSoup falls
+back to the standard html.parser.
+
+A ParsePool parses pages off the event loop in threads with selectolax,
+whose parser runs without the GIL. BeautifulSoup builds its tree in Python
+even on top of lxml, so its pages are parsed on the calling thread unless
+worker processes are asked for: starting them costs more than parsing the
+pages of most searches.
+"""
+import os
+import re
+import warnings
+
+from bs4 import BeautifulSoup, SoupStrainer
+
+try:
+    from selectolax.lexbor import LexborHTMLParser as HTMLParser
+except ImportError:
+    try:
+        from selectolax.parser import HTMLParser  # selectolax < 0.3.13
+    except ImportError:
+        HTMLParser = None
+
+try:
+    import lxml  # noqa: F401
+    BS4_FEATURES = 'lxml'
+except ImportError:
+    BS4_FEATURES = 'html.parser'
+
+BACKEND = 'selectolax' if HTMLParser is not None else BS4_FEATURES
+BACKENDS = ['selectolax', 'lxml', 'html.parser']
+GIL_FREE = ['selectolax']  # Backends parsing without holding the GIL, run in threads
+PARSE_WORKERS = min(4, os.cpu_count() or 1)  # Pages parsed at the same time by the GIL_FREE backends
+
+CITED_BY_RE = re.compile(r'Cited by (\d+)')
+# Header above the results, e.g. 'About 1,230,000 results (0.04 sec)'
+TOTAL_RESULTS_RE = re.compile(rb'class="gs_ab_mdw">(?:About )?([\d,.]+) results?')
+
+
+def _is_result_class(value):
+    # The class attribute is still a plain string while the strainer runs
+    if isinstance(value, str):
+        value = value.split()
+    return value is not None and 'gs_or' in value
+
+
+# Only result blocks are turned into a tree, the rest of the page is skipped
+RESULT_STRAINER = SoupStrainer('div', class_=_is_result_class)
+
+
+def get_citations(content):
+    """Returns the last 'Cited by N' count found in the content, 0 if none."""
+    matches = CITED_BY_RE.findall(content)
+    return int(matches[-1]) if matches else 0
+
+
+def get_total_results(content):
+    """Returns the number of results Scholar reports for a query, None if not shown."""
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    match = TOTAL_RESULTS_RE.search(content)
+    if match is None:
+        return None
+    return int(match.group(1).replace(b',', b'').replace(b'.', b''))
+
+
+def get_year(content):
+    """Returns the year written right before the last ' - ' of a gs_a line."""
+    dash = content.rindex('-')
+    out = content[dash-5:dash-1]
+    if not out.isdigit():
+        return 0
+    return int(out)
+
+
+def get_author(content):
+    content = content.replace('\xa0', ' ')  # Replaces the non-breaking space with a regular space
+    out = ""
+    if len(content)>0:
+        out = content.split(" - ")[0]
+    return out
+
+
+def get_publisher(content):
+    return content[content.rfind('-') + 1:]
+
+
+def get_venue(content):
+    return " ".join(content.rsplit("-", 2)[-2].split(",")[:-1])
+
+
+def make_record(url, link, title, gs_a, text, download_href, download_text):
+    """Builds the record of one result from the strings found in its block."""
+    if title is None:
+        title = 'Could not catch title'
+    record = {
+        'link': link if link is not None else f'Look manually at: {url}',
+        'title': title,
+        'citations': get_citations(text),
+        'year': 0,
+        'author': 'Author not found',
+        'publisher': 'Publisher not found',
+        'venue': 'Venue not found',
+        'download_link': None,
+        'html_link': None,
+    }
+
+    if gs_a is None:
+        warnings.warn(f"Year not found for {title}, appending 0")
+    else:
+        try:
+            record['year'] = get_year(gs_a)
+        except ValueError:
+            warnings.warn(f"Year not found for {title}, appending 0")
+        record['author'] = get_author(gs_a)
+        record['publisher'] = get_publisher(gs_a)
+        try:
+            record['venue'] = get_venue(gs_a)
+        except IndexError:
+            pass
+
+    # PDFs are linked directly, 'HTML' badges point to a landing page
+    if download_href:
+        if 'pdf' in download_href.lower():
+            record['download_link'] = download_href
+        elif 'HTML' in download_text:
+            record['html_link'] = download_href
+    return record
+
+
+def _parse_bs4(content, url, features):
+    kwargs = {'from_encoding': 'utf-8'} if isinstance(content, bytes) else {}
+    soup = BeautifulSoup(content, features, parse_only=RESULT_STRAINER, **kwargs)
+    records = []
+    for div in soup.find_all('div', class_='gs_or'):
+        h3 = div.find('h3')
+        a = h3.find('a') if h3 is not None else None
+        gs_a = div.find('div', {'class': 'gs_a'})
+        download_div = div.find('div', {'class': 'gs_ggs gs_fl'})
+        download_a = download_div.find('a') if download_div is not None else None
+        records.append(make_record(
+            url,
+            a.get('href') if a is not None else None,
+            a.text if a is not None else None,
+            gs_a.text if gs_a is not None else None,
+            div.get_text(),
+            download_a.get('href') if download_a is not None else None,
+            download_div.text if download_div is not None else ''))
+    soup.decompose()
+    return records
+
+
+def _parse_selectolax(content, url):
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', errors='replace')
+    tree = HTMLParser(content)
+    records = []
+    for div in tree.css('div.gs_or'):
+        h3 = div.css_first('h3')
+        a = h3.css_first('a') if h3 is not None else None
+        gs_a = div.css_first('div.gs_a')
+        download_div = div.css_first('div.gs_ggs.gs_fl')
+        download_a = download_div.css_first('a') if download_div is not None else None
+        records.append(make_record(
+            url,
+            a.attributes.get('href') if a is not None else None,
+            a.text() if a is not None else None,
+            gs_a.text() if gs_a is not None else None,
+            div.text(),
+            download_a.attributes.get('href') if download_a is not None else None,
+            download_div.text() if download_div is not None else ''))
+    return records
+
+
+def parse_page(content, url=None, backend=None):
+    """
+    Returns a list of records, one per result found in a result page.
+
+    Each record is a dict with the keys link, title, citations, year, author,
+    publisher, venue, download_link and html_link. `html_link` is set when
+    the download badge points to an HTML landing page that may link a PDF.
+    """
+    backend = backend or BACKEND
+    if backend == 'selectolax':
+        if HTMLParser is None:
+            raise ValueError('selectolax is not installed')
+        return _parse_selectolax(content, url)
+    if backend not in BACKENDS:
+        raise ValueError(f'Unknown parser backend: {backend}')
+    return _parse_bs4(content, url, backend)
+
+
+class ParsePool:
+    """
+    Parses result pages in `workers` threads or processes.
+
+        with ParsePool(workers=4) as pool:
+            records = await pool.parse(content, url)
+
+    Threads are used for the GIL_FREE backends, PARSE_WORKERS of them by
+    default, and processes for the others, none by default. Processes are
+    started with the default start method of multiprocessing, which callers
+    can set. Workers get the raw page bytes and send back the list of
+    records, never a parsed tree. The workers are started on the first page.
+    With no workers, pages are parsed right away on the calling thread.
+    """
+
+    def __init__(self, workers=None, backend=None):
+        self.backend = backend or BACKEND
+        self.kind = 'thread' if self.backend in GIL_FREE else 'process'
+        if workers is None:
+            workers = PARSE_WORKERS if self.kind == 'thread' else 0
+        self.workers = workers
+        self._executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _start(self):
+        from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+        if self.kind == 'thread':
+            return ThreadPoolExecutor(self.workers, thread_name_prefix='sortgs-parse')
+        return ProcessPoolExecutor(self.workers)
+
+    async def parse(self, content, url=None):
+        """Returns the records of a result page, see parse_page."""
+        if self.workers < 1:
+            return parse_page(content, url, self.backend)
+        if self._executor is None:
+            self._executor = self._start()
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, parse_page, content, url, self.backend)
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
@@ -0,0 +1,151 @@
+"""
+Content-addressed store of downloaded PDFs.
+
+Every PDF is kept once, under the SHA-256 of its content, and an index maps
+each download URL to the file it returned along with the ETag and
+Last-Modified headers sent with it. Repeated runs and overlapping queries
+only send conditional requests for PDFs already stored. Interrupted
+downloads are kept as partial files and resumed with a Range request.
+
+The files named after paper IDs in the PDF folder are hard links to the
+store (copies where hard links are not supported).
+"""
+import json
+import hashlib
+import os
+import shutil
+import tempfile
+
+STORE_DNAME = 'pdfs'  # Folder of the store in the cache folder
+INDEX_FNAME = 'index.jsonl'
+PARTIAL_DIR = 'partial'
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode('utf-8')).hexdigest()
+
+
+class PartialDownload:
+    """
+    A download in progress, stored next to the validator it was started with.
+
+    `validator` is the ETag or Last-Modified header of the first response and
+    is sent back in If-Range, so a PDF that changed in between is restarted
+    instead of being stitched together from two versions.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.meta_path = path + '.json'
+        self.validator = None
+        if os.path.exists(self.meta_path):
+            try:
+                with open(self.meta_path, encoding='utf-8') as f:
+                    self.validator = json.load(f).get('validator')
+            except ValueError:
+                pass
+
+    @property
+    def size(self):
+        try:
+            return os.path.getsize(self.path)
+        except OSError:
+            return 0
+
+    def start(self, validator):
+        """Starts the download over, truncating what was saved so far."""
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        open(self.path, 'wb').close()
+        self.validator = validator
+        with open(self.meta_path, 'w', encoding='utf-8') as f:
+            json.dump({'validator': validator}, f)
+
+    def sha256(self):
+        digest = hashlib.sha256()
+        with open(self.path, 'rb') as f:
+            for block in iter(lambda: f.read(2**20), b''):
+                digest.update(block)
+        return digest
+
+    def tail(self, size=1024):
+        with open(self.path, 'rb') as f:
+            f.seek(max(0, self.size - size))
+            return f.read()
+
+    def remove(self):
+        for path in (self.path, self.meta_path):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class PdfStore:
+    """
+    PDFs stored by content hash, with a URL -> file index.
+
+        store = PdfStore(store_dir)
+        entry = store.lookup(url)  # {'sha256', 'size', 'etag', 'last_modified'} or None
+        store.add(url, partial, sha256, etag, last_modified)
+        store.link(entry['sha256'], 'PDFs/paper_0001.pdf')
+    """
+
+    def __init__(self, store_dir):
+        self.store_dir = store_dir
+        self.index_path = os.path.join(store_dir, INDEX_FNAME)
+        self.index = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial write from an interrupted run
+                    self.index[entry['url']] = entry
+
+    def object_path(self, sha256):
+        return os.path.join(self.store_dir, sha256[:2], sha256 + '.pdf')
+
+    def lookup(self, url):
+        """Returns the index entry of `url`, if its PDF is still in the store."""
+        entry = self.index.get(url)
+        if entry is None or not os.path.exists(self.object_path(entry['sha256'])):
+            return None
+        return entry
+
+    def partial(self, url):
+        return PartialDownload(os.path.join(self.store_dir, PARTIAL_DIR, url_key(url) + '.part'))
+
+    def add(self, url, partial, sha256, etag=None, last_modified=None):
+        """Moves a finished download into the store and records it in the index."""
+        path = self.object_path(sha256)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        size = partial.size
+        if os.path.exists(path):
+            partial.remove()  # Same content already downloaded from another URL
+        else:
+            os.replace(partial.path, path)
+            partial.remove()
+        entry = {'url': url, 'sha256': sha256, 'size': size, 'etag': etag, 'last_modified': last_modified}
+        self.index[url] = entry
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(entry) + '\n')
+        return entry
+
+    def link(self, sha256, path):
+        """Makes `path` point to the stored PDF, replacing any file already there."""
+        source = self.object_path(sha256)
+        try:
+            if os.path.samefile(source, path):
+                return
+        except OSError:
+            pass
+        directory = os.path.dirname(path) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        os.close(fd)
+        os.remove(tmp_path)
+        try:
+            os.link(source, tmp_path)
+        except OSError:
+            shutil.copyfile(source, tmp_path)  # Other file system, or no hard links
+        os.replace(tmp_path, path)
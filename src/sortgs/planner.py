@@ -0,0 +1,67 @@
+"""
+Year-sliced query planning.
+
+Scholar serves at most about 1000 results per query. Larger crawls split the
+year range into slices, either one per year or by bisecting the range until
+every slice reports at most 1000 results, and share the requested number of
+results between the slices. The slices are crawled together and their
+results merged back into a single ranking.
+"""
+from collections import namedtuple
+import math
+
+MAX_RESULTS_PER_QUERY = 1000
+RESULTS_PER_PAGE = 10
+FIRST_YEAR = 1900  # Lower bound of the range bisected when no start year is given
+SLICE_MODES = ['year', 'auto']
+
+
+class YearSlice(namedtuple('YearSlice', ['start_year', 'end_year', 'count'])):
+    """Years start_year..end_year (inclusive) and the number of results reported, if known."""
+
+    @property
+    def key(self):
+        return f'{self.start_year}-{self.end_year}'
+
+
+def year_slices(start_year, end_year):
+    """Returns one slice per year."""
+    return [YearSlice(year, year, None) for year in range(start_year, end_year + 1)]
+
+
+async def bisect_slices(start_year, end_year, count_results, cap=MAX_RESULTS_PER_QUERY):
+    """
+    Splits start_year..end_year until every slice has at most `cap` results.
+
+    `count_results(start_year, end_year)` is awaited for every candidate slice
+    and returns its number of results, or None when unknown. Both halves of a
+    split are counted concurrently. A single year is never split further.
+    """
+    import asyncio  # Not loaded by the command line before the search starts
+
+    count = await count_results(start_year, end_year)
+    if count is None or count <= cap or start_year == end_year:
+        return [YearSlice(start_year, end_year, count)]
+    middle = (start_year + end_year) // 2
+    lower, upper = await asyncio.gather(bisect_slices(start_year, middle, count_results, cap),
+                                        bisect_slices(middle + 1, end_year, count_results, cap))
+    return lower + upper
+
+
+def allocate(slices, nresults, cap=MAX_RESULTS_PER_QUERY):
+    """
+    Returns the number of results to fetch from each slice, in whole pages.
+
+    Slices smaller than their share get all their results and the rest is
+    shared between the larger ones. Slices of unknown size count as full.
+    """
+    capacities = [cap if s.count is None else min(s.count, cap) for s in slices]
+    budgets = [0] * len(slices)
+    remaining = nresults
+    # Smallest slices first, so what they can't use goes to the others
+    order = sorted(range(len(slices)), key=lambda i: capacities[i])
+    for done, i in enumerate(order):
+        share = math.ceil(remaining / (len(slices) - done))
+        budgets[i] = min(capacities[i], share)
+        remaining -= budgets[i]
+    return [min(cap, math.ceil(budget / RESULTS_PER_PAGE) * RESULTS_PER_PAGE) for budget in budgets]
@@ -0,0 +1,191 @@
+"""
+Scoring, ranking and plotting of the results once the crawl is over.
+
+Everything works on whole columns with numpy, so large merged tables are
+scored in a single pass. Tables are sorted on one or more keys, written
+as a comma-separated list where each column sorts in descending order
+unless it ends with ' asc':
+
+    keys = parse_sortby('cit/year, Year asc')
+    data['Score'] = score(data, {'Citations': 1, 'cit/year': 10}, half_life=5, end_year=2024)
+    best = sort_frame(data, keys, top=100)
+
+With `top`, the best rows are picked with a partial selection
+(numpy.argpartition) and only those are sorted, instead of the whole table.
+"""
+
+MAX_PLOT_POINTS = 5000  # Points per keyword drawn on a plot, larger results are downsampled
+SCORE = 'Score'
+
+
+class Descending:
+    """Sort key wrapper that reverses the order of any comparable value."""
+    __slots__ = ('value',)
+
+    def __init__(self, value):
+        self.value = value
+
+    def __lt__(self, other):
+        return other.value < self.value
+
+    def __eq__(self, other):
+        return self.value == other.value
+
+
+def parse_sortby(sortby):
+    """Returns the (column, ascending) keys of a sort specification, e.g. 'Citations, Year asc'."""
+    keys = []
+    for part in sortby.split(','):
+        column = part.strip()
+        ascending = False
+        words = column.rsplit(' ', 1)
+        if len(words) == 2 and words[1].lower() in ('asc', 'desc'):
+            column, ascending = words[0].strip(), words[1].lower() == 'asc'
+        if column:
+            keys.append((column, ascending))
+    return keys
+
+
+def row_key(keys):
+    """Returns a sort key function of dict rows that orders them by `keys`, for sorted or heapq.merge."""
+    def key(row):
+        return tuple(row[column] if ascending else Descending(row[column]) for column, ascending in keys)
+    return key
+
+
+def parse_weights(weights, columns=None):
+    """
+    Returns the {column: weight} of a weight specification, e.g.
+    'Citations=1,cit/year=10'. With `columns`, only those columns can be
+    weighted.
+    """
+    parsed = {}
+    for part in weights.split(','):
+        column, sep, weight = part.rpartition('=')
+        column = column.strip()
+        if not sep or not column:
+            raise ValueError(f'Weights are written as column=weight: {part}')
+        if columns is not None and column not in columns:
+            raise ValueError(f'Only numeric columns can be weighted ({", ".join(columns)}): {column}')
+        parsed[column] = float(weight)
+    return parsed
+
+
+def score(data, weights=None, half_life=None, end_year=None):
+    """
+    Returns the weighted sum of the `weights` columns of every row, by
+    default the citations. With `half_life`, the score of a paper halves
+    every `half_life` years before `end_year`; papers without a year are
+    not decayed.
+    """
+    import numpy as np
+
+    weights = weights or {'Citations': 1}
+    total = np.zeros(len(data))
+    for column, weight in weights.items():
+        total += weight * data[column].to_numpy(dtype=float, na_value=0)
+    if half_life:
+        years = data['Year'].to_numpy(dtype=float, na_value=0)
+        age = np.where(years > 0, np.clip(end_year - years, 0, None), 0)
+        total *= np.exp2(-age / half_life)
+    return total.round(2)
+
+
+def row_score(weights=None, half_life=None, end_year=None):
+    """
+    Returns a function that scores a single dict row as `score` scores the
+    rows of a table, for the rows written to the output files as the crawl goes.
+    """
+    import numpy as np
+
+    weights = weights or {'Citations': 1}
+
+    def row_score(row):
+        total = 0.0
+        for column, weight in weights.items():
+            total += weight * float(row[column] or 0)
+        if half_life:
+            year = float(row['Year'] or 0)
+            age = max(end_year - year, 0) if year > 0 else 0
+            total *= np.exp2(-age / half_life)
+        return float(np.round(total, 2))
+    return row_score
+
+
+def top_positions(data, keys, top):
+    """
+    Returns the positions of the rows that can make the `top` best, found
+    with a partial selection on the first key: the `top` best values and
+    every row tied with the last of them. None when the first key isn't
+    numeric or has missing values among the best.
+    """
+    import numpy as np
+
+    column, ascending = keys[0]
+    if data[column].dtype.kind not in 'iuf':
+        return None
+    values = data[column].to_numpy(dtype=float, na_value=np.nan)
+    if not ascending:
+        values = -values
+    kth = values[np.argpartition(values, top - 1)[top - 1]]
+    if np.isnan(kth):
+        return None
+    return np.flatnonzero(values <= kth)
+
+
+def sort_frame(data, keys, top=None):
+    """Returns `data` sorted by `keys`, stable, with only the `top` first rows when given."""
+    if top is not None and top < len(data):
+        positions = top_positions(data, keys, top)
+        if positions is not None:
+            data = data.iloc[positions]
+    data = data.sort_values([column for column, _ in keys], ascending=[ascending for _, ascending in keys],
+                            kind='stable')
+    return data if top is None else data.head(top)
+
+
+def downsample(values, max_points=MAX_PLOT_POINTS):
+    """
+    Returns the sorted positions of at most `max_points` values to plot:
+    evenly spaced ones, so the shape of the curve is kept, and the largest
+    ones, so outliers stay visible.
+    """
+    import numpy as np
+
+    n = len(values)
+    if n <= max_points:
+        return np.arange(n)
+    n_top = max_points // 10
+    largest = np.argpartition(-np.asarray(values, dtype=float), n_top - 1)[:n_top] if n_top else []
+    spaced = np.linspace(0, n - 1, max_points - n_top).astype(int)
+    return np.union1d(spaced, largest)
+
+
+def plot_results(frames, fpath=None, max_points=MAX_PLOT_POINTS):
+    """
+    Plots the citations of every {keyword: data} table against their rank
+    on Scholar. The plot is saved to `fpath` without opening a window, or
+    shown when no file is given.
+    """
+    import matplotlib
+    if fpath:
+        matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots()
+    for keyword, data in frames.items():
+        citations = data['Citations'].to_numpy()
+        keep = downsample(citations, max_points)
+        ax.plot(data.index.to_numpy()[keep], citations[keep], '*', label=keyword)
+    ax.set_ylabel('Number of Citations')
+    ax.set_xlabel('Rank of the keyword on Google Scholar')
+    if len(frames) > 1:
+        ax.set_title(f'Keywords: {", ".join(frames)}')
+        ax.legend()
+    else:
+        ax.set_title(f'Keyword: {next(iter(frames))}')
+    if fpath:
+        fig.savefig(fpath)
+        plt.close(fig)
+    else:
+        plt.show()
@@ -0,0 +1,131 @@
+"""
+Adaptive request rate for Google Scholar.
+
+The rate follows an AIMD rule: every clean result page raises it by a small
+step, and every throttled answer (HTTP 429 or 503, or a robot-check page)
+halves it and pauses all requests for a backoff that doubles with every
+throttle in a row, or for the server's Retry-After. The rate reached at the
+end of a run is saved, so the next run starts from it instead of from the
+default.
+
+    controller = RateController.load('~/.cache/sortgs/rate.json')
+    async with PageFetcher(controller=controller) as fetcher:
+        ...
+    controller.save()
+    print(controller.summary())
+"""
+from collections import Counter
+import json
+import os
+import time
+
+from sortgs.fetcher import RATE, TokenBucket
+from sortgs.sortgs import MAX_RATE  # Never faster unless a higher start rate is given
+
+MIN_RATE = 0.02  # Result pages per second, never slower
+INCREASE = 0.02  # Added to the rate after every clean page
+DECREASE = 0.5  # Factor applied to the rate after every throttled answer
+BACKOFF = 30  # Seconds of the first pause, doubled with every throttle in a row
+MAX_BACKOFF = 600
+MAX_RETRIES = 3  # Attempts at a throttled page before giving up on it
+STATE_FNAME = 'rate.json'
+STATE_TTL = 7 * 24 * 3600  # Seconds a saved rate is trusted
+
+
+class RateController:
+    """
+    AIMD controller of the token bucket shared by the page requests.
+
+    `metrics` counts the requests, clean pages, throttled answers by reason
+    and the seconds spent in backoff, and `lowest_rate`/`highest_rate` keep
+    the range the rate went through during the run. With `adaptive` off the
+    rate stays fixed and answers are only counted.
+    """
+
+    def __init__(self, rate=RATE, min_rate=MIN_RATE, max_rate=MAX_RATE, increase=INCREASE, decrease=DECREASE,
+                 backoff=BACKOFF, max_backoff=MAX_BACKOFF, max_retries=MAX_RETRIES, jitter=None,
+                 state_path=None, adaptive=True):
+        self.min_rate = min(min_rate, rate)
+        self.max_rate = max(max_rate, rate)
+        self.increase = increase
+        self.decrease = decrease
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.max_retries = max_retries
+        self.state_path = state_path
+        self.adaptive = adaptive
+        self.bucket = TokenBucket(rate) if jitter is None else TokenBucket(rate, jitter=jitter)
+        self.start_rate = rate
+        self.lowest_rate = self.highest_rate = rate
+        self.metrics = Counter()
+        self._in_a_row = 0
+
+    @classmethod
+    def load(cls, state_path, rate=None, **kwargs):
+        """
+        Returns a controller starting at `rate`, or at the rate saved in
+        `state_path` by a recent run, or at the default rate.
+        """
+        if rate is None:
+            rate = RATE
+            try:
+                with open(state_path) as f:
+                    state = json.load(f)
+                if time.time() - state['updated'] < STATE_TTL:
+                    rate = float(state['rate'])
+            except (OSError, ValueError, KeyError, TypeError):
+                pass
+        return cls(rate, state_path=state_path, **kwargs)
+
+    def save(self):
+        """Saves the current rate for the next runs."""
+        if self.state_path is None or not self.adaptive or not self.metrics['requests']:
+            return
+        os.makedirs(os.path.dirname(self.state_path) or '.', exist_ok=True)
+        tmp_path = self.state_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'rate': self.rate, 'updated': time.time()}, f)
+        os.replace(tmp_path, self.state_path)
+
+    @property
+    def rate(self):
+        return self.bucket.rate
+
+    def _set_rate(self, rate):
+        self.bucket.rate = min(self.max_rate, max(self.min_rate, rate))
+        self.lowest_rate = min(self.lowest_rate, self.bucket.rate)
+        self.highest_rate = max(self.highest_rate, self.bucket.rate)
+
+    def success(self):
+        """Records a clean page: the rate goes up by one step."""
+        self.metrics['requests'] += 1
+        self.metrics['clean'] += 1
+        self._in_a_row = 0
+        if self.adaptive:
+            self._set_rate(self.rate + self.increase)
+
+    def throttled(self, reason, retry_after=None):
+        """
+        Records a throttled answer: the rate goes down and every request
+        pauses. Returns the pause in seconds.
+        """
+        self.metrics['requests'] += 1
+        self.metrics[f'throttled_{reason}'] += 1
+        if not self.adaptive:
+            return 0
+        self._in_a_row += 1
+        self._set_rate(self.rate * self.decrease)
+        delay = retry_after
+        if delay is None:
+            delay = self.backoff * 2 ** (self._in_a_row - 1)
+        delay = min(delay, self.max_backoff)
+        self.metrics['backoff_seconds'] += delay
+        self.bucket.pause(delay)
+        return delay
+
+    def summary(self):
+        throttled = {key[len('throttled_'):]: n for key, n in self.metrics.items() if key.startswith('throttled_')}
+        throttled = ', '.join(f'{reason}: {n}' for reason, n in sorted(throttled.items())) or 'none'
+        return (f"Requests: {self.metrics['requests']}, clean: {self.metrics['clean']}, throttled: {throttled}, "
+                f"backoff: {self.metrics['backoff_seconds']:.0f} s, rate: {self.start_rate:.2f} -> {self.rate:.2f} "
+                f"pages/s (range {self.lowest_rate:.2f}-{self.highest_rate:.2f})")
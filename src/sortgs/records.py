@@ -0,0 +1,107 @@
+"""
+Records of the papers collected during a run.
+
+A `Paper` holds one result. `PaperTable` keeps them column by column, with
+the integer columns in typed arrays, so appending a result costs a few list
+appends and the whole table turns into a DataFrame without building a row
+tuple per paper.
+"""
+from array import array
+from dataclasses import dataclass
+from typing import Optional
+
+# Attribute, column name and whether the column holds integers
+FIELDS = [
+    ('id', 'ID', False),
+    ('author', 'Author', False),
+    ('title', 'Title', False),
+    ('citations', 'Citations', True),
+    ('year', 'Year', True),
+    ('publisher', 'Publisher', False),
+    ('venue', 'Venue', False),
+    ('source', 'Source', False),
+    ('download_link', 'Download Link', False),
+    ('rank', 'Rank', True),
+    ('keyword', 'Keyword', False),
+    ('slice', 'Slice', False),
+]
+COLUMNS = [column for _, column, _ in FIELDS]
+
+
+@dataclass
+class Paper:
+    """A single result. `rank` is its rank within the query (keyword and year range) that found it."""
+    __slots__ = tuple(name for name, _, _ in FIELDS)
+    id: str
+    author: str
+    title: str
+    citations: int
+    year: int
+    publisher: str
+    venue: str
+    source: str
+    download_link: Optional[str]
+    rank: int
+    keyword: str
+    slice: str
+
+    @classmethod
+    def from_row(cls, row, keyword=None):
+        """Builds a paper from a row with the column names, e.g. a checkpoint row."""
+        values = {name: row.get(column) for name, column, _ in FIELDS}
+        values['keyword'] = row.get('Keyword', keyword)
+        values['slice'] = row.get('Slice', '')
+        return cls(**values)
+
+    def to_row(self, **extra):
+        """Returns the paper as a dict with the column names, plus `extra` columns."""
+        row = {column: getattr(self, name) for name, column, _ in FIELDS}
+        row.update(extra)
+        return row
+
+    @property
+    def query(self):
+        return self.keyword, self.slice
+
+
+class PaperTable:
+    """
+    Column-oriented table of papers.
+
+        table = PaperTable()
+        table.append(paper)
+        table[-1]          # Paper
+        table.to_frame()   # pandas DataFrame with the COLUMNS
+
+    The integer columns of the frame share memory with the table, which
+    can't grow while they are in use, so build the frame once the run is over.
+    """
+
+    def __init__(self):
+        self._columns = {name: array('q') if is_int else [] for name, _, is_int in FIELDS}
+
+    def __len__(self):
+        return len(self._columns['id'])
+
+    def append(self, paper):
+        for name, column in self._columns.items():
+            column.append(getattr(paper, name))
+
+    def __getitem__(self, i):
+        return Paper(*(column[i] for column in self._columns.values()))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def column(self, name):
+        return self._columns[name]
+
+    def to_frame(self):
+        import numpy as np
+        import pandas as pd
+
+        # Integer columns are wrapped without copying their buffer
+        data = {column: np.frombuffer(self._columns[name], dtype=np.int64) if is_int else self._columns[name]
+                for name, column, is_int in FIELDS}
+        return pd.DataFrame(data, columns=COLUMNS, copy=False)
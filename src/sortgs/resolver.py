@@ -0,0 +1,165 @@
+"""
+Resolution of PDF links behind the 'HTML' download badges of Scholar results.
+
+Landing pages are fetched asynchronously over their own connections, with
+a timeout and a concurrency limit per domain. Each page is scanned while it streams in and the request
+is dropped as soon as a PDF anchor shows up. Results, including pages
+without any PDF link, are kept in a persistent URL -> PDF cache so the same
+landing page is never resolved twice, across runs and queries.
+"""
+from urllib.parse import urljoin, urlsplit
+import asyncio
+import html
+import json
+import os
+import re
+
+RESOLVE_TIMEOUT = 15  # Seconds allowed to resolve one landing page
+LIMIT_PER_DOMAIN = 2  # Landing pages fetched at the same time from one domain
+CHUNK_SIZE = 16 * 1024
+MAX_PAGE_SIZE = 4 * 2**20  # Stop reading a landing page after 4 MiB
+CACHE_FNAME = 'links.jsonl'
+
+HREF_RE = re.compile(rb'<a\s[^>]*?href\s*=\s*(?:"([^"]*)"|\'([^\']*)\'|([^\s>]+))', re.IGNORECASE)
+OVERLAP = 2048  # Bytes scanned again after each chunk, so split tags are not missed
+
+
+def find_pdf_link(base, data):
+    """Returns the first anchor of `data` whose resolved URL mentions 'pdf'."""
+    for match in HREF_RE.finditer(data):
+        href = next(group for group in match.groups() if group is not None)
+        resolved_link = urljoin(base, html.unescape(href.decode('utf-8', errors='replace')))
+        if 'pdf' in resolved_link.lower():
+            return resolved_link
+    return None
+
+
+class LinkCache:
+    """
+    Persistent URL -> resolved PDF link map, stored as JSON lines.
+
+    A value of None records a landing page without a PDF link.
+    """
+
+    def __init__(self, fpath=None):
+        self.fpath = fpath
+        self.links = {}
+        if fpath and os.path.exists(fpath):
+            with open(fpath, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Partial write from an interrupted run
+                    self.links[entry['url']] = entry['pdf']
+
+    def __contains__(self, url):
+        return url in self.links
+
+    def get(self, url):
+        return self.links.get(url)
+
+    def put(self, url, pdf_link):
+        self.links[url] = pdf_link
+        if self.fpath:
+            os.makedirs(os.path.dirname(self.fpath) or '.', exist_ok=True)
+            with open(self.fpath, 'a', encoding='utf-8') as f:
+                f.write(json.dumps({'url': url, 'pdf': pdf_link}) + '\n')
+
+
+class LinkResolver:
+    """
+    Finds the PDF link of external landing pages.
+
+        async with LinkResolver(cache_path='~/.cache/sortgs/links.jsonl') as resolver:
+            pdf_link = await resolver.resolve(link)  # None if not found
+
+    Used as a context manager, the resolver opens its own aiohttp session,
+    whose connections are only limited per domain, so the timeout of a
+    landing page never counts the time spent waiting for the PDF downloads
+    or the Scholar pages. An open `session` can be given instead.
+    """
+
+    def __init__(self, session=None, cache_path=None, timeout=RESOLVE_TIMEOUT, limit_per_domain=LIMIT_PER_DOMAIN):
+        self.session = session
+        self._own_session = False
+        self.cache = LinkCache(cache_path)
+        self.timeout = timeout
+        self.limit_per_domain = limit_per_domain
+        self._domains = {}
+        self._in_flight = {}
+
+    async def __aenter__(self):
+        import aiohttp
+
+        if self.session is None:
+            # Landing pages are already limited per domain by the semaphores
+            connector = aiohttp.TCPConnector(limit=0, ttl_dns_cache=300)
+            self.session = aiohttp.ClientSession(connector=connector)
+            self._own_session = True
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        if self._own_session:
+            await self.session.close()
+            self.session = None
+            self._own_session = False
+
+    def _domain_semaphore(self, link):
+        domain = urlsplit(link).netloc
+        if domain not in self._domains:
+            self._domains[domain] = asyncio.Semaphore(self.limit_per_domain)
+        return self._domains[domain]
+
+    async def resolve(self, link):
+        """Returns the PDF link found at `link`, from the cache when possible."""
+        if link in self.cache:
+            return self.cache.get(link)
+        # Papers sharing a landing page wait for the same request
+        if link not in self._in_flight:
+            self._in_flight[link] = asyncio.ensure_future(self._resolve(link))
+        try:
+            return await asyncio.shield(self._in_flight[link])
+        finally:
+            task = self._in_flight.get(link)
+            if task is not None and task.done():
+                del self._in_flight[link]
+
+    async def _resolve(self, link):
+        import aiohttp
+
+        try:
+            async with self._domain_semaphore(link):
+                pdf_link = await asyncio.wait_for(self._scan(link), self.timeout)
+        except asyncio.TimeoutError:
+            print(f"Timeout while resolving external link: {link}")
+            return None
+        except aiohttp.ClientError as e:
+            print(f"Network error while resolving external link {link}: {e}")
+            return None
+        except Exception as e:
+            print(f"Error extracting download link: {e}")
+            return None
+        self.cache.put(link, pdf_link)
+        return pdf_link
+
+    async def _scan(self, link):
+        async with self.session.get(link) as response:
+            response.raise_for_status()
+            base = str(response.url)
+            if 'application/pdf' in response.headers.get('content-type', ''):
+                return base
+
+            tail = b''
+            size = 0
+            async for chunk in response.content.iter_chunked(CHUNK_SIZE):
+                size += len(chunk)
+                data = tail + chunk
+                pdf_link = find_pdf_link(base, data)
+                if pdf_link:
+                    return pdf_link  # Leaving the block drops the rest of the page
+                if size >= MAX_PAGE_SIZE:
+                    break
+                # Only the tail can hold a tag split across chunks
+                tail = data[-OVERLAP:]
+        return None
@@ -0,0 +1,366 @@
+"""
+Output files written while the crawl goes.
+
+A sink receives the rows of every result page as soon as it is parsed and
+appends them to its file, so other programs can read results before the
+run is over. Rows arrive in crawl order; when the run ends, `finalize`
+drops repeated papers, numbers the ranks and leaves the file sorted by
+the selected columns (see sortgs.postprocess.parse_sortby) it holds. The
+CSV, JSON lines and Parquet files are sorted with an external sort, and
+the SQLite database with an index and a view, so the results are never
+all held in memory. Sinks opened with `columns=COLUMNS + [SCORE]` also
+keep the score that the caller adds to every row.
+
+    sink = open_sink('jsonl', 'results/machine_learning', sortby='Citations')
+    sink.write(rows)  # after each page
+    sink.finalize()
+    for row in sink.read():  # Ranked and sorted, one row at a time
+        ...
+"""
+import csv
+from itertools import islice
+import json
+import os
+import sqlite3
+import tempfile
+
+from sortgs.extsort import RUN_SIZE, external_sort
+from sortgs.postprocess import SCORE, parse_sortby, row_key
+
+FORMATS = ['csv', 'jsonl', 'parquet', 'sqlite']
+COLUMNS = ['Rank', 'ID', 'Author', 'Title', 'Citations', 'Year', 'Publisher', 'Venue', 'Source',
+           'Download Link', 'cit/year']
+INT_COLUMNS = ['Rank', 'Citations', 'Year', 'cit/year']
+FLOAT_COLUMNS = [SCORE]
+MERGED_COLUMNS = COLUMNS + ['Keywords']  # Merged table of several keywords
+SORTBY = 'Citations'
+
+
+def sql_type(column):
+    """Returns the SQLite type of an output column."""
+    if column in INT_COLUMNS:
+        return 'INTEGER'
+    return 'REAL' if column in FLOAT_COLUMNS else 'TEXT'
+
+
+def arrow_type(pa, column):
+    """Returns the Arrow type of an output column."""
+    if column in INT_COLUMNS:
+        return pa.int64()
+    return pa.float64() if column in FLOAT_COLUMNS else pa.string()
+
+
+def rank_rows(rows, max_rank=None):
+    """
+    Numbers rows sorted in crawl order from 1, keeping the first row of each
+    paper ID and stopping after `max_rank` rows.
+    """
+    seen = set()
+    for row in rows:
+        if row['ID'] in seen:
+            continue
+        seen.add(row['ID'])
+        if max_rank is not None and len(seen) > max_rank:
+            return
+        yield dict(row, Rank=len(seen))
+
+
+class Sink:
+    """Base class of the output sinks. `ext` is the file extension."""
+    ext = None
+
+    def __init__(self, fpath_base, sortby=SORTBY, max_rank=None, columns=COLUMNS):
+        self.fpath = fpath_base + '.' + self.ext
+        self.columns = columns
+        # Columns computed after the crawl are not in the files
+        self.sort_keys = [(column, ascending) for column, ascending in parse_sortby(sortby)
+                          if column in columns] or [(SORTBY, False)]
+        self.max_rank = max_rank
+        if os.path.exists(self.fpath):
+            os.remove(self.fpath)  # Output of an earlier run
+
+    def write(self, rows):
+        raise NotImplementedError
+
+    def finalize(self):
+        raise NotImplementedError
+
+    def read(self):
+        """Yields the rows of the file one at a time, ranked and sorted once it is finalized."""
+        return self._read()
+
+    def _read(self):
+        raise NotImplementedError
+
+    def _replace(self, write_rows, rows):
+        """Writes `rows` to a temporary file with `write_rows(f, rows)`, then renames it over the output."""
+        directory = os.path.dirname(self.fpath) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+                write_rows(f, rows)
+            os.replace(tmp_path, self.fpath)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _sorted_rows(self):
+        """Yields the rows written so far, ranked and sorted by the selected columns."""
+        directory = os.path.dirname(self.fpath) or '.'
+        rows = external_sort(self._read(), key=lambda row: row['Rank'], tmp_dir=directory)
+        rows = rank_rows(rows, self.max_rank)
+        return external_sort(rows, key=row_key(self.sort_keys), tmp_dir=directory)
+
+
+class CsvSink(Sink):
+    ext = 'csv'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file = None
+
+    def _write_rows(self, f, rows, header=True):
+        writer = csv.DictWriter(f, self.columns, extrasaction='ignore')
+        if header:
+            writer.writeheader()
+        writer.writerows(rows)
+
+    def write(self, rows):
+        if self._file is None:
+            self._file = open(self.fpath, 'w', encoding='utf-8', newline='')
+            self._write_rows(self._file, [])
+        self._write_rows(self._file, rows, header=False)
+        self._file.flush()
+
+    def _read(self):
+        with open(self.fpath, encoding='utf-8', newline='') as f:
+            for row in csv.DictReader(f):
+                for column in INT_COLUMNS:
+                    row[column] = int(row[column])
+                for column in FLOAT_COLUMNS:
+                    if column in row:
+                        row[column] = float(row[column])
+                row['Download Link'] = row['Download Link'] or None
+                yield row
+
+    def finalize(self):
+        if self._file is None:
+            self.write([])
+        self._file.close()
+        self._replace(self._write_rows, self._sorted_rows())
+
+
+class JsonlSink(Sink):
+    ext = 'jsonl'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._file = None
+
+    def _write_rows(self, f, rows):
+        for row in rows:
+            f.write(json.dumps({column: row[column] for column in self.columns}, ensure_ascii=False) + '\n')
+
+    def write(self, rows):
+        if self._file is None:
+            self._file = open(self.fpath, 'w', encoding='utf-8')
+        self._write_rows(self._file, rows)
+        self._file.flush()
+
+    def _read(self):
+        with open(self.fpath, encoding='utf-8') as f:
+            for line in f:
+                yield json.loads(line)
+
+    def finalize(self):
+        if self._file is None:
+            self.write([])
+        self._file.close()
+        self._replace(self._write_rows, self._sorted_rows())
+
+
+class SqliteSink(Sink):
+    """
+    Rows go to the `results` table, committed after every page. Finalizing
+    replaces it with the `ranked` table, indexed on the sort columns, and
+    the `sorted` view that lists it by those columns.
+    """
+    ext = 'sqlite'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.db = sqlite3.connect(self.fpath)
+        columns = ', '.join(f'"{column}" {sql_type(column)}' for column in self.columns)
+        self.db.execute(f'CREATE TABLE results ({columns})')
+
+    def write(self, rows):
+        placeholders = ', '.join('?' for _ in self.columns)
+        self.db.executemany(f'INSERT INTO results VALUES ({placeholders})',
+                            ([row[column] for column in self.columns] for row in rows))
+        self.db.commit()
+
+    def finalize(self):
+        other_columns = ', '.join(f'"{column}"' for column in self.columns[1:])
+        limit = f'WHERE "Rank" <= {int(self.max_rank)}' if self.max_rank is not None else ''
+        with self.db:
+            # Keep the first result of each paper and number the ranks again
+            self.db.execute(f'''
+                CREATE TABLE ranked AS
+                SELECT * FROM (
+                    SELECT ROW_NUMBER() OVER (ORDER BY "Rank") AS "Rank", {other_columns}
+                    FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY "ID" ORDER BY "Rank") AS copy FROM results)
+                    WHERE copy = 1)
+                {limit}''')
+            self.db.execute('DROP TABLE results')
+            order = ', '.join(f'"{column}" {"ASC" if ascending else "DESC"}' for column, ascending in self.sort_keys)
+            self.db.execute(f'CREATE INDEX ranked_by_sort ON ranked ({order})')
+            self.db.execute(f'CREATE VIEW sorted AS SELECT * FROM ranked ORDER BY {order}, "Rank"')
+        self.db.close()
+
+    def _read(self):
+        db = sqlite3.connect(self.fpath)
+        try:
+            cursor = db.execute('SELECT * FROM sorted')
+            columns = [description[0] for description in cursor.description]
+            for row in cursor:
+                yield dict(zip(columns, row))
+        finally:
+            db.close()
+
+
+class ParquetSink(Sink):
+    """
+    Each page is written as a row group. Finalizing ranks and sorts the rows
+    with external sorts, read and written back a row group at a time.
+    """
+    ext = 'parquet'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError('Parquet output needs pyarrow: pip install "sortgs[parquet]"')
+        self.pa = pa
+        self.pq = pq
+        self.schema = pa.schema([(column, arrow_type(pa, column)) for column in self.columns])
+        self._writer = None
+
+    def write(self, rows):
+        if self._writer is None:
+            self._writer = self.pq.ParquetWriter(self.fpath, self.schema)
+        if rows:
+            self._writer.write_table(self.pa.Table.from_pylist(rows, schema=self.schema))
+
+    def finalize(self):
+        if self._writer is None:
+            self.write([])
+        self._writer.close()
+
+        directory = os.path.dirname(self.fpath) or '.'
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp.' + self.ext)
+        os.close(fd)
+        try:
+            write_rows(self._sorted_rows(), self.ext, tmp_path[:-len('.' + self.ext)], self.columns)
+            os.replace(tmp_path, self.fpath)
+        except BaseException:
+            os.remove(tmp_path)
+            raise
+
+    def _read(self):
+        for batch in self.pq.ParquetFile(self.fpath).iter_batches():
+            yield from batch.to_pylist()
+
+
+SINKS = {'csv': CsvSink, 'jsonl': JsonlSink, 'parquet': ParquetSink, 'sqlite': SqliteSink}
+
+
+def open_sink(fmt, fpath_base, sortby=SORTBY, max_rank=None, columns=COLUMNS):
+    """Returns a sink writing `fmt` to `fpath_base` with the extension of the format, e.g. `.csv`."""
+    if fmt not in SINKS:
+        raise ValueError(f'Unknown output format: {fmt}')
+    return SINKS[fmt](fpath_base, sortby=sortby, max_rank=max_rank, columns=columns)
+
+
+def write_frame(data, fmt, fpath_base):
+    """Writes a DataFrame that is already complete, such as the merged results, in format `fmt`."""
+    fpath = fpath_base + '.' + fmt
+    if fmt == 'csv':
+        data.to_csv(fpath, encoding='utf-8')
+    elif fmt == 'jsonl':
+        data.reset_index().to_json(fpath, orient='records', lines=True, force_ascii=False)
+    elif fmt == 'parquet':
+        data.to_parquet(fpath)
+    elif fmt == 'sqlite':
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        with sqlite3.connect(fpath) as db:
+            data.to_sql('results', db)
+        db.close()
+    else:
+        raise ValueError(f'Unknown output format: {fmt}')
+
+
+def write_rows(rows, fmt, fpath_base, columns=COLUMNS):
+    """
+    Writes rows that are already complete and sorted, such as the output of
+    an external sort, in format `fmt`. Rows are consumed one at a time, or
+    by batches of RUN_SIZE for Parquet, and are never all held in memory.
+    """
+    fpath = fpath_base + '.' + fmt
+    if fmt == 'csv':
+        with open(fpath, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, columns, extrasaction='ignore')
+            writer.writeheader()
+            writer.writerows(rows)
+    elif fmt == 'jsonl':
+        with open(fpath, 'w', encoding='utf-8') as f:
+            for row in rows:
+                f.write(json.dumps({column: row[column] for column in columns}, ensure_ascii=False) + '\n')
+    elif fmt == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        schema = pa.schema([(column, arrow_type(pa, column)) for column in columns])
+        rows = iter(rows)
+        with pq.ParquetWriter(fpath, schema) as writer:
+            while True:
+                batch = list(islice(rows, RUN_SIZE))
+                if not batch:
+                    break
+                writer.write_table(pa.Table.from_pylist(batch, schema=schema))
+    elif fmt == 'sqlite':
+        if os.path.exists(fpath):
+            os.remove(fpath)
+        db = sqlite3.connect(fpath)
+        with db:
+            db.execute('CREATE TABLE results ({})'.format(', '.join(
+                f'"{column}" {sql_type(column)}' for column in columns)))
+            db.executemany(f'INSERT INTO results VALUES ({", ".join("?" for _ in columns)})',
+                           ([row[column] for column in columns] for row in rows))
+        db.close()
+    else:
+        raise ValueError(f'Unknown output format: {fmt}')
+
+
+def read_frame(fpath):
+    """Reads the results saved by an earlier run, in any of the FORMATS, as a DataFrame with the COLUMNS."""
+    import pandas as pd
+
+    fmt = os.path.splitext(fpath)[1][1:]
+    if fmt == 'csv':
+        data = pd.read_csv(fpath)
+    elif fmt == 'jsonl':
+        data = pd.read_json(fpath, orient='records', lines=True)
+    elif fmt == 'parquet':
+        data = pd.read_parquet(fpath)
+    elif fmt == 'sqlite':
+        with sqlite3.connect(fpath) as db:
+            data = pd.read_sql('SELECT * FROM ranked', db)
+        db.close()
+    else:
+        raise ValueError(f'Unknown output format: {fmt}')
+    # Missing download links are read back as NaN
+    data['Download Link'] = data['Download Link'].astype(object).where(data['Download Link'].notna(), None)
+    return data
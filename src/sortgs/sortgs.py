@@ -15,28 +15,18 @@ a .csv file.
 
 
 """
-from urllib.parse import urljoin
-import requests
-import bs4
-import requests, os, datetime, argparse
-from bs4 import BeautifulSoup
-import matplotlib.pyplot as plt
-import pandas as pd
-import aiohttp
-import asyncio
-from aiofiles import open as aio_open
+from itertools import islice
+import os, datetime, argparse
 from time import sleep
-import warnings
 import random
-import os
-import re
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.common.exceptions import StaleElementReferenceException
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
+# Heavy modules (pandas, matplotlib, selenium, aiohttp, bs4) are only imported
+# where they are used, so that `sortgs --help` and plain runs start quickly.
+# The defaults of the light modules are imported from them; the modules that
+# load asyncio (fetcher, ratecontrol) import theirs from the defaults below
+from sortgs.planner import MAX_RESULTS_PER_QUERY, SLICE_MODES
+from sortgs.postprocess import MAX_PLOT_POINTS
+from sortgs.sinks import FORMATS, SORTBY
 
 # Solve conflict between raw_input and input on Python 2 and Python 3
 import sys
@@ -47,7 +37,6 @@ KEYWORD = 'machine learning' # Default argument if command line is empty
 NRESULTS = 40# Fetch 100 articles
 CSVPATH = os.getcwd() # Current folder as default path
 SAVECSV = True
-SORTBY = 'Citations'
 PLOT_RESULTS = True
 STARTYEAR = None
 now = datetime.datetime.now()
@@ -55,8 +44,20 @@ ENDYEAR = now.year # Current year
 DEBUG=False # debug mode
 MAX_CSV_FNAME = 255
 LANG = 'All'
-MAX_RETRIES = 4
-RETRY_DELAY = 2 
+CACHE_DIR = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.expanduser('~/.cache')), 'sortgs')
+CACHE_TTL = 24 # Hours a cached result page stays valid
+MAX_CONCURRENCY = 4 # Result pages fetched at the same time
+RATE = 0.5 # Result pages requested per second, when no earlier run learned a better rate
+MAX_RATE = 2.0 # Result pages requested per second, at most, unless --rate is higher
+BROWSERS = 2 # Headless browsers loading robot-checked pages at the same time
+MERGED_FNAME = 'merged.csv' # Merged table of a batch run with several keywords
+DIFF_SUFFIX = '_diff.csv' # Changes found by --refresh-from, next to the refreshed file
+REFRESH_SUFFIX = '.refresh' # Results of --refresh-from, renamed over the refreshed file once complete
+FORMAT = 'csv' # Format of the saved results
+PROFILE_TOP = 25 # Functions listed by --profile when --cprofile is given
+INDEX_TTL = 7 * 24 # Hours the results of a query are answered from the local index with --from-index
+PRINT_ROWS = 20 # Results printed per keyword with --low-memory, unless --top is given
+RESUME_BATCH = 100 # Rows of the checkpoint journal added back to the search at a time
 
 
 
@@ -71,11 +72,23 @@ LANG_URL = '&lr={}'
 
 ROBOT_KW=['unusual traffic from your computer network', 'not a robot']
 
+def read_keywords(fpath):
+    """Returns the keywords listed in a keyword file, one per line."""
+    with open(fpath, encoding='utf-8') as f:
+        lines = [line.strip() for line in f]
+    return [line for line in lines if line and not line.startswith('#')]
+
+
 def get_command_line_args():
     # Command line arguments
     parser = argparse.ArgumentParser(description='Arguments')
-    parser.add_argument('kw', type=str, help="""Keyword to be searched. Use double quote followed by simple quote to search for an exact keyword. Example: "'exact keyword'" """, default=KEYWORD)
-    parser.add_argument('--sortby', type=str, help='Column to be sorted by. Default is by the columns "Citations", i.e., it will be sorted by the number of citations. If you want to sort by citations per year, use --sortby "cit/year"')
+    parser.add_argument('kw', type=str, nargs='*', help="""Keyword to be searched. Use double quote followed by simple quote to search for an exact keyword. Example: "'exact keyword'". Several keywords are searched in a single batch run""")
+    parser.add_argument('--kwfile', type=str, help='File with one keyword per line to be searched in a single batch run. Empty lines and lines starting with # are skipped')
+    parser.add_argument('--sortby', type=str, help='Column to be sorted by. Default is by the columns "Citations", i.e., it will be sorted by the number of citations. If you want to sort by citations per year, use --sortby "cit/year". Several columns are separated by commas, and a column followed by "asc" is sorted in ascending order, e.g. --sortby "Citations, Year asc"')
+    parser.add_argument('--top', type=int, help='Only print the TOP best results of each keyword, and of the merged table. They are selected without sorting all the results. The saved files still hold every result')
+    parser.add_argument('--weights', type=str, help='Add a Score column, the weighted sum of the given columns among Rank, Citations, Year and cit/year, and sort by it unless --sortby is given. Example: --weights "Citations=1,cit/year=10"')
+    parser.add_argument('--half-life', type=float, help='Halve the Score of a paper for every HALF_LIFE years of age, to favour recent papers. The score is the number of citations unless --weights is given')
+    parser.add_argument('--plotfile', type=str, help=f'Save the plot of the results to this image file (e.g. plot.png) instead of showing it in a window. Results with more than {MAX_PLOT_POINTS} papers are downsampled')
     parser.add_argument('--langfilter', nargs='+', type=str, help='Only languages listed are permitted to pass the filter. List of supported language codes: zh-CN, zh-TW, nl, en, fr, de, it, ja, ko, pl, pt, es, tr')
 
     parser.add_argument('--nresults', type=int, help='Number of articles to search on Google Scholar. Default is 100. (carefull with robot checking if value is too high)')
@@ -85,6 +98,24 @@ def get_command_line_args():
     parser.add_argument('--startyear', type=int, help='Start year when searching. Default is None')
     parser.add_argument('--endyear', type=int, help='End year when searching. Default is current year')
     parser.add_argument('--debug', action='store_true', help='Debug mode. Used for unit testing. It will get pages stored on web archive')
+    parser.add_argument('--max-concurrency', type=int, help=f'Maximum number of result pages fetched at the same time. Default is {MAX_CONCURRENCY}')
+    parser.add_argument('--rate', type=float, help=f'Number of result pages requested per second at the start. The rate then goes up while pages come back clean and down when Scholar throttles. Default is the rate reached by the last run, or {RATE}')
+    parser.add_argument('--max-rate', type=float, help=f'Maximum number of result pages requested per second. Default is {MAX_RATE}')
+    parser.add_argument('--fixed-rate', action='store_true', help='Keep the rate of --rate during the whole run instead of adapting it')
+    parser.add_argument('--browsers', type=int, help=f'Number of headless browsers that load result pages at the same time when Scholar asks for a robot check. Default is {BROWSERS}')
+    parser.add_argument('--cache-dir', type=str, help=f'Folder where result pages, resolved PDF links and downloaded PDFs are cached. Default is {CACHE_DIR}')
+    parser.add_argument('--cache-ttl', type=float, help=f'Hours a cached result page stays valid. Use 0 to disable the page cache. Default is {CACHE_TTL}')
+    parser.add_argument('--refresh', action='store_true', help='Fetch every result page again instead of using cached pages. The cache is updated with the new pages')
+    parser.add_argument('--format', type=str, choices=FORMATS, help=f'Format of the saved results. Rows are written as soon as each page is parsed and sorted when the search ends. Parquet needs pyarrow. Default is {FORMAT}')
+    parser.add_argument('--from-index', type=float, nargs='?', const=INDEX_TTL, metavar='HOURS', help=f'Answer the search from the local index of the cache folder, where every run keeps the papers and the results of its queries, when the same keyword, years and languages were searched less than HOURS ago. Only the other queries are sent to Scholar. Default HOURS is {INDEX_TTL}')
+    parser.add_argument('--refresh-from', type=str, help=f'Results file of an earlier run to update. Only the result pages are fetched again: the citations and ranks of the file are updated in place, papers already in it keep their download link and PDF, and the changes are written to a file ending in {DIFF_SUFFIX}. The keyword defaults to the file name, and the number of results to the number of rows of the file')
+    parser.add_argument('--worker', action='store_true', help='Share the search with the other sortgs processes started with --worker and the same arguments on the same --csvpath. The pages to fetch and the PDFs to download are split into units kept in a job table of the --csvpath folder, which each worker takes in turn. Units of a worker that stops are taken over by the others, and a run started again goes on from the units already done. The last worker writes the results')
+    parser.add_argument('--low-memory', action='store_true', help=f'Keep the memory of large crawls bounded: results are not kept in memory but written to the output files as their page is parsed, and ranked with an external sort on disk when the search ends. Only the first {PRINT_ROWS} results, or TOP, are printed, followed by the peak memory of the run. Can not be combined with --weights, --half-life, --plotresults, --plotfile, --refresh-from or --worker')
+    parser.add_argument('--parse-workers', type=int, help='Number of threads or processes parsing result pages while the next ones are fetched. Use 0 to parse them in the main thread. Threads are used with selectolax, processes otherwise. Default is the number of CPUs, at most 4, with selectolax, and 0 otherwise')
+    parser.add_argument('--profile', action='store_true', help='Print the time spent in each stage (page requests, parsing, link resolution, PDF downloads, output) and counters such as bytes downloaded, retries and robot checks when the run ends')
+    parser.add_argument('--metrics-file', type=str, help='Write the stage timings and counters to this file when the run ends: Prometheus text format for a .prom file, JSON otherwise')
+    parser.add_argument('--cprofile', type=str, help='Run under cProfile and save the stats to this file, for pstats or snakeviz. With --profile, the slowest functions are printed too')
+    parser.add_argument('--slices', type=str, choices=SLICE_MODES, help=f'Split the search into year ranges, to get more than the {MAX_RESULTS_PER_QUERY} results Scholar returns per query. "year" searches every year from --startyear to --endyear, "auto" splits the years until each range has at most {MAX_RESULTS_PER_QUERY} results. Default is "auto" when --nresults is above {MAX_RESULTS_PER_QUERY}')
 
     # Parse and read arguments and assign them to variables if exists
     args, _ = parser.parse_known_args()
@@ -94,11 +125,22 @@ def get_command_line_args():
         parser.print_help()
         sys.exit(0)
 
-    keyword = KEYWORD
-    if args.kw:
-        keyword = args.kw
+    keywords = list(args.kw)
+    if args.kwfile:
+        keywords += read_keywords(args.kwfile)
+    refresh_from = args.refresh_from
+    if refresh_from and not keywords:
+        # Output files are named after their keyword, e.g. machine_learning.csv
+        keywords = [os.path.splitext(os.path.basename(refresh_from))[0].replace('_', ' ')]
+    if not keywords:
+        keywords = [KEYWORD]
+    keywords = list(dict.fromkeys(keywords))  # Drop repeated keywords
+    if refresh_from and len(keywords) > 1:
+        parser.error('--refresh-from updates the results of a single keyword')
 
     nresults = NRESULTS
+    if refresh_from:
+        nresults = None  # Number of rows of the refreshed file
     if args.nresults:
         nresults = args.nresults
 
@@ -110,10 +152,29 @@ def get_command_line_args():
     if args.notsavecsv:
         save_csv = False
 
+    weights = None
+    if args.weights:
+        from sortgs.postprocess import parse_weights
+        from sortgs.sinks import INT_COLUMNS
+        try:
+            weights = parse_weights(args.weights, INT_COLUMNS)
+        except ValueError as e:
+            parser.error(str(e))
+
+    half_life = None
+    if args.half_life:
+        half_life = args.half_life
+
     sortby = SORTBY
+    if weights or half_life:
+        sortby = 'Score'
     if args.sortby:
         sortby=args.sortby
 
+    top = None
+    if args.top:
+        top = args.top
+
     langfilter = LANG
     if args.langfilter:
         langfilter = args.langfilter
@@ -122,6 +183,11 @@ def get_command_line_args():
     if args.plotresults:
         plot_results = True
 
+    plot_fpath = None
+    if args.plotfile:
+        plot_fpath = args.plotfile
+        plot_results = True
+
     start_year = STARTYEAR
     if args.startyear:
         start_year=args.startyear
@@ -134,402 +200,500 @@ def get_command_line_args():
     if args.debug:
         debug = True
 
-    return keyword, nresults, save_csv, csvpath, sortby, langfilter, plot_results, start_year, end_year, debug
-
-
-def get_citations(content):
-    out = 0
-    for char in range(0,len(content)):
-        if content[char:char+9] == 'Cited by ':
-            init = char+9
-            for end in range(init+1,init+6):
-                if content[end] == '<':
-                    break
-            out = content[init:end]
-    return int(out)
-
-def get_year(content):
-    for char in range(0,len(content)):
-        if content[char] == '-':
-            out = content[char-5:char-1]
-    if not out.isdigit():
-        out = 0
-    return int(out)
-
-def setup_driver():
-    print('Loading...')
+    max_concurrency = MAX_CONCURRENCY
+    if args.max_concurrency:
+        max_concurrency = args.max_concurrency
+
+    rate = None
+    if args.rate:
+        rate = args.rate
+
+    max_rate = MAX_RATE
+    if args.max_rate:
+        max_rate = args.max_rate
+
+    adaptive = True
+    if args.fixed_rate:
+        adaptive = False
+
+    browsers = BROWSERS
+    if args.browsers:
+        browsers = args.browsers
+
+    cache_dir = CACHE_DIR
+    if args.cache_dir:
+        cache_dir = args.cache_dir
+
+    cache_ttl = CACHE_TTL
+    if args.cache_ttl is not None:
+        cache_ttl = args.cache_ttl
+
+    refresh = False
+    if args.refresh:
+        refresh = True
+
+    from_index = None # Hours, None to always ask Scholar
+    if args.from_index is not None:
+        from_index = args.from_index
+    if from_index is not None and (refresh or refresh_from):
+        parser.error('--from-index answers from stored results, it can not be combined with --refresh or --refresh-from')
+
+    worker = False
+    if args.worker:
+        worker = True
+    if worker and (refresh_from or from_index is not None):
+        parser.error('--worker can not be combined with --refresh-from or --from-index')
+
+    low_memory = False
+    if args.low_memory:
+        low_memory = True
+    if low_memory and (weights or half_life or plot_results or refresh_from or worker):
+        parser.error('--low-memory can not be combined with --weights, --half-life, --plotresults, --plotfile, --refresh-from or --worker')
+
+    output_format = FORMAT
+    if args.format:
+        output_format = args.format
+    if refresh_from:
+        output_format = os.path.splitext(refresh_from)[1][1:]
+        if output_format not in FORMATS:
+            parser.error(f'--refresh-from needs a results file (.csv, .jsonl, .parquet or .sqlite): {refresh_from}')
+
+    parse_workers = None # Threads with selectolax, the main thread otherwise
+    if args.parse_workers is not None:
+        parse_workers = args.parse_workers
+
+    profile = False
+    if args.profile:
+        profile = True
+
+    metrics_file = args.metrics_file
+    cprofile_path = args.cprofile
+
+    slices = args.slices
+    if slices is None and nresults is not None and nresults > MAX_RESULTS_PER_QUERY:
+        print(f'Scholar returns at most {MAX_RESULTS_PER_QUERY} results per query. Splitting the search into year ranges.')
+        slices = 'auto'
+    if slices and debug:
+        print('Year ranges are not available in debug mode.')
+        slices = None
+    if slices == 'year' and start_year is None:
+        parser.error('--slices year needs a --startyear')
+
+    return keywords, nresults, save_csv, csvpath, sortby, langfilter, plot_results, start_year, end_year, debug, max_concurrency, rate, max_rate, adaptive, browsers, cache_dir, cache_ttl, refresh, slices, output_format, refresh_from, parse_workers, profile, metrics_file, cprofile_path, top, weights, half_life, plot_fpath, from_index, worker, low_memory
+
+
+def setup_driver(headless=False):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.options import Options
+
     chrome_options = Options()
     chrome_options.add_argument("disable-infobars")
+    if headless:
+        chrome_options.add_argument("--headless=new")
+        chrome_options.add_argument("--window-size=1280,1024")
+    else:
+        print('Loading...')
     driver = webdriver.Chrome(options=chrome_options)
     return driver
 
-def get_author(content):
-    content = content.replace('\xa0', ' ')  # Replaces the non-breaking space with a regular space
-    out = ""
-    if len(content)>0:
-        out = content.split(" - ")[0]
-    return out
-
 def get_element(driver, xpath, attempts=5, _count=0):
     '''Safe get_element method with multiple attempts'''
+    from selenium.webdriver.common.by import By
+
     try:
-        element = driver.find_element_by_xpath(xpath)
+        element = driver.find_element(By.XPATH, xpath)
         return element
     except Exception as e:
         if _count<attempts:
             sleep(random.uniform(0.5, 3))
-            get_element(driver, xpath, attempts=attempts, _count=_count+1)
+            return get_element(driver, xpath, attempts=attempts, _count=_count+1)
         else:
             print("Element not found")
 
-def get_content_with_selenium(url):
-    if 'driver' not in globals():
-        global driver
-        driver = setup_driver()
-    driver.get(url)
+async def get_download_link(resolver, paper):
+    """Returns the download link for a parsed paper if available."""
+    if paper['download_link']:
+        return paper['download_link']
+
+    # Handle external HTML links
+    link = paper['html_link']
+    if link:
+        print(f"Processing external HTML link: {link}")
+        pdf_link = await resolver.resolve(link)
+        if pdf_link:
+            print(f"Found PDF link in external HTML: {pdf_link}")
+            return pdf_link
+        else:
+            print("Pdf link not found at", link, "search manually")
 
-    while True:
-        # Wait for a specific element that indicates the page has loaded
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.TAG_NAME, "body"))
-        )
+    return None
 
-        # Get the body element
-        el = driver.find_element(By.TAG_NAME, "body")
 
-        c = el.get_attribute('innerHTML')
-        if any(kw in el.text for kw in ROBOT_KW):
-            raw_input("Solve captcha manually and press enter here to continue...")
-        else:
-            break
+def format_strings(strings):
+    if len(strings) == 1:
+        return f'lang_{strings[0]}'
+    else:
+        return '%7C'.join(f'lang_{s}' for s in strings)
 
-    return c.encode('utf-8')
 
-def get_download_link(div):
-    """Finds and returns the download link for a paper if available."""
-    try:
-        download_div = div.find("div", {"class": "gs_ggs gs_fl"})
-        if not download_div:
-            return None
-
-        link = download_div.find("a").get("href")
-        if link and "pdf" in link.lower():
-            return link
-
-        # Handle external HTML links
-        if "HTML" in download_div.text:
-            print(f"Processing external HTML link: {link}")
-            pdf_link = handle_external_link(link)
-            if pdf_link:
-                print(f"Found PDF link in external HTML: {pdf_link}")
-                return pdf_link
-            else:
-                print("Pdf link not found at", link, "search manually")
+def get_url_template(start_year, end_year, langfilter, debug):
+    """Returns the URL template of result pages, with the year and language filters."""
+    if debug:
+        return 'https://web.archive.org/web/20210314203256/' + GSCHOLAR_URL
 
-    except Exception as e:
-        print(f"Error extracting download link: {e}")
+    url_template = GSCHOLAR_URL
+    if start_year:
+        url_template = url_template + STARTYEAR_URL.format(start_year)
 
-    return None
+    if end_year != now.year:
+        url_template = url_template + ENDYEAR_URL.format(end_year)
 
+    if langfilter != 'All':
+        formatted_filters = format_strings(langfilter)
+        url_template = url_template + LANG_URL.format(formatted_filters)
+    return url_template
 
-     
- 
-    
 
-async def download_pdf_async(session, url, path):
-    """Downloads the PDF asynchronously from a URL to the specified path, with retries."""
-    for attempt in range(MAX_RETRIES):
-        try:
-            async with session.get(url, timeout=10) as response:
-                if response.headers.get("content-type") == "application/pdf" or url.endswith(".pdf"):
-                    async with aio_open(path, "wb") as file:
-                        async for chunk in response.content.iter_chunked(1024):
-                            if chunk:
-                                await file.write(chunk)
-                    print(f"Downloaded PDF: {path}")
-                    return True
-                else:
-                    # Attempt to detect PDFs from content if Content-Type is misleading
-                    first_chunk = await response.content.read(1024)
-                    if b"%PDF" in first_chunk:  # PDF files usually start with %PDF
-                        async with aio_open(path, "wb") as file:
-                            await file.write(first_chunk)
-                            async for chunk in response.content.iter_chunked(1024):
-                                await file.write(chunk)
-                        print(f"Downloaded PDF (detected from content): {path}")
-                        return True
-                    else:
-                        print(f"Skipping non-PDF content: {url}")
-                        return False
-        except aiohttp.ClientError as e:
-            print(f"Network error during attempt {attempt + 1} for {url}: {e}")
-        except asyncio.TimeoutError:
-            print(f"Timeout during attempt {attempt + 1} for {url}.")
-        except Exception as e:
-            print(f"Unexpected error during attempt {attempt + 1} for {url}: {e}")
-
-        if attempt < MAX_RETRIES - 1:
-            print(f"Retrying in {RETRY_DELAY} seconds...")
-            await asyncio.sleep(RETRY_DELAY)
-
-    print(f"Failed to download PDF from {url} after {MAX_RETRIES} attempts.")
-    return False
-
-
-# Function to handle all PDF downloads asynchronously
-async def download_pdfs(papers):
-    """Handles downloading PDFs for all papers asynchronously."""
-    async with aiohttp.ClientSession() as session:
-        tasks = []
-        for paper in papers:
-            if paper['download_link']:
-                pdf_save_path = os.path.join(paper['pdf_save_dir'], f"{paper['paper_id']}.pdf")
-                tasks.append(download_pdf_async(session, paper['download_link'], pdf_save_path))
-            else:
-                print(f"No download link available for {paper['title']}.")
+def sort_results(data, sortby_column, top=None):
+    """
+    Sorts results by the selected columns, or by citations if one of them
+    doesn't exist. With `top`, only the `top` first results are kept.
+    """
+    from sortgs.postprocess import parse_sortby, sort_frame
 
-        # Run all tasks concurrently
-        results = await asyncio.gather(*tasks)
-        return results
+    keys = parse_sortby(sortby_column)
+    missing = [column for column, _ in keys if column not in data.columns]
+    if missing or not keys:
+        print('Column name to be sorted not found. Sorting by the number of citations...')
+        print(missing)
+        keys = [('Citations', False)]
+    return sort_frame(data, keys, top)
 
 
+def merge_results(data):
+    """Returns one row per paper found by any keyword, with its best rank."""
+    rows = data.reset_index()
+    by_id = rows.groupby('ID', sort=False)
+    merged = rows.drop_duplicates('ID').set_index('ID')
+    merged['Rank'] = by_id['Rank'].min()
+    merged['Keywords'] = by_id['Keyword'].agg('; '.join)
+    merged = merged.drop(columns='Keyword').reset_index().set_index('Rank')
+    return merged
 
 
-def handle_external_link(link):
+def merge_result_rows(keyword_rows, sort_keys, tmp_dir=None):
     """
-    Handle an external link to find the PDF link within the page.
+    Yields the rows of merge_results, sorted by `sort_keys`, from the ranked
+    rows of every keyword ({keyword: rows}), with external sorts so that
+    they are never all held in memory.
     """
-    outer_page = requests.get(link).content
-    soup = BeautifulSoup(outer_page, "html.parser")
-    a_tags = soup.findAll("a")
+    from itertools import groupby
+    from sortgs.extsort import external_sort
+    from sortgs.postprocess import row_key
 
-    for a_tag in a_tags:
-        href = a_tag.get("href")
+    def tagged():
+        for keyword, rows in keyword_rows.items():
+            for row in rows:
+                yield dict(row, Keyword=keyword)
 
-        resolved_link = urljoin(link, href)  # Resolve relative link
+    def merged():
+        # The rows of a paper follow each other, best rank first
+        by_id = external_sort(tagged(), key=lambda row: (row['ID'], row['Rank']), tmp_dir=tmp_dir)
+        for _, rows in groupby(by_id, key=lambda row: row['ID']):
+            rows = list(rows)
+            yield dict(rows[0], Keywords='; '.join(row['Keyword'] for row in rows))
 
-        if "pdf" in resolved_link.lower():
-            return resolved_link
+    # Ties stay in crawl order, as in merge_results: best rank first, then the keyword order
+    keywords = {keyword: i for i, keyword in enumerate(keyword_rows)}
+    sort_key = row_key(sort_keys)
+    return external_sort(merged(), key=lambda row: (sort_key(row), row['Rank'], keywords[row['Keyword']]),
+                         tmp_dir=tmp_dir)
 
-    return None
 
+def print_rows(rows, n):
+    """Prints the first `n` of ranked rows, without loading the others."""
+    print(f"{'Rank':>6} {'Citations':>9} {'cit/year':>8} {'Year':>5}  Title")
+    for row in islice(rows, n):
+        print(f"{row['Rank']:>6} {row['Citations']:>9} {row['cit/year']:>8} {row['Year']:>5}  {row['Title']}")
 
 
-def format_strings(strings):
-    if len(strings) == 1:
-        return f'lang_{strings[0]}'
-    else:
-        return '%7C'.join(f'lang_{s}' for s in strings)
+def diff_results(old, new):
+    """
+    Returns the changes between two results tables indexed by rank: one row
+    per paper of either table, with its old and new rank and citations, and
+    whether it is 'new', 'dropped', 'changed' or 'same'.
+    """
+    columns = ['ID', 'Title', 'Rank', 'Citations']
+    diff = old.reset_index()[columns].merge(new.reset_index()[columns], on='ID', how='outer',
+                                              suffixes=(' Before', ' After'))
+    diff['Title'] = diff['Title After'].fillna(diff['Title Before'])
+    diff['Rank Change'] = diff['Rank Before'] - diff['Rank After']  # Positive when the paper went up
+    diff['Citation Change'] = diff['Citations After'] - diff['Citations Before']
+    diff['Status'] = 'same'
+    diff.loc[(diff['Rank Change'] != 0) | (diff['Citation Change'] != 0), 'Status'] = 'changed'
+    diff.loc[diff['Rank Before'].isna(), 'Status'] = 'new'
+    diff.loc[diff['Rank After'].isna(), 'Status'] = 'dropped'
+    diff = diff[['ID', 'Title', 'Status', 'Rank Before', 'Rank After', 'Rank Change',
+                 'Citations Before', 'Citations After', 'Citation Change']]
+    for column in diff.columns[3:]:
+        diff[column] = diff[column].astype('Int64')
+    return diff.sort_values(['Rank After', 'Rank Before'], na_position='last').reset_index(drop=True)
+
+
+def report_metrics(profile, metrics_file, profiler=None, cprofile_path=None):
+    """Prints and saves the stage timings and counters of the run, and the cProfile stats."""
+    from sortgs.metrics import metrics
+
+    if profiler is not None:
+        profiler.disable()
+        profiler.dump_stats(cprofile_path)
+        print(f"cProfile stats saved to {cprofile_path}")
+    if profile:
+        print(metrics.summary())
+        if profiler is not None:
+            import pstats
+            pstats.Stats(profiler).sort_stats('cumulative').print_stats(PROFILE_TOP)
+    if metrics_file:
+        metrics.write(metrics_file)
+        print(f"Metrics saved to {metrics_file}")
 
 
 def main():
     # Get command line arguments
-    keyword, number_of_results, save_database, path, sortby_column, langfilter, plot_results, start_year, end_year, debug = get_command_line_args()
+    keywords, number_of_results, save_database, path, sortby_column, langfilter, plot_results, start_year, end_year, debug, max_concurrency, rate, max_rate, adaptive, browsers, cache_dir, cache_ttl, refresh, slices, output_format, refresh_from, parse_workers, profile, metrics_file, cprofile_path, top, weights, half_life, plot_fpath, from_index, worker, low_memory = get_command_line_args()
+
+    import asyncio
+    from sortgs.browser import BrowserPool
+    from sortgs.client import ScholarClient, Search
+    from sortgs.jobs import JOBS_FNAME, JobTable, run_worker
+    from sortgs.journal import CheckpointJournal
+    from itertools import chain
+    import shutil
+    import tempfile
+    from sortgs.metrics import metrics, peak_rss
+    from sortgs.postprocess import SCORE, plot_results as plot_frames, row_score, score
+    from sortgs.sinks import COLUMNS, MERGED_COLUMNS, open_sink, read_frame, write_frame, write_rows as write_sorted_rows
+
+    if parse_workers:
+        # Forking a process that runs threads (DNS lookups, browsers) is unsafe
+        import multiprocessing
+        multiprocessing.set_start_method('spawn', force=True)
+
+    profiler = None
+    if cprofile_path:
+        import cProfile
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if profile or metrics_file or profiler is not None:
+        # Reported at exit, so that interrupted runs are reported too
+        import atexit
+        atexit.register(report_metrics, profile, metrics_file, profiler, cprofile_path)
 
     # print("Running with the following parameters:")
     print(
-        f"Keyword: {keyword}, Number of results: {number_of_results}, Save database: {save_database}, Path: {path}, Sort by: {sortby_column}, Permitted Languages: {langfilter}, Plot results: {plot_results}, Start year: {start_year}, End year: {end_year}, Debug: {debug}")
-
-    # Create main URL based on command line arguments
-    if start_year:
-        GSCHOLAR_MAIN_URL = GSCHOLAR_URL + STARTYEAR_URL.format(start_year)
-    else:
-        GSCHOLAR_MAIN_URL = GSCHOLAR_URL
-
-    if end_year != now.year:
-        GSCHOLAR_MAIN_URL = GSCHOLAR_MAIN_URL + ENDYEAR_URL.format(end_year)
-
-    if langfilter != 'All':
-        formatted_filters = format_strings(langfilter)
-        GSCHOLAR_MAIN_URL = GSCHOLAR_MAIN_URL + LANG_URL.format(formatted_filters)
-
-    if debug:
-        GSCHOLAR_MAIN_URL = 'https://web.archive.org/web/20210314203256/' + GSCHOLAR_URL
-
-    # Start new session
-    session = requests.Session()
-
-    # Variables
-    links, title, citations, year, author, venue, publisher, rank, download_links, download_status, paper_ids = ([] for _ in range(11))
-    rank = [0]  # Start rank at 0
-    pdf_save_dir = os.path.join(path, "PDFs")  # Directory for saving PDFs
-    os.makedirs(pdf_save_dir, exist_ok=True)
-    df = pd.DataFrame()
-    # Check for temporary progress file
-    temp_csv = os.path.join(path, "temp_results.csv")
-    temp_cols = 0
-    if os.path.exists(temp_csv):
-        print(f"Found temporary file: {temp_csv}. Resuming from saved progress.")
-        try:
-            df = pd.read_csv(temp_csv)
-
-            # Verify and fix the Rank column if missing or invalid
-            if 'Rank' not in df.columns or df['Rank'].isnull().all():
-                print("Rank column missing or invalid. Regenerating index...")
-                df.index = range(1, len(df) + 1)
-                df.index.name = 'Rank'
-            else:
-                df.set_index('Rank', inplace=True)
-            temp_cols = len(df)
-            print(f"Resuming from paper {len(df) + 1}.")
-            rank_start = len(df)  # Start from the next unprocessed paper
-        except Exception as e:
-            print(f"Error reading temporary file: {e}. Starting from scratch.")
-            rank_start = 0
-            data = pd.DataFrame()
-    else:
-        # print("No temporary file found. Starting from scratch.")
-        rank_start = 0
-        data = pd.DataFrame()
-
-    # Generate unique IDs
-    def generate_unique_id(idx):
-        return f"paper_{idx:04d}"
-
-    # Function to download PDF
-
-
-    # Get content from number_of_results URLs
-    for n in range(rank_start, number_of_results, 10):
-        url = GSCHOLAR_MAIN_URL.format(str(n), keyword.replace(' ', '+'))
-        if debug:
-            print("Opening URL:", url)
-
-        # print(f"Loading next {n + 10} results")
-        page = session.get(url)
-        c = page.content
-        if any(kw in c.decode('ISO-8859-1') for kw in ROBOT_KW):
-            # print("Robot checking detected, handling with selenium (if installed)")
-            try:
-                c = get_content_with_selenium(url)
-            except Exception as e:
-                # print("No success. The following error was raised:")
-                print(e)
-
-        # Create parser
-        soup = BeautifulSoup(c, 'html.parser', from_encoding='utf-8')
-
-        # Get stuff
-        mydivs = soup.findAll("div", {"class": "gs_or"})
-        papers= []
-        for div in mydivs:
-            paper_id = generate_unique_id(len(rank)+temp_cols)
-            paper_ids.append(paper_id)
-
-            try:
-                links.append(div.find('h3').find('a').get('href'))
-            except:
-                links.append(f'Look manually at: {url}')
-
-            try:
-                title.append(div.find('h3').find('a').text)
-            except:
-                title.append('Could not catch title')
-
-            try:
-                citations.append(get_citations(str(div.format_string)))
-            except:
-                warnings.warn(f"Number of citations not found for {title[-1]}. Appending 0")
-                citations.append(0)
-
-            try:
-                year.append(get_year(div.find('div', {'class': 'gs_a'}).text))
-            except:
-                warnings.warn(f"Year not found for {title[-1]}, appending 0")
-                year.append(0)
-
-            try:
-                author.append(get_author(div.find('div', {'class': 'gs_a'}).text))
-            except:
-                author.append("Author not found")
-
-            try:
-                publisher.append(div.find('div', {'class': 'gs_a'}).text.split("-")[-1])
-            except:
-                publisher.append("Publisher not found")
-
-            try:
-                venue.append(" ".join(div.find('div', {'class': 'gs_a'}).text.split("-")[-2].split(",")[:-1]))
-            except:
-                venue.append("Venue not found")
-
-            # Extract and store download link
-            download_link = get_download_link(div)
-            download_links.append(download_link)
-
-
-            if not download_link:
-                download_status.append("No Link")
-            rank.append(rank[-1] + 1)
-
-
-        for idx, (paper_id, title, download_link) in enumerate(zip(paper_ids, title, download_links)):
-            pdf_save_path = os.path.join(pdf_save_dir, f"{paper_id}.pdf")
-            papers.append({
-                "paper_id": paper_id,
-                "title": title,
-                "download_link": download_link,
-                "pdf_save_dir": pdf_save_dir,
-                "pdf_save_path": pdf_save_path,
-            })
-        print("Starting asynchronous PDF downloads...")
-        results = asyncio.run(download_pdfs(papers))
-        download_status+= results
-        
-            
-        
-        # Save progress to a temporary file
-        temp_data = pd.DataFrame(list(zip(paper_ids, author, title, citations, year, publisher, venue, links, download_links, download_status)),
-                                 columns=['ID', 'Author', 'Title', 'Citations', 'Year', 'Publisher', 'Venue', 'Source', 'Download Link', 'Download Status'])
-        temp_data['Rank'] = range(1, len(temp_data) + 1)
-        temp_data.to_csv(temp_csv, index=False)
-        print("Progress saved to temp_results.csv")
-        title = list(title)
-        # Delay
-        sleep(random.uniform(0.5, 3))
-
-    # Create a dataset and sort by the number of citations
-    data = pd.DataFrame(list(zip(paper_ids, author, title, citations, year, publisher, venue, links, download_links)),
-                        index=rank[1:],
-                        columns=['ID', 'Author', 'Title', 'Citations', 'Year', 'Publisher', 'Venue', 'Source', 'Download Link'])
-    if not df.empty:
-        frames = [df, data]
-        data = pd.concat(frames)
-    data.index.name = 'Rank'
-
-    # Avoid years that are higher than the current year by clipping it to end_year
-    data['cit/year'] = data['Citations'] / (end_year + 1 - data['Year'].clip(upper=end_year))
-    data['cit/year'] = data['cit/year'].round(0).astype(int)
-
-    # Sort by the selected columns, if exists
+        f"Keywords: {keywords}, Number of results: {number_of_results}, Save database: {save_database}, Path: {path}, Sort by: {sortby_column}, Permitted Languages: {langfilter}, Plot results: {plot_results}, Start year: {start_year}, End year: {end_year}, Debug: {debug}, Max concurrency: {max_concurrency}, Rate: {rate or 'learned'}, Max rate: {max_rate}, Adaptive rate: {adaptive}, Browsers: {browsers}, Cache: {cache_dir}, Cache TTL: {cache_ttl} h, Refresh: {refresh}, Slices: {slices}, Format: {output_format}, Top: {top}, From index: {from_index}, Worker: {worker}, Low memory: {low_memory}")
+
+    # Results of an earlier run being refreshed
+    existing = None
+    if refresh_from:
+        existing = read_frame(refresh_from)
+        if number_of_results is None:
+            number_of_results = len(existing)
+        print(f"Refreshing {len(existing)} results of {refresh_from}")
+
+    # Papers of every keyword and year range
+    search = Search(keywords, number_of_results, start_year, end_year, langfilter, slices, keep_papers=not low_memory)
+    if existing is not None:
+        search.load_known(existing.to_dict('records'))
+    pdf_save_dir = os.path.join(path, "PDFs")  # Directory for saving PDFs, shared by all keywords and runs
+
+    # Workers share their progress through the job table instead of the journal
+    jobs = None
+    if worker:
+        os.makedirs(path, exist_ok=True)
+        jobs = JobTable(os.path.join(path, JOBS_FNAME))
+
+    # Check for a checkpoint journal left by an interrupted run
+    journal = CheckpointJournal(path)
+    resume = jobs is None and journal.exists()
+    if resume:
+        print(f"Found checkpoint journal: {journal.fpath}. Resuming from saved progress.")
+
+    # Results are written to the output files as soon as their page is parsed.
+    # In low memory mode, they are only kept there, in a temporary folder if
+    # they are not saved
+    sinks = {}
+    use_sinks = save_database or low_memory
+    sink_dir = path
+    sink_format = output_format
+    if low_memory and not save_database:
+        sink_dir = tempfile.mkdtemp(prefix='sortgs-')
+        sink_format = 'jsonl'
+
+    def fpath_base(keyword):
+        if refresh_from:
+            # The refreshed file is only replaced once the new one is complete
+            return os.path.splitext(refresh_from)[0] + REFRESH_SUFFIX
+        fpath = os.path.join(sink_dir, keyword.replace(' ', '_').replace(':', '_'))
+        return fpath[:MAX_CSV_FNAME - len('.' + sink_format)]
+
+    # The files hold the score of every row, to be sorted by it
+    scored = bool(weights or half_life)
+    sink_columns = COLUMNS + [SCORE] if scored else COLUMNS
+    scorer = row_score(weights, half_life, end_year) if scored else None
+
+    def write_rows(papers):
+        rows = {}
+        for paper in papers:
+            row = search.row(paper)
+            if scorer is not None:
+                row[SCORE] = scorer(row)
+            rows.setdefault(paper.keyword, []).append(row)
+        with metrics.timer('output.write'):
+            for keyword, keyword_rows in rows.items():
+                sinks[keyword].write(keyword_rows)
+
+    def open_sinks():
+        for keyword in keywords:
+            sinks[keyword] = open_sink(sink_format, fpath_base(keyword), sortby=sortby_column,
+                                       max_rank=number_of_results if slices else None, columns=sink_columns)
+
+    async def crawl():
+        # Queries share the session, the rate limit, the caches and the PDF
+        # folder, and PDFs are downloaded in the background
+        async with ScholarClient(max_concurrency=max_concurrency, rate=rate, max_rate=max_rate, adaptive=adaptive,
+                                 cache_dir=cache_dir, cache_ttl=cache_ttl, refresh=refresh or bool(refresh_from), pdf_dir=pdf_save_dir,
+                                 fallback=browser_pool, fallback_concurrency=browsers,
+                                 parse_workers=parse_workers, index_ttl=from_index, low_memory=low_memory,
+                                 debug=debug) as client:
+            if jobs is not None:
+                # The merge unit is only done once the output is written
+                merge_job = await run_worker(client, search, jobs)
+                if merge_job is not None and save_database:
+                    open_sinks()
+                    write_rows(search.papers)
+                print(client.controller.summary())
+                return merge_job
+
+            await client.plan(search)
+            if use_sinks:
+                open_sinks()
+
+            if resume:
+                # Streamed by batches, the journal of a large crawl is never held in memory
+                rows = journal.replay()
+                try:
+                    for batch in iter(lambda: list(islice(rows, RESUME_BATCH)), []):
+                        replayed = await client.resume(search, batch)
+                        if use_sinks:
+                            write_rows(replayed)
+                except Exception as e:
+                    print(f"Error reading checkpoint journal: {e}. Resuming from the rows read before it.")
+                print(f"Resuming from paper {search.found + 1}.")
+
+            async for page in client.crawl(search):
+                if use_sinks:
+                    write_rows(page)
+                # Append the new page to the checkpoint journal
+                with metrics.timer('checkpoint'):
+                    journal.append(search.found - len(page), [
+                        paper.to_row(**{'Download Status': client.downloads.get_status(paper.id)}) for paper in page])
+            print(client.controller.summary())
+            print("Waiting for PDF downloads to finish...")
+
+    # Browsers are only started if Scholar asks for a robot check
+    browser_pool = BrowserPool(size=browsers, robot_kw=ROBOT_KW)
     try:
-        data_ranked = data.sort_values(by=sortby_column, ascending=False)
-    except Exception as e:
-        print('Column name to be sorted not found. Sorting by the number of citations...')
-        data_ranked = data.sort_values(by='Citations', ascending=False)
-        print(e)
-
-    # Print data
-    print(data_ranked)
+        with metrics.timer('crawl'):
+            merge_job = asyncio.run(crawl())
+    finally:
+        journal.close()
+        browser_pool.close()
+    if jobs is not None and merge_job is None:
+        jobs.close()
+        print("Another worker writes the results.")
+        return
+
+    if low_memory:
+        # Ranked from the files, a row at a time
+        with metrics.timer('output.finalize'):
+            for keyword in keywords:
+                sinks[keyword].finalize()
+        for keyword in keywords:
+            if len(keywords) > 1:
+                print(f"Results for keyword: {keyword}")
+            print_rows(sinks[keyword].read(), top or PRINT_ROWS)
+        if len(keywords) > 1:
+            with metrics.timer('postprocess'):
+                merged_rows = merge_result_rows({keyword: sinks[keyword].read() for keyword in keywords},
+                                                sinks[keywords[0]].sort_keys, tmp_dir=sink_dir)
+                head = list(islice(merged_rows, top or PRINT_ROWS))
+                if save_database:
+                    write_sorted_rows(chain(head, merged_rows), output_format,
+                                      os.path.join(path, os.path.splitext(MERGED_FNAME)[0]), MERGED_COLUMNS)
+            print("Merged results of all keywords")
+            print_rows(head, len(head))
+        peak = peak_rss()
+        if peak is not None:
+            print(f"Peak memory: {peak / 2**20:.1f} MB")
+        if not save_database:
+            shutil.rmtree(sink_dir, ignore_errors=True)
+        journal.remove()
+        return
+
+    # Create a dataset, each paper once per keyword
+    with metrics.timer('postprocess'):
+        data = search.to_frame()
+        if scored:
+            data[SCORE] = score(data, weights, half_life, end_year)
+
+    frames = {}
+    for keyword in keywords:
+        with metrics.timer('postprocess'):
+            data_keyword = data[data['Keyword'] == keyword].drop(columns='Keyword')
+            data_ranked = sort_results(data_keyword, sortby_column, top)
+        frames[keyword] = data_keyword
+
+        # Print data
+        if len(keywords) > 1:
+            print(f"Results for keyword: {keyword}")
+        print(data_ranked)
+
+        # Sort the saved results
+        if save_database:
+            with metrics.timer('output.finalize'):
+                sinks[keyword].finalize()
+            if refresh_from:
+                os.replace(sinks[keyword].fpath, refresh_from)
+
+    # Changes since the refreshed results
+    if existing is not None:
+        diff = diff_results(existing.set_index('Rank'), data_keyword)
+        counts = diff['Status'].value_counts()
+        print(f"Changed: {counts.get('changed', 0)} papers, {counts.get('new', 0)} new, {counts.get('dropped', 0)} dropped")
+        if save_database:
+            diff.to_csv(os.path.splitext(refresh_from)[0] + DIFF_SUFFIX, index=False, encoding='utf-8')
+
+    # Papers of all keywords in a single table, each paper once
+    if len(keywords) > 1:
+        with metrics.timer('postprocess'):
+            merged_ranked = sort_results(merge_results(data), sortby_column)
+        print("Merged results of all keywords")
+        print(merged_ranked.head(top) if top else merged_ranked)
+        if save_database:
+            write_frame(merged_ranked, output_format, os.path.join(path, os.path.splitext(MERGED_FNAME)[0]))
 
     # Plot by citation number
     if plot_results:
-        plt.plot(rank[1:], citations, '*')
-        plt.ylabel('Number of Citations')
-        plt.xlabel('Rank of the keyword on Google Scholar')
-        plt.title(f'Keyword: {keyword}')
-        plt.show()
-
-    # Save results
-    if save_database:
-        fpath_csv = os.path.join(path, keyword.replace(' ', '_').replace(':', '_') + '.csv')
-        fpath_csv = fpath_csv[:MAX_CSV_FNAME]
-        data_ranked.to_csv(fpath_csv, encoding='utf-8')
-        # print('Results saved to', fpath_csv)
-
-    #delete the temporary file
-    if os.path.exists(temp_csv):
-        os.remove(temp_csv)
+        plot_frames(frames, plot_fpath, MAX_PLOT_POINTS)
+        if plot_fpath:
+            print(f"Plot saved to {plot_fpath}")
+
+    # Delete the checkpoint journal, or the job table of the workers
+    journal.remove()
+    if jobs is not None:
+        jobs.complete(merge_job)
+        jobs.remove()
 
 
 
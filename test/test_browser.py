@@ -0,0 +1,134 @@
+import threading
+import time
+import unittest
+from unittest import mock
+
+from selenium.webdriver.common.by import By
+
+from sortgs.browser import BrowserPool
+from sortgs.sortgs import get_element
+
+
+class FakeElement:
+    def __init__(self, text):
+        self.text = text
+
+    def get_attribute(self, name):
+        return self.text
+
+
+class FakeDriver:
+    """Selenium driver stand-in serving `pages` ({url: html}) with a delay."""
+
+    def __init__(self, pages, headless=True, delay=0.05):
+        self.pages = pages
+        self.headless = headless
+        self.delay = delay
+        self.url = None
+        self.cookies = []
+        self.alive = True
+        self.quit_called = False
+
+    def get(self, url):
+        time.sleep(self.delay)
+        self.url = url
+
+    def find_element(self, by, value):
+        return FakeElement(self.pages.get(self.url, ''))
+
+    def execute_script(self, script):
+        if not self.alive:
+            raise RuntimeError('browser crashed')
+        return 1
+
+    def execute_cdp_cmd(self, cmd, params):
+        self.cookies.append(params)
+
+    def get_cookies(self):
+        return [{'name': 'GSP', 'value': 'solved', 'domain': '.scholar.google.com'}]
+
+    def quit(self):
+        self.quit_called = True
+
+
+class TestBrowserPool(unittest.TestCase):
+    def setUp(self):
+        self.pages = {f'https://scholar.google.com/scholar?start={n}': f'page {n}' for n in range(0, 60, 10)}
+        self.drivers = []
+        self.lock = threading.Lock()
+
+    def factory(self, headless=True):
+        driver = FakeDriver(self.pages, headless)
+        with self.lock:
+            self.drivers.append(driver)
+        return driver
+
+    def test_parallel_fetches(self):
+        urls = sorted(self.pages)
+        results = {}
+        with BrowserPool(size=3, factory=self.factory) as pool:
+            threads = [threading.Thread(target=lambda url=url: results.update({url: pool.fetch(url)}))
+                       for url in urls]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            self.assertEqual(pool.started, 3)
+        self.assertEqual(results[urls[0]], b'page 0')
+        self.assertEqual(len(self.drivers), 3)
+        # Six pages on three browsers, not one after the other
+        self.assertLess(elapsed, 6 * 2 * 0.05)
+        self.assertTrue(all(driver.quit_called for driver in self.drivers))
+
+    def test_unhealthy_browser_replaced(self):
+        with BrowserPool(size=1, factory=self.factory) as pool:
+            pool.fetch('https://scholar.google.com/scholar?start=0')
+            self.drivers[0].alive = False
+            self.assertEqual(pool.fetch('https://scholar.google.com/scholar?start=10'), b'page 10')
+            self.assertEqual(len(self.drivers), 2)
+            self.assertTrue(self.drivers[0].quit_called)
+
+    def test_cookies_shared(self):
+        url = 'https://scholar.google.com/scholar?start=0'
+        with BrowserPool(size=1, factory=self.factory) as pool:
+            pool.share_cookies(url, {'NID': 'abc'})
+            pool.fetch(url)
+            pool.fetch(url)
+        self.assertEqual(self.drivers[0].cookies,
+                         [{'name': 'NID', 'value': 'abc', 'domain': 'scholar.google.com', 'path': '/'}])
+
+    def test_captcha_solved_in_visible_browser(self):
+        url = 'https://scholar.google.com/scholar?start=0'
+        self.pages[url] = 'Please show you are not a robot'
+        with BrowserPool(size=1, robot_kw=['not a robot'], factory=self.factory) as pool:
+            def solve(prompt):
+                self.pages[url] = 'page 0'
+            with mock.patch('builtins.input', solve):
+                self.assertEqual(pool.fetch(url), b'page 0')
+            visible = [driver for driver in self.drivers if not driver.headless]
+            self.assertEqual(len(visible), 1)
+            # The headless browsers get the cookies of the solved captcha
+            pool.fetch(url)
+            self.assertEqual(self.drivers[0].cookies[0]['value'], 'solved')
+        self.assertTrue(visible[0].quit_called)
+
+    def test_robot_page_returned_when_not_interactive(self):
+        url = 'https://scholar.google.com/scholar?start=0'
+        self.pages[url] = 'Please show you are not a robot'
+        with BrowserPool(size=1, robot_kw=['not a robot'], interactive=False, factory=self.factory) as pool:
+            self.assertEqual(pool.fetch(url), b'Please show you are not a robot')
+
+
+class TestGetElement(unittest.TestCase):
+    def test_retry_returns_element(self):
+        driver = mock.Mock()
+        driver.find_element.side_effect = [Exception('not yet'), 'element']
+        with mock.patch('sortgs.sortgs.sleep'):
+            self.assertEqual(get_element(driver, '//div'), 'element')
+        driver.find_element.assert_called_with(By.XPATH, '//div')
+
+
+if __name__ == '__main__':
+    unittest.main()
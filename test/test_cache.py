@@ -0,0 +1,103 @@
+import os
+import tempfile
+import time
+import unittest
+
+from aiohttp import web
+
+from sortgs.cache import PageCache
+from sortgs.fetcher import PageFetcher
+
+
+class TestPageCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.cache_dir = self.tmpdir.name
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def test_round_trip(self):
+        cache = PageCache(self.cache_dir)
+        self.assertIsNone(cache.get('http://scholar/?start=0'))
+        cache.put('http://scholar/?start=0', b'page 0')
+        self.assertEqual(cache.get('http://scholar/?start=0'), b'page 0')
+        self.assertEqual((cache.hits, cache.misses), (1, 1))
+
+        # A new instance reads the same pages back
+        self.assertEqual(PageCache(self.cache_dir).get('http://scholar/?start=0'), b'page 0')
+
+    def test_expired(self):
+        cache = PageCache(self.cache_dir, ttl=60)
+        cache.put('http://scholar/?start=0', b'page 0')
+        path = cache._path('http://scholar/?start=0')
+        old = time.time() - 120
+        os.utime(path, (old, old))
+        self.assertIsNone(cache.get('http://scholar/?start=0'))
+
+    def test_refresh(self):
+        PageCache(self.cache_dir).put('http://scholar/?start=0', b'old page')
+        cache = PageCache(self.cache_dir, refresh=True)
+        self.assertIsNone(cache.get('http://scholar/?start=0'))
+        cache.put('http://scholar/?start=0', b'new page')
+        self.assertEqual(PageCache(self.cache_dir).get('http://scholar/?start=0'), b'new page')
+
+    def test_evicts_least_recently_used(self):
+        cache = PageCache(self.cache_dir)
+        urls = [f'http://scholar/?start={n}' for n in range(0, 40, 10)]
+        for i, url in enumerate(urls):
+            cache.put(url, os.urandom(1000))
+            # Pages were last used in reverse order of storage
+            used = time.time() - 100 * (len(urls) - i)
+            os.utime(cache._path(url), (time.time() - 100 * i, used))
+
+        cache.max_size = cache.size() - 1
+        cache.evict()
+        self.assertFalse(os.path.exists(cache._path(urls[-1])))
+        for url in urls[:-1]:
+            self.assertTrue(os.path.exists(cache._path(url)))
+        self.assertLessEqual(cache.size(), cache.max_size)
+
+
+class TestCachedFetcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = 0
+
+        async def handler(request):
+            self.requests += 1
+            if request.query['start'] == '20':
+                return web.Response(text='Please show you are not a robot')
+            return web.Response(text=f'page {request.query["start"]}')
+
+        app = web.Application()
+        app.router.add_get('/scholar', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.urls = [f'http://127.0.0.1:{port}/scholar?start={n}' for n in range(0, 30, 10)]
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+        self.tmpdir.cleanup()
+
+    async def crawl(self, cache):
+        async with PageFetcher(rate=1000, jitter=0, robot_kw=['not a robot'], cache=cache) as fetcher:
+            return [c async for _, c in fetcher.iter_pages(self.urls)]
+
+    async def test_second_run_uses_cache(self):
+        first = await self.crawl(PageCache(self.tmpdir.name))
+        self.assertEqual(self.requests, 3)
+        # Only the robot check page is requested again
+        second = await self.crawl(PageCache(self.tmpdir.name))
+        self.assertEqual(self.requests, 4)
+        self.assertEqual(first, second)
+
+        await self.crawl(PageCache(self.tmpdir.name, refresh=True))
+        self.assertEqual(self.requests, 7)
+
+
+if __name__ == '__main__':
+    unittest.main()
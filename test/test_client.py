@@ -0,0 +1,64 @@
+'''In-process searches through the library API, against the local stub server.'''
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+import sortgs
+import sortgs.sortgs
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks'))
+from stub_server import KEYWORD, StubServer  # noqa: E402
+
+
+class TestClient(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(latency=0, pdf_size=4096).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        patcher = mock.patch.object(sortgs.sortgs, 'GSCHOLAR_URL', self.server.scholar_url)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.client_args = {'rate': 1000, 'cache_dir': os.path.join(self.tmp.name, 'cache')}
+
+    async def test_asearch(self):
+        titles = [paper.title async for paper in sortgs.asearch(KEYWORD, nresults=20, **self.client_args)]
+        self.assertEqual(titles, [row['Title'] for row in self.server.rows[:20]])
+
+    async def test_client_reused(self):
+        async with sortgs.ScholarClient(**self.client_args) as client:
+            first = await client.asearch_frame(KEYWORD, nresults=20)
+            session = client.fetcher.session
+            pages = self.server.stats['pages']
+            second = await client.asearch_frame(KEYWORD, nresults=20, sortby='cit/year')
+            self.assertIs(client.fetcher.session, session)
+        # The second search is served by the page cache
+        self.assertEqual(self.server.stats['pages'], pages)
+        self.assertEqual(sorted(first.index), list(range(1, 21)))
+        self.assertEqual(list(second['cit/year']), sorted(second['cit/year'], reverse=True))
+
+    def test_search(self):
+        df = sortgs.search(KEYWORD, nresults=20, **self.client_args)
+        self.assertEqual(len(df), 20)
+        self.assertNotIn('Keyword', df.columns)
+        self.assertEqual(list(df.Citations), sorted(df.Citations, reverse=True))
+        # No PDFs are downloaded unless a folder is given
+        self.assertEqual(self.server.stats['pdfs'], 0)
+
+    def test_blocking_client(self):
+        with sortgs.ScholarClient(**self.client_args) as client:
+            df = client.search([KEYWORD, 'deep learning'], nresults=10)
+            self.assertEqual(client.search(KEYWORD, nresults=10).shape[0], 10)
+        self.assertEqual(sorted(df.Keyword.unique()), ['deep learning', KEYWORD])
+
+
+if __name__ == '__main__':
+    unittest.main()
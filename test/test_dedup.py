@@ -0,0 +1,38 @@
+import unittest
+
+from sortgs.dedup import DiskPaperIndex, PaperIndex, normalize_title
+
+
+class TestDedup(unittest.TestCase):
+    def make_index(self):
+        return PaperIndex()
+
+    def test_normalize_title(self):
+        self.assertEqual(normalize_title('  Déjà Vu: A Study of   Recall! '), 'deja vu a study of recall')
+
+    def test_same_title_and_year(self):
+        index = self.make_index()
+        index.add('paper_0001', 'Machine Learning: A Review', 2020, 'https://a.org/1')
+        self.assertEqual(index.find('machine learning - a review', 2020, 'https://b.org/2'), 'paper_0001')
+        self.assertIsNone(index.find('Machine Learning: A Review', 2021, 'https://b.org/2'))
+
+    def test_same_link(self):
+        index = self.make_index()
+        index.add('paper_0001', 'Machine Learning', 2020, 'https://a.org/1')
+        self.assertEqual(index.find('Machine learning (preprint)', 2019, 'https://a.org/1'), 'paper_0001')
+
+    def test_placeholders_never_match(self):
+        index = self.make_index()
+        index.add('paper_0001', 'Could not catch title', 0, 'Look manually at: https://scholar')
+        self.assertIsNone(index.find('Could not catch title', 0, 'Look manually at: https://scholar'))
+
+
+class TestDiskDedup(TestDedup):
+    def make_index(self):
+        index = DiskPaperIndex()
+        self.addCleanup(index.close)
+        return index
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,200 @@
+import asyncio
+import hashlib
+import os
+import tempfile
+import unittest
+from unittest import mock
+
+from aiohttp import web
+
+
+from sortgs.downloads import BufferedFileWriter, ByteBudget, DownloadPipeline, NO_LINK, PdfTooLarge
+from sortgs.pdfstore import PdfStore
+
+
+class TestDownloadPipeline(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+
+        async def handler(request):
+            self.requests.append(request.path)
+            return web.Response(body=b'%PDF-1.4 test\n%%EOF\n', content_type='application/pdf')
+
+        app = web.Application()
+        app.router.add_get('/{name}', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+        self.tmp = tempfile.TemporaryDirectory()
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+        self.tmp.cleanup()
+
+    async def test_each_paper_downloaded_once(self):
+        async with DownloadPipeline(self.tmp.name, workers=2, queue_size=1) as downloads:
+            for i in range(5):
+                await downloads.submit(f'paper_{i}', 'title', f'{self.base}/{i}.pdf')
+            # Submitting the same papers again must not download them again
+            for i in range(5):
+                await downloads.submit(f'paper_{i}', 'title', f'{self.base}/{i}.pdf')
+            await downloads.submit('paper_5', 'title', None)
+
+        self.assertEqual(len(self.requests), 5)
+        self.assertEqual(downloads.get_status('paper_0'), True)
+        self.assertEqual(downloads.get_status('paper_5'), NO_LINK)
+        self.assertTrue(os.path.exists(os.path.join(self.tmp.name, 'paper_4.pdf')))
+
+    async def test_bounded_status(self):
+        done = []
+        async with DownloadPipeline(self.tmp.name, workers=1, max_status=2,
+                                    on_done=lambda *args: done.append(args)) as downloads:
+            for i in range(5):
+                await downloads.submit(f'paper_{i}', 'title', f'{self.base}/{i}.pdf')
+        self.assertEqual(len(done), 5)
+        self.assertEqual(done[0], ('paper_0', f'{self.base}/0.pdf', True))
+        # Only the last finished papers are remembered, and no lock is left per link
+        self.assertEqual(sorted(downloads.status), ['paper_3', 'paper_4'])
+        self.assertEqual(downloads._url_locks, {})
+
+
+PDF = b'%PDF-1.4\n' + b'0' * 5000 + b'\n%%EOF\n'
+ETAG = '"v1"'
+
+
+class TestPdfStore(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.requests = []
+        self.cut_next = False
+
+        async def pdf(request):
+            self.requests.append((request.headers.get('If-None-Match'), request.headers.get('Range')))
+            if request.headers.get('If-None-Match') == ETAG:
+                return web.Response(status=304, headers={'ETag': ETAG})
+            body, status, headers = PDF, 200, {'ETag': ETAG}
+            if request.headers.get('Range') and request.headers.get('If-Range') == ETAG:
+                start = int(request.headers['Range'][len('bytes='):-1])
+                body, status = PDF[start:], 206
+                headers['Content-Range'] = f'bytes {start}-{len(PDF) - 1}/{len(PDF)}'
+            if self.cut_next:
+                # Drop the connection half way through the body
+                self.cut_next = False
+                response = web.StreamResponse(status=status, headers=headers)
+                response.content_length = len(body)
+                await response.prepare(request)
+                await response.write(body[:2000])
+                request.transport.close()
+                return response
+            return web.Response(status=status, body=body, headers=headers, content_type='application/pdf')
+
+        async def truncated(request):
+            return web.Response(body=PDF[:-10], content_type='application/pdf')
+
+        async def html(request):
+            return web.Response(text='<html>Not a PDF</html>', content_type='text/html')
+
+        app = web.Application()
+        app.router.add_get('/paper.pdf', pdf)
+        app.router.add_get('/truncated.pdf', truncated)
+        app.router.add_get('/page', html)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+        self.tmp = tempfile.TemporaryDirectory()
+        self.store = PdfStore(os.path.join(self.tmp.name, 'store'))
+        patcher = mock.patch('sortgs.downloads.RETRY_DELAY', 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+        self.tmp.cleanup()
+
+    async def download(self, paper_id, url):
+        async with DownloadPipeline(os.path.join(self.tmp.name, 'PDFs'), store=self.store) as downloads:
+            await downloads.submit(paper_id, 'title', url)
+        return downloads.get_status(paper_id)
+
+    def read(self, paper_id):
+        with open(os.path.join(self.tmp.name, 'PDFs', f'{paper_id}.pdf'), 'rb') as f:
+            return f.read()
+
+    async def test_conditional_request(self):
+        self.assertTrue(await self.download('paper_0001', f'{self.base}/paper.pdf'))
+        # A later run asks whether the PDF changed and gets no body back
+        self.store = PdfStore(os.path.join(self.tmp.name, 'store'))
+        self.assertTrue(await self.download('paper_0002', f'{self.base}/paper.pdf'))
+        self.assertEqual(self.requests, [(None, None), (ETAG, None)])
+        self.assertEqual(self.read('paper_0002'), PDF)
+        entry = self.store.lookup(f'{self.base}/paper.pdf')
+        self.assertTrue(os.path.samefile(self.store.object_path(entry['sha256']),
+                                         os.path.join(self.tmp.name, 'PDFs', 'paper_0002.pdf')))
+
+    async def test_resume(self):
+        self.cut_next = True
+        self.assertTrue(await self.download('paper_0001', f'{self.base}/paper.pdf'))
+        # The second attempt only asks for what is missing
+        self.assertEqual(len(self.requests), 2)
+        self.assertRegex(self.requests[1][1], r'^bytes=[1-9]\d*-$')
+        self.assertEqual(self.read('paper_0001'), PDF)
+
+    async def test_max_size(self):
+        async with DownloadPipeline(os.path.join(self.tmp.name, 'PDFs'), store=self.store, max_size=1000) as downloads:
+            await downloads.submit('paper_0001', 'title', f'{self.base}/paper.pdf')
+        self.assertFalse(downloads.get_status('paper_0001'))
+        self.assertEqual(downloads.budget.in_flight, 0)
+
+    async def test_invalid_pdfs(self):
+        self.assertFalse(await self.download('paper_0001', f'{self.base}/truncated.pdf'))
+        self.assertFalse(await self.download('paper_0002', f'{self.base}/page'))
+        self.assertEqual(os.listdir(os.path.join(self.tmp.name, 'PDFs')), [])
+
+
+class FakeFile:
+    def __init__(self):
+        self.writes = []
+
+    async def write(self, data):
+        self.writes.append(bytes(data))
+
+
+class TestBufferedFileWriter(unittest.IsolatedAsyncioTestCase):
+    async def test_coalesces_writes(self):
+        file = FakeFile()
+        digest = hashlib.sha256()
+        writer = BufferedFileWriter(file, digest, buffer_size=4096)
+        for _ in range(100):
+            await writer.write(b'x' * 1024)
+        await writer.flush()
+        self.assertEqual(len(file.writes), 25)
+        self.assertEqual(b''.join(file.writes), b'x' * 102400)
+        self.assertEqual(digest.hexdigest(), hashlib.sha256(b'x' * 102400).hexdigest())
+
+    async def test_max_size(self):
+        writer = BufferedFileWriter(FakeFile(), hashlib.sha256(), max_size=2000, size=1000)
+        await writer.write(b'x' * 1000)
+        with self.assertRaises(PdfTooLarge):
+            await writer.write(b'x')
+
+    async def test_budget_shared_between_writers(self):
+        budget = ByteBudget(3000)
+        files = [FakeFile(), FakeFile()]
+        writers = [BufferedFileWriter(file, hashlib.sha256(), budget, buffer_size=10000) for file in files]
+        for _ in range(2):
+            await writers[0].write(b'x' * 1000)
+            self.assertLessEqual(budget.in_flight, 3000)
+        # The second writer waits for the first one to write its buffer out
+        writing = asyncio.ensure_future(writers[1].write(b'y' * 2000))
+        await asyncio.sleep(0)
+        self.assertFalse(writing.done())
+        await writers[0].flush()
+        await writing
+        self.assertEqual(budget.in_flight, 2000)
+
+
+if __name__ == '__main__':
+    unittest.main()
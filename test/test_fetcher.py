@@ -0,0 +1,79 @@
+import asyncio
+import unittest
+
+from aiohttp import web
+
+from sortgs.fetcher import PageFetcher, TokenBucket
+
+
+class TestPageFetcher(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+        async def handler(request):
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            # Earlier pages answer slower so completion order differs from rank order
+            start = int(request.query['start'])
+            await asyncio.sleep(0.05 * (5 - start // 10))
+            self.in_flight -= 1
+            if start == 30:
+                return web.Response(text='Please show you are not a robot')
+            return web.Response(text=f'page {start}')
+
+        app = web.Application()
+        app.router.add_get('/scholar', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        port = self.runner.addresses[0][1]
+        self.urls = [f'http://127.0.0.1:{port}/scholar?start={n}' for n in range(0, 50, 10)]
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_pages_in_rank_order(self):
+        async with PageFetcher(max_concurrency=3, rate=1000, jitter=0) as fetcher:
+            pages = [c async for _, c in fetcher.iter_pages(self.urls)]
+        self.assertEqual(pages[0], b'page 0')
+        self.assertEqual(pages[4], b'page 40')
+        self.assertLessEqual(self.max_in_flight, 3)
+        self.assertGreater(self.max_in_flight, 1)
+
+    async def test_robot_check_uses_fallback(self):
+        async with PageFetcher(rate=1000, jitter=0, robot_kw=['not a robot'],
+                               fallback=lambda url: b'solved') as fetcher:
+            pages = [c async for _, c in fetcher.iter_pages(self.urls)]
+        self.assertEqual(pages[3], b'solved')
+
+    async def test_stop_early(self):
+        async with PageFetcher(max_concurrency=2, rate=1000, jitter=0) as fetcher:
+            async for url, c in fetcher.iter_pages(self.urls):
+                break
+        self.assertEqual(c, b'page 0')
+
+    async def test_parsed_as_fetched(self):
+        async def parse(content, url):
+            return content.decode().upper()
+
+        async with PageFetcher(max_concurrency=3, rate=1000, jitter=0) as fetcher:
+            pages = [c async for _, c in fetcher.iter_pages(self.urls, parse=parse)]
+        self.assertEqual(pages[0], 'PAGE 0')
+        self.assertEqual(pages[4], 'PAGE 40')
+
+
+class TestTokenBucket(unittest.IsolatedAsyncioTestCase):
+    async def test_rate_limit(self):
+        bucket = TokenBucket(rate=20, jitter=0)
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        for _ in range(5):
+            await bucket.acquire()
+        # First token is immediate, the next four wait 1/20 s each
+        self.assertGreaterEqual(loop.time() - start, 0.18)
+
+
+if __name__ == '__main__':
+    unittest.main()
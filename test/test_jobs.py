@@ -0,0 +1,105 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sortgs.jobs import DONE, FAILED, LEASED, MAX_ATTEMPTS, PENDING, JobTable
+
+
+class TestJobTable(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.fpath = os.path.join(self.tmp.name, 'jobs.sqlite')
+        self.first = self.table('first')
+        self.second = self.table('second')
+
+    def table(self, worker, lease=60):
+        jobs = JobTable(self.fpath, lease=lease, worker=worker)
+        self.addCleanup(jobs.close)
+        return jobs
+
+    def test_add_is_idempotent(self):
+        self.first.add([('page', 'a', {'n': 0}), ('page', 'b', {'n': 10})])
+        self.second.add([('page', 'a', {'n': 99})])
+        self.assertEqual(self.first.counts(['page']), {PENDING: 2})
+        self.assertEqual(self.first.payload('a'), {'n': 0})
+
+    def test_units_claimed_once(self):
+        self.first.add([('page', 'a', {}), ('page', 'b', {}), ('pdf', 'c', {})])
+        first = self.first.claim(['page'], n=10)
+        self.assertEqual([job.key for job in first], ['a', 'b'])
+        self.assertEqual(self.second.claim(['page']), [])
+        self.assertEqual([job.key for job in self.second.claim(['page', 'pdf'])], ['c'])
+
+    def test_expired_lease_taken_over(self):
+        crashed = self.table('crashed', lease=0)
+        crashed.add([('page', 'a', {})])
+        job, = crashed.claim(['page'])
+        time.sleep(0.01)
+        taken, = self.second.claim(['page'])
+        self.assertEqual(taken.key, 'a')
+        # The result of the worker that lost its lease is dropped
+        self.assertFalse(crashed.complete(job, ['late']))
+        self.assertTrue(self.second.complete(taken, ['on time']))
+        self.assertEqual(self.first.get('a'), (DONE, ['on time']))
+
+    def test_renew(self):
+        jobs = self.table('slow', lease=0)
+        jobs.add([('page', 'a', {})])
+        jobs.claim(['page'])
+        jobs.lease = 60
+        jobs.renew()
+        self.assertEqual(self.second.claim(['page']), [])
+
+    def test_complete_adds_units(self):
+        self.first.add([('page', 'a', {})])
+        job, = self.first.claim(['page'])
+        self.first.complete(job, [], new_jobs=[('pdf', 'pdf|x', {'url': 'x'})])
+        self.assertEqual(self.second.results('page'), {'a': ({}, [])})
+        self.assertEqual(self.second.counts(['pdf']), {PENDING: 1})
+
+    def test_failed_after_attempts(self):
+        self.first.add([('page', 'a', {})])
+        for _ in range(MAX_ATTEMPTS):
+            self.assertEqual(self.first.get('a')[0], PENDING)
+            job, = self.first.claim(['page'])
+            self.first.fail(job)
+        self.assertEqual(self.first.get('a')[0], FAILED)
+        self.assertEqual(self.first.claim(['page']), [])
+
+    def test_skip(self):
+        self.first.add([('page', 'a', {}), ('page', 'b', {})])
+        self.second.claim(['page'])
+        self.first.skip('page', ['a', 'b'])
+        self.assertEqual(self.first.get('a'), (LEASED, None))
+        self.assertEqual(self.first.get('b'), (DONE, None))
+
+    def test_merge_waits_for_other_units(self):
+        self.first.add([('page', 'a', {}), ('merge', 'merge', {})])
+        job, = self.first.claim(['page'])
+        self.assertEqual(self.second.claim(['merge'], last=True), [])
+        self.first.complete(job, [])
+        merge, = self.second.claim(['merge'], last=True)
+        self.assertEqual(merge.key, 'merge')
+
+    def test_hold(self):
+        jobs = self.table('merging', lease=0.3)
+        jobs.add([('merge', 'merge', {})])
+        jobs.claim(['merge'])
+        jobs.hold()
+        time.sleep(0.6)
+        # Still renewed while the worker writes the output
+        self.assertEqual(self.second.claim(['merge']), [])
+        jobs.release()
+        time.sleep(0.4)
+        self.assertEqual([job.key for job in self.second.claim(['merge'])], ['merge'])
+
+    def test_remove(self):
+        self.first.add([('page', 'a', {})])
+        self.first.remove()
+        self.assertFalse(os.path.exists(self.fpath))
+
+
+if __name__ == '__main__':
+    unittest.main()
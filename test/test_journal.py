@@ -0,0 +1,47 @@
+import tempfile
+import unittest
+
+from sortgs.journal import CheckpointJournal
+
+
+class TestCheckpointJournal(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmp.cleanup()
+
+    def test_replay_appended_pages(self):
+        journal = CheckpointJournal(self.tmp.name, fsync_every=1)
+        journal.append(0, [{'ID': 'paper_0001', 'Rank': 1}, {'ID': 'paper_0002', 'Rank': 2}])
+        journal.append(2, [{'ID': 'paper_0003', 'Rank': 3}])
+        journal.close()
+
+        rows = CheckpointJournal(self.tmp.name).replay()
+        # Rows are read as they are asked for
+        self.assertEqual(next(rows)['Rank'], 1)
+        self.assertEqual([row['Rank'] for row in rows], [2, 3])
+
+    def test_partial_line_is_dropped(self):
+        journal = CheckpointJournal(self.tmp.name)
+        journal.append(0, [{'ID': 'paper_0001', 'Rank': 1}])
+        journal.close()
+        with open(journal.fpath, 'ab') as f:
+            f.write(b'{"start": 1, "rows": [{"ID"')
+
+        journal = CheckpointJournal(self.tmp.name)
+        self.assertEqual(len(list(journal.replay())), 1)
+        journal.append(1, [{'ID': 'paper_0002', 'Rank': 2}])
+        journal.close()
+        self.assertEqual([row['ID'] for row in journal.replay()], ['paper_0001', 'paper_0002'])
+
+    def test_remove(self):
+        journal = CheckpointJournal(self.tmp.name)
+        journal.append(0, [])
+        journal.remove()
+        self.assertFalse(journal.exists())
+        self.assertEqual(list(journal.replay()), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import os
+import tempfile
+import time
+import unittest
+
+from sortgs.localindex import LocalIndex
+from sortgs.records import Paper
+
+
+def make_paper(i, citations=10, year=2015, title=None):
+    return Paper(f'paper_{i:04d}', 'A Author', title or f'Learning deep models {i}', citations, year, 'publisher.org',
+                 'Venue', f'https://example.org/{i}', None, i, 'deep learning', '')
+
+
+class TestLocalIndex(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.index = LocalIndex(os.path.join(self.tmp.name, 'papers.sqlite'))
+        self.addCleanup(self.index.close)
+
+    def test_upsert(self):
+        self.index.add_papers([make_paper(1, citations=10)])
+        paper = make_paper(1, citations=12)
+        paper.download_link = 'https://example.org/1.pdf'
+        self.index.add_papers([paper])
+        self.index.add_papers([make_paper(1, citations=13)])
+        self.index.set_pdfs([(paper, 'abc')])
+        rows = self.index.db.execute('SELECT citations, download_link, pdf_sha256 FROM papers').fetchall()
+        self.assertEqual(rows, [(13, 'https://example.org/1.pdf', 'abc')])
+
+    def test_lookup(self):
+        papers = [make_paper(i) for i in range(1, 11)]
+        self.index.record_query('deep learning', None, 2020, 'All', papers, exhausted=False)
+        found = self.index.lookup('deep learning', None, 2020, 'All', 5, max_age=60)
+        self.assertEqual([paper.title for paper, _ in found], [paper.title for paper in papers[:5]])
+        self.assertIsNone(found[0][0].id)
+        # Other years or languages, more results than recorded, or too old
+        self.assertIsNone(self.index.lookup('deep learning', 2010, 2020, 'All', 5, max_age=60))
+        self.assertIsNone(self.index.lookup('deep learning', None, 2020, ['en'], 5, max_age=60))
+        self.assertIsNone(self.index.lookup('deep learning', None, 2020, 'All', 20, max_age=60))
+        time.sleep(0.01)
+        self.assertIsNone(self.index.lookup('deep learning', None, 2020, 'All', 5, max_age=0))
+
+        # Scholar had no more results
+        self.index.record_query('deep learning', None, 2020, 'All', papers, exhausted=True)
+        self.assertEqual(len(self.index.lookup('deep learning', None, 2020, 'All', 20, max_age=60)), 10)
+
+    def test_search(self):
+        self.index.add_papers([make_paper(1, citations=5), make_paper(2, citations=50, year=2019),
+                               make_paper(3, title='Graph networks')])
+        self.assertEqual([row['citations'] for row in self.index.search('deep LEARNING')], [50, 5])
+        self.assertEqual([row['year'] for row in self.index.search('learning', start_year=2018)], [2019])
+        self.assertEqual(self.index.search('networks')[0]['title'], 'Graph networks')
+        self.assertEqual(self.index.search('transformers'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import json
+import os
+import tempfile
+import unittest
+
+from sortgs.metrics import Metrics
+
+
+class TestMetrics(unittest.TestCase):
+    def setUp(self):
+        self.metrics = Metrics()
+
+    def test_timer(self):
+        with self.metrics.timer('parse'):
+            pass
+        with self.assertRaises(ValueError):
+            with self.metrics.timer('parse'):
+                raise ValueError
+        self.metrics.add_time('parse', 0.5)
+        timer = self.metrics.timers['parse']
+        self.assertEqual(timer.calls, 3)
+        self.assertGreaterEqual(timer.total, 0.5)
+        self.assertEqual(timer.longest, 0.5)
+
+    def test_summary(self):
+        self.metrics.add_time('page.request', 0.1)
+        self.metrics.add_time('parse', 0.3)
+        self.metrics.count('page_bytes', 2048)
+        lines = self.metrics.summary().splitlines()
+        # Slowest stage first, then the counters
+        self.assertTrue(lines[2].startswith('parse'))
+        self.assertTrue(lines[3].startswith('page.request'))
+        self.assertEqual(lines[4].split(), ['page_bytes', '2048'])
+
+    def test_write(self):
+        self.metrics.add_time('page.request', 0.25)
+        self.metrics.count('throttled_robot')
+        with tempfile.TemporaryDirectory() as tmp:
+            fpath = os.path.join(tmp, 'metrics.json')
+            self.metrics.write(fpath)
+            with open(fpath) as f:
+                saved = json.load(f)
+            self.assertEqual(saved['stages']['page.request'], {'calls': 1, 'total': 0.25, 'max': 0.25})
+            self.assertEqual(saved['counters'], {'throttled_robot': 1})
+            self.assertGreater(saved['peak_rss'], 2**20)
+
+            fpath = os.path.join(tmp, 'sortgs.prom')
+            self.metrics.write(fpath)
+            with open(fpath) as f:
+                lines = f.read().splitlines()
+            self.assertIn('sortgs_stage_seconds_total{stage="page.request"} 0.25', lines)
+            self.assertIn('sortgs_throttled_robot_total 1', lines)
+            self.assertTrue(any(line.startswith('sortgs_peak_rss_bytes ') for line in lines))
+            # No temporary files left behind
+            self.assertEqual(sorted(os.listdir(tmp)), ['metrics.json', 'sortgs.prom'])
+
+
+if __name__ == '__main__':
+    unittest.main()
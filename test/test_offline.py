@@ -0,0 +1,395 @@
+'''End-to-end runs of the sortgs command line against the local stub server.'''
+import json
+import os
+import pstats
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+import unittest
+
+import pandas as pd
+
+from sortgs.postprocess import score
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir, 'benchmarks'))
+from bench_e2e import RUNNER  # noqa: E402
+from stub_server import KEYWORD, StubServer  # noqa: E402
+
+
+class OfflineTestCase(unittest.TestCase):
+    """Starts a stub server and a temporary folder, with its own cache, for the runs of a test class."""
+    latency = 0
+
+    @classmethod
+    def setUpClass(cls):
+        cls.server = StubServer(latency=cls.latency, pdf_size=4096).start()
+        cls.tmp = tempfile.TemporaryDirectory()
+        cls.env = dict(os.environ, XDG_CACHE_HOME=os.path.join(cls.tmp.name, 'cache'))
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.stop()
+        cls.tmp.cleanup()
+
+    @classmethod
+    def command(cls, *args, csvpath=None):
+        """Returns the sortgs command line with `args`, saving to `csvpath`, by default the temporary folder."""
+        return [sys.executable, '-c', RUNNER, cls.server.scholar_url, *args,
+                '--csvpath', csvpath or cls.tmp.name, '--rate', '1000']
+
+    @classmethod
+    def run_sortgs(cls, *args, csvpath=None):
+        """Runs sortgs with `args` and returns what it printed."""
+        return subprocess.run(cls.command(*args, csvpath=csvpath), check=True, env=cls.env,
+                              capture_output=True, text=True).stdout
+
+
+class TestOffline(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.expected = pd.DataFrame(cls.server.rows[:30])
+        cls.run_sortgs(KEYWORD, '--nresults', '30')
+        cls.df = pd.read_csv(os.path.join(cls.tmp.name, 'machine_learning.csv'))
+
+    def test_number_of_results(self):
+        self.assertEqual(len(self.df), 30)
+        self.assertEqual(sorted(self.df.Rank), list(range(1, 31)))
+
+    def test_is_sorted_by_citations(self):
+        expected = sorted(self.expected.Citations.astype(int), reverse=True)
+        self.assertEqual(list(self.df.Citations), expected)
+
+    def test_fields_in_rank_order(self):
+        df = self.df.sort_values('Rank')
+        self.assertEqual(list(df.Title), list(self.expected.Title))
+        self.assertEqual(list(df.Year), list(self.expected.Year.astype(int)))
+        self.assertEqual([a.strip() for a in df.Author], [a.strip() for a in self.expected.Author])
+
+    def test_pdfs_downloaded(self):
+        # Every third result links a PDF and every third links a landing page
+        pdfs = os.listdir(os.path.join(self.tmp.name, 'PDFs'))
+        self.assertEqual(len(pdfs), 20)
+        self.assertEqual(self.server.stats['landings'], 10)
+
+    def test_checkpoint_removed(self):
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'temp_results.jsonl')))
+
+
+class TestOfflineResume(OfflineTestCase):
+    resume_args = ()
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        first = os.path.join(cls.tmp.name, 'first')
+        cls.run_sortgs(KEYWORD, '--nresults', '30', csvpath=first)
+        # A run interrupted after two pages, before any of their PDFs was downloaded
+        rows = pd.read_csv(os.path.join(first, 'machine_learning.csv')).sort_values('Rank')
+        rows = rows.astype(object).where(rows.notna(), None).to_dict('records')[:20]
+        cls.pending = sum(row['Download Link'] is not None for row in rows)
+        cls.resumed = os.path.join(cls.tmp.name, 'resumed')
+        os.makedirs(cls.resumed)
+        with open(os.path.join(cls.resumed, 'temp_results.jsonl'), 'w') as f:
+            for start in (0, 10):
+                page = [dict(row, Keyword=KEYWORD, Slice='', **{'Download Status': 'Pending'})
+                        for row in rows[start:start + 10]]
+                f.write(json.dumps({'start': start, 'rows': page}) + '\n')
+        cls.run_sortgs(KEYWORD, '--nresults', '30', *cls.resume_args, csvpath=cls.resumed)
+        cls.df = pd.read_csv(os.path.join(cls.resumed, 'machine_learning.csv'))
+
+    def test_pending_pdfs_downloaded(self):
+        self.assertGreater(self.pending, 0)
+        pdfs = os.listdir(os.path.join(self.resumed, 'PDFs'))
+        self.assertEqual(len(pdfs), self.df['Download Link'].notna().sum())
+        self.assertEqual(len(self.df), 30)
+
+
+class TestOfflineResumeLowMemory(TestOfflineResume):
+    resume_args = ('--low-memory',)
+
+
+class TestOfflineBatch(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        kwfile = os.path.join(cls.tmp.name, 'keywords.txt')
+        with open(kwfile, 'w') as f:
+            f.write('# Keywords\ndeep learning\n\n')
+        # The stub server returns the same papers for every keyword
+        cls.run_sortgs(KEYWORD, '--kwfile', kwfile, '--nresults', '30')
+
+    def test_csv_per_keyword(self):
+        for fname in ['machine_learning.csv', 'deep_learning.csv']:
+            df = pd.read_csv(os.path.join(self.tmp.name, fname))
+            self.assertEqual(sorted(df.Rank), list(range(1, 31)))
+        self.assertEqual(self.server.stats['pages'], 6)
+
+    def test_merged_without_duplicates(self):
+        df = pd.read_csv(os.path.join(self.tmp.name, 'merged.csv'))
+        # Results without a title can't be matched across keywords
+        unknown = df.Title == 'Could not catch title'
+        self.assertEqual(len(df[~unknown]), 30 - unknown.sum() // 2)
+        self.assertEqual(set(df[~unknown].Keywords), {'machine learning; deep learning'})
+        self.assertTrue(df.ID.is_unique)
+
+    def test_shared_downloads(self):
+        # Each PDF is downloaded once, even when both keywords found the paper
+        df = pd.read_csv(os.path.join(self.tmp.name, 'merged.csv'))
+        pdfs = os.listdir(os.path.join(self.tmp.name, 'PDFs'))
+        self.assertEqual(len(pdfs), df['Download Link'].notna().sum())
+        self.assertEqual(self.server.stats['pdfs'], df['Download Link'].nunique())
+        self.assertLess(len(pdfs), 40)
+
+
+class TestOfflineSlices(OfflineTestCase):
+    def search(self, *args):
+        csvpath = tempfile.mkdtemp(dir=self.tmp.name)
+        self.run_sortgs(KEYWORD, '--endyear', '2016', *args, csvpath=csvpath)
+        return pd.read_csv(os.path.join(csvpath, 'machine_learning.csv'))
+
+    def test_year_slices(self):
+        before = self.server.stats['pages']
+        df = self.search('--slices', 'year', '--startyear', '2010', '--nresults', '30')
+        expected = [row for row in self.server.rows if 2010 <= int(row['Year']) <= 2016]
+        # One page per year, each with every result of its year
+        self.assertEqual(self.server.stats['pages'] - before, 7)
+        self.assertEqual(len(df), len(expected))
+        self.assertEqual(sorted(df.Rank), list(range(1, len(expected) + 1)))
+        self.assertEqual(sorted(df.Title), sorted(row['Title'] for row in expected))
+
+    def test_auto_slices(self):
+        before = self.server.stats['pages']
+        df = self.search('--slices', 'auto', '--startyear', '2000', '--nresults', '30')
+        # A single range is enough, its first page is counted and then read from the cache
+        self.assertEqual(self.server.stats['pages'] - before, 3)
+        self.assertEqual(len(df), 30)
+        self.assertTrue(df.Year.between(2000, 2016).all())
+
+
+class TestOfflineFormats(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.run_sortgs(KEYWORD, '--format', 'sqlite', '--nresults', '30')
+
+    def test_sqlite(self):
+        with sqlite3.connect(os.path.join(self.tmp.name, 'machine_learning.sqlite')) as db:
+            df = pd.read_sql('SELECT * FROM sorted', db)
+        db.close()
+        self.assertEqual(sorted(df.Rank), list(range(1, 31)))
+        expected = sorted((int(row['Citations']) for row in self.server.rows[:30]), reverse=True)
+        self.assertEqual(list(df.Citations), expected)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'machine_learning.csv')))
+
+
+class TestOfflineScore(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.run_sortgs(KEYWORD, '--nresults', '30', '--weights', 'Citations=1,cit/year=10', '--half-life', '5',
+                       '--endyear', '2024')
+        cls.df = pd.read_csv(os.path.join(cls.tmp.name, 'machine_learning.csv'))
+
+    def test_sorted_by_score(self):
+        self.assertEqual(len(self.df), 30)
+        self.assertEqual(list(self.df.Score), sorted(self.df.Score, reverse=True))
+        expected = score(self.df, {'Citations': 1, 'cit/year': 10}, half_life=5, end_year=2024)
+        self.assertEqual(list(self.df.Score), list(expected))
+
+
+class TestOfflineRefresh(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.run_sortgs(KEYWORD, '--nresults', '30')
+        cls.fpath = os.path.join(cls.tmp.name, 'machine_learning.csv')
+        cls.before = pd.read_csv(cls.fpath)
+
+        # An older file: other citations, a paper not found anymore and one not found yet
+        old = cls.before.sort_values('Rank')
+        old.loc[old.Rank == 1, 'Citations'] -= 5
+        old = old[old.Rank != 30]
+        old = pd.concat([old, old[old.Rank == 2].assign(ID='paper_0099', Title='Gone', Source='https://gone.org')])
+        old.to_csv(cls.fpath, index=False)
+
+        cls.stats = dict(cls.server.stats)
+        cls.run_sortgs('--refresh-from', cls.fpath)
+        cls.after = pd.read_csv(cls.fpath)
+        cls.diff = pd.read_csv(os.path.join(cls.tmp.name, 'machine_learning_diff.csv'))
+
+    def test_updated_in_place(self):
+        after = self.after.sort_values('Rank').reset_index(drop=True)
+        before = self.before.sort_values('Rank').reset_index(drop=True)
+        # Only the paper missing from the older file gets a new ID
+        self.assertEqual(list(after.ID[:29]), list(before.ID[:29]))
+        self.assertEqual(after.ID[29], 'paper_0100')
+        pd.testing.assert_frame_equal(after.drop(columns='ID'), before.drop(columns='ID'))
+
+    def test_only_pages_fetched(self):
+        # The pages are fetched again, the links and PDFs of known papers are not
+        self.assertEqual(self.server.stats['pages'] - self.stats['pages'], 3)
+        self.assertEqual(self.server.stats['landings'], self.stats['landings'])
+        self.assertEqual(self.server.stats['pdfs'], self.stats['pdfs'])
+
+    def test_diff(self):
+        status = self.diff.set_index('ID')['Status']
+        self.assertEqual(status['paper_0099'], 'dropped')
+        self.assertEqual(status['paper_0100'], 'new')
+        first = self.diff[self.diff['Rank After'] == 1].iloc[0]
+        self.assertEqual(first.Status, 'changed')
+        self.assertEqual(first['Citation Change'], 5)
+        self.assertEqual((self.diff.Status == 'same').sum(), 28)
+
+
+class TestOfflineRefreshInterrupted(OfflineTestCase):
+    latency = 0.1
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.run_sortgs(KEYWORD, '--nresults', '30')
+        cls.fpath = os.path.join(cls.tmp.name, 'machine_learning.csv')
+        cls.before = pd.read_csv(cls.fpath)
+
+        # Killed once the first page of the refresh is in the journal
+        refresh = subprocess.Popen(cls.command('--refresh-from', cls.fpath), env=cls.env,
+                                   stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        journal = os.path.join(cls.tmp.name, 'temp_results.jsonl')
+        deadline = time.monotonic() + 30
+        while not (os.path.exists(journal) and os.path.getsize(journal)) and time.monotonic() < deadline:
+            time.sleep(0.01)
+        refresh.kill()
+        refresh.wait()
+        cls.interrupted = pd.read_csv(cls.fpath)
+        cls.out = cls.run_sortgs('--refresh-from', cls.fpath)
+        cls.after = pd.read_csv(cls.fpath)
+
+    def test_original_kept(self):
+        pd.testing.assert_frame_equal(self.interrupted, self.before)
+
+    def test_resumed(self):
+        self.assertIn('Resuming from saved progress.', self.out)
+        self.assertIn('0 new, 0 dropped', self.out)
+        pd.testing.assert_frame_equal(self.after, self.before)
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'machine_learning.refresh.csv')))
+
+
+class TestOfflineProfile(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.out = cls.run_sortgs(KEYWORD, '--profile', '--metrics-file', os.path.join(cls.tmp.name, 'metrics.json'),
+                                 '--cprofile', os.path.join(cls.tmp.name, 'run.prof'), '--nresults', '30')
+        with open(os.path.join(cls.tmp.name, 'metrics.json')) as f:
+            cls.metrics = json.load(f)
+
+    def test_counters(self):
+        counters = self.metrics['counters']
+        self.assertEqual(counters['pages_requested'], self.server.stats['pages'])
+        self.assertEqual(counters['results_parsed'], 30)
+        self.assertEqual(counters['pdfs_saved'], 20)
+        self.assertEqual(counters['pdf_bytes'], self.server.stats['pdfs'] * len(self.server.pdf_payload))
+
+    def test_stages(self):
+        for stage in ['crawl', 'page.request', 'parse', 'resolve', 'download', 'checkpoint', 'output.write',
+                      'output.finalize', 'postprocess']:
+            self.assertIn(stage, self.metrics['stages'])
+        self.assertEqual(self.metrics['stages']['parse']['calls'], 3)
+
+    def test_report(self):
+        self.assertIn('Mean (ms)', self.out)
+        self.assertIn('cumulative', self.out)
+        self.assertGreater(pstats.Stats(os.path.join(self.tmp.name, 'run.prof')).total_calls, 0)
+
+
+class TestOfflineIndex(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        first = os.path.join(cls.tmp.name, 'first')
+        cls.run_sortgs(KEYWORD, '--cache-ttl', '0', '--nresults', '30', csvpath=first)
+        cls.before = pd.read_csv(os.path.join(first, 'machine_learning.csv'))
+        cls.stats = dict(cls.server.stats)
+        cls.second = os.path.join(cls.tmp.name, 'second')
+        cls.run_sortgs(KEYWORD, '--cache-ttl', '0', '--nresults', '20', '--from-index', csvpath=cls.second)
+        cls.after = pd.read_csv(os.path.join(cls.second, 'machine_learning.csv'))
+
+    def test_answered_from_index(self):
+        self.assertEqual(self.server.stats, self.stats)
+        before = self.before[self.before.Rank <= 20].sort_values('Rank').reset_index(drop=True)
+        after = self.after.sort_values('Rank').reset_index(drop=True)
+        pd.testing.assert_frame_equal(after, before)
+
+    def test_pdfs_from_store(self):
+        # The PDFs are linked from the store, not downloaded again
+        pdfs = self.before[self.before.Rank <= 20]['Download Link'].notna().sum()
+        self.assertGreater(pdfs, 0)
+        self.assertEqual(len(os.listdir(os.path.join(self.second, 'PDFs'))), pdfs)
+
+
+class TestOfflineWorkers(OfflineTestCase):
+    latency = 0.05
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.expected = pd.DataFrame(cls.server.rows[:50])
+        command = cls.command(KEYWORD, '--nresults', '50', '--max-concurrency', '2', '--worker')
+        workers = [subprocess.Popen(command, env=cls.env, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True)
+                   for _ in range(2)]
+        cls.outputs = [worker.communicate()[0] for worker in workers]
+        for worker in workers:
+            assert worker.returncode == 0
+        cls.df = pd.read_csv(os.path.join(cls.tmp.name, 'machine_learning.csv'))
+
+    def test_results_written_once(self):
+        self.assertEqual(sum('Another worker writes the results.' in output for output in self.outputs), 1)
+        df = self.df.sort_values('Rank')
+        self.assertEqual(list(df.Rank), list(range(1, 51)))
+        self.assertEqual(list(df.Title), list(self.expected.Title))
+
+    def test_pages_fetched_once(self):
+        self.assertEqual(self.server.stats['pages'], 5)
+
+    def test_pdfs_linked(self):
+        pdfs = os.listdir(os.path.join(self.tmp.name, 'PDFs'))
+        self.assertEqual(len([fname for fname in pdfs if fname.endswith('.pdf')]), 34)
+
+    def test_job_table_removed(self):
+        self.assertFalse(os.path.exists(os.path.join(self.tmp.name, 'jobs.sqlite')))
+
+
+class TestOfflineLowMemory(OfflineTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        kwfile = os.path.join(cls.tmp.name, 'keywords.txt')
+        with open(kwfile, 'w') as f:
+            f.write('deep learning\n')
+        args = [KEYWORD, '--kwfile', kwfile, '--nresults', '30', '--sortby', 'cit/year', '--top', '5']
+        cls.normal = os.path.join(cls.tmp.name, 'normal')
+        cls.run_sortgs(*args, csvpath=cls.normal)
+        cls.low = os.path.join(cls.tmp.name, 'low')
+        cls.out = cls.run_sortgs(*args, '--low-memory', csvpath=cls.low)
+
+    def test_same_results(self):
+        for fname in ['machine_learning.csv', 'deep_learning.csv', 'merged.csv']:
+            normal = pd.read_csv(os.path.join(self.normal, fname))
+            low = pd.read_csv(os.path.join(self.low, fname))
+            pd.testing.assert_frame_equal(low, normal[low.columns])
+
+    def test_top_only_printed(self):
+        merged = pd.read_csv(os.path.join(self.normal, 'merged.csv'))
+        self.assertGreater(len(merged), 30)
+
+    def test_report(self):
+        self.assertIn('Merged results of all keywords', self.out)
+        self.assertIn('Peak memory:', self.out)
+        self.assertNotIn('pandas', self.out)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+import unittest
+import warnings
+
+from sortgs.parser import BS4_FEATURES, HTMLParser, PARSE_WORKERS, ParsePool, get_total_results, parse_page
+
+PAGE = '''<html><body><div id="gs_res_ccl_mid">
+<div class="gs_r gs_or gs_scl" data-cid="a1">
+<div class="gs_ggs gs_fl"><div class="gs_ggsd"><div class="gs_or_ggsm"><a href="https://example.org/paper.pdf"><span class="gs_ctg2">[PDF]</span> example.org</a></div></div></div>
+<div class="gs_ri"><h3 class="gs_rt"><a href="https://example.org/understanding">Understanding machine learning: From theory to algorithms</a></h3>
+<div class="gs_a">S Shalev-Shwartz,&nbsp;S Ben-David - Cambridge University Press, 2014 - books.google.com</div>
+<div class="gs_fl"><a href="#">Save</a> <a href="/scholar?cites=1">Cited by 3166</a> <a>Related articles</a></div></div></div>
+<div class="gs_r gs_or gs_scl" data-cid="a2">
+<div class="gs_ggs gs_fl"><div class="gs_ggsd"><div class="gs_or_ggsm"><a href="https://example.org/landing"><span class="gs_ctg2">[HTML]</span> example.org</a></div></div></div>
+<div class="gs_ri"><h3 class="gs_rt"><span class="gs_ctu">[CITATION]</span> Elements of machine learning</h3>
+<div class="gs_fl"><a href="#">Save</a></div></div></div>
+</div></body></html>'''.encode('utf-8')
+
+
+class TestParser(unittest.TestCase):
+    def backends(self):
+        backends = ['html.parser']
+        if BS4_FEATURES == 'lxml':
+            backends.append('lxml')
+        if HTMLParser is not None:
+            backends.append('selectolax')
+        return backends
+
+    def test_fields(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            first, second = parse_page(PAGE, 'https://scholar.google.com/scholar?start=0', 'html.parser')
+
+        self.assertEqual(first['title'], 'Understanding machine learning: From theory to algorithms')
+        self.assertEqual(first['link'], 'https://example.org/understanding')
+        self.assertEqual(first['citations'], 3166)
+        self.assertEqual(first['year'], 2014)
+        self.assertEqual(first['author'], 'S Shalev-Shwartz, S Ben-David')
+        self.assertEqual(first['venue'], ' Cambridge University Press')
+        self.assertEqual(first['publisher'], ' books.google.com')
+        self.assertEqual(first['download_link'], 'https://example.org/paper.pdf')
+        self.assertIsNone(first['html_link'])
+
+        self.assertEqual(second['title'], 'Could not catch title')
+        self.assertEqual(second['link'], 'Look manually at: https://scholar.google.com/scholar?start=0')
+        self.assertEqual(second['citations'], 0)
+        self.assertEqual(second['year'], 0)
+        self.assertEqual(second['author'], 'Author not found')
+        self.assertIsNone(second['download_link'])
+        self.assertEqual(second['html_link'], 'https://example.org/landing')
+
+    def test_backends_agree(self):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            results = [parse_page(PAGE, 'url', backend) for backend in self.backends()]
+        for result in results[1:]:
+            self.assertEqual(result, results[0])
+
+    def test_no_results(self):
+        self.assertEqual(parse_page(b'<html><body>Nothing here</body></html>', backend='html.parser'), [])
+
+    def test_total_results(self):
+        header = b'<div id="gs_ab_md"><div class="gs_ab_mdw">About 1,230,000 results (<b>0.04</b> sec)</div></div>'
+        self.assertEqual(get_total_results(header + PAGE), 1230000)
+        self.assertEqual(get_total_results(b'<div class="gs_ab_mdw">1 result (<b>0.01</b> sec)</div>'), 1)
+        self.assertIsNone(get_total_results(PAGE))
+
+
+class TestParsePool(unittest.IsolatedAsyncioTestCase):
+    async def assertParses(self, pool):
+        with pool, warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            expected = parse_page(PAGE, 'url', pool.backend)
+            self.assertEqual([await pool.parse(PAGE, 'url') for _ in range(3)], [expected] * 3)
+        self.assertIsNone(pool._executor)
+
+    async def test_processes(self):
+        pool = ParsePool(workers=2, backend='html.parser')
+        self.assertEqual(pool.kind, 'process')
+        await self.assertParses(pool)
+
+    @unittest.skipIf(HTMLParser is None, 'selectolax is not installed')
+    async def test_threads(self):
+        pool = ParsePool(workers=2, backend='selectolax')
+        self.assertEqual(pool.kind, 'thread')
+        await self.assertParses(pool)
+
+    def test_default_workers(self):
+        # Only threads are started unless processes are asked for
+        self.assertEqual(ParsePool(backend='html.parser').workers, 0)
+        self.assertEqual(ParsePool(backend='selectolax').workers, PARSE_WORKERS)
+
+    async def test_inline(self):
+        await self.assertParses(ParsePool(workers=0, backend='html.parser'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,38 @@
+import unittest
+
+from sortgs.planner import YearSlice, allocate, bisect_slices, year_slices
+
+
+class TestPlanner(unittest.IsolatedAsyncioTestCase):
+    async def test_bisect_until_under_cap(self):
+        per_year = {year: 300 for year in range(2000, 2008)}
+        counted = []
+
+        async def count_results(start_year, end_year):
+            counted.append((start_year, end_year))
+            return sum(per_year[y] for y in range(start_year, end_year + 1))
+
+        slices = await bisect_slices(2000, 2007, count_results, cap=1000)
+        self.assertEqual([s.key for s in slices], ['2000-2001', '2002-2003', '2004-2005', '2006-2007'])
+        self.assertEqual([s.count for s in slices], [600] * 4)
+        self.assertEqual(len(counted), 7)
+
+    async def test_single_year_not_split(self):
+        async def count_results(start_year, end_year):
+            return 5000
+
+        slices = await bisect_slices(2020, 2021, count_results, cap=1000)
+        self.assertEqual(slices, [YearSlice(2020, 2020, 5000), YearSlice(2021, 2021, 5000)])
+
+    def test_year_slices(self):
+        self.assertEqual([s.key for s in year_slices(2019, 2021)], ['2019-2019', '2020-2020', '2021-2021'])
+
+    def test_allocate(self):
+        slices = [YearSlice(2000, 2000, 15), YearSlice(2001, 2001, None), YearSlice(2002, 2002, 5000)]
+        # The small slice only has 15 results, the two others share the rest
+        self.assertEqual(allocate(slices, 1500, cap=1000), [20, 750, 750])
+        self.assertEqual(allocate(slices, 5000, cap=1000), [20, 1000, 1000])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import os
+import tempfile
+import unittest
+
+import numpy as np
+import pandas as pd
+
+from sortgs.postprocess import downsample, parse_sortby, parse_weights, plot_results, row_score, score, sort_frame
+from sortgs.sinks import INT_COLUMNS
+
+
+class TestSortFrame(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        n = 2000
+        # Few distinct values, so the best rows are tied on the first key
+        self.data = pd.DataFrame({'Citations': rng.integers(0, 50, n), 'Year': rng.integers(1990, 2024, n),
+                                  'Title': [f'Title {i}' for i in range(n)]}, index=pd.RangeIndex(1, n + 1, name='Rank'))
+
+    def test_parse_sortby(self):
+        self.assertEqual(parse_sortby('cit/year'), [('cit/year', False)])
+        self.assertEqual(parse_sortby('Citations, Year asc,Title DESC'),
+                         [('Citations', False), ('Year', True), ('Title', False)])
+
+    def test_top_matches_full_sort(self):
+        for sortby in ['Citations', 'Citations, Year asc', 'Year asc, Citations', 'Title']:
+            keys = parse_sortby(sortby)
+            full = sort_frame(self.data, keys)
+            pd.testing.assert_frame_equal(sort_frame(self.data, keys, top=25), full.head(25))
+        self.assertEqual(len(sort_frame(self.data, keys, top=5000)), 2000)
+
+    def test_top_with_missing_values(self):
+        data = self.data.astype({'Citations': 'Int64'})
+        data.loc[data.index > 10, 'Citations'] = pd.NA
+        keys = [('Citations', False)]
+        pd.testing.assert_frame_equal(sort_frame(data, keys, top=20), sort_frame(data, keys).head(20))
+
+
+class TestScore(unittest.TestCase):
+    def test_weights_and_decay(self):
+        data = pd.DataFrame({'Citations': [100, 100, 100], 'cit/year': [10, 20, 0], 'Year': [2020, 2010, 0]})
+        self.assertEqual(list(score(data)), [100, 100, 100])
+        weights = parse_weights('Citations=1, cit/year=2')
+        self.assertEqual(weights, {'Citations': 1, 'cit/year': 2})
+        self.assertEqual(list(score(data, weights)), [120, 140, 100])
+        # Halved every 10 years, papers without a year are not decayed
+        self.assertEqual(list(score(data, half_life=10, end_year=2020)), [100, 50, 100])
+
+    def test_row_score(self):
+        data = pd.DataFrame({'Citations': [100, 7, 3], 'cit/year': [10, 1, 0], 'Year': [2020, 2003, 0]})
+        weights = {'Citations': 1, 'cit/year': 10}
+        scores = score(data, weights, half_life=3, end_year=2020)
+        row_scores = [row_score(weights, half_life=3, end_year=2020)(row) for row in data.to_dict('records')]
+        self.assertEqual(row_scores, list(scores))
+
+    def test_bad_weights(self):
+        with self.assertRaises(ValueError):
+            parse_weights('Citations')
+        # A typo, and a column that isn't a number
+        for weights in ['Citation=1', 'Title=1']:
+            with self.assertRaises(ValueError):
+                parse_weights(weights, INT_COLUMNS)
+
+
+class TestPlot(unittest.TestCase):
+    def test_downsample(self):
+        values = np.arange(100000)[::-1]
+        keep = downsample(values, 1000)
+        self.assertLessEqual(len(keep), 1000)
+        self.assertEqual(keep[0], 0)
+        self.assertEqual(keep[-1], len(values) - 1)
+        self.assertTrue((np.diff(keep) > 0).all())
+        self.assertEqual(list(downsample(values[:10], 1000)), list(range(10)))
+
+    def test_plot_to_file(self):
+        data = pd.DataFrame({'Citations': np.arange(20000)}, index=pd.RangeIndex(1, 20001, name='Rank'))
+        with tempfile.TemporaryDirectory() as tmp:
+            fpath = os.path.join(tmp, 'plot.png')
+            plot_results({'machine learning': data, 'deep learning': data}, fpath, max_points=500)
+            self.assertGreater(os.path.getsize(fpath), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
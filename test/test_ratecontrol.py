@@ -0,0 +1,97 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from aiohttp import web
+
+from sortgs.fetcher import PageFetcher
+from sortgs.ratecontrol import RateController
+
+
+class TestRateController(unittest.IsolatedAsyncioTestCase):
+    async def test_aimd(self):
+        controller = RateController(rate=1, max_rate=1.1, increase=0.04, backoff=0.01)
+        for _ in range(5):
+            controller.success()
+        self.assertAlmostEqual(controller.rate, 1.1)
+        controller.throttled('429')
+        self.assertAlmostEqual(controller.rate, 0.55)
+        self.assertEqual(controller.metrics['throttled_429'], 1)
+
+    async def test_backoff_doubles(self):
+        controller = RateController(rate=1, backoff=0.01, max_backoff=0.03)
+        delays = [controller.throttled('robot') for _ in range(3)]
+        self.assertEqual(delays, [0.01, 0.02, 0.03])
+        self.assertEqual(controller.throttled('503', retry_after=0), 0)
+        controller.success()
+        self.assertEqual(controller.throttled('robot'), 0.01)
+
+    async def test_fixed_rate(self):
+        controller = RateController(rate=1, adaptive=False)
+        controller.success()
+        self.assertEqual(controller.throttled('429'), 0)
+        self.assertEqual(controller.rate, 1)
+        self.assertEqual(controller.metrics['requests'], 2)
+
+
+class TestLearnedRate(unittest.TestCase):
+    def test_saved_between_runs(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            fpath = os.path.join(tmp, 'rate.json')
+            self.assertEqual(RateController.load(fpath).rate, 0.5)
+            controller = RateController.load(fpath, rate=1.5)
+            controller.success()
+            controller.save()
+            self.assertAlmostEqual(RateController.load(fpath).rate, 1.52)
+            # A given rate wins over the saved one
+            self.assertEqual(RateController.load(fpath, rate=0.2).rate, 0.2)
+
+            with open(fpath, 'w') as f:
+                json.dump({'rate': 1.5, 'updated': time.time() - 30 * 24 * 3600}, f)
+            self.assertEqual(RateController.load(fpath).rate, 0.5)
+
+
+class TestThrottledFetch(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.answers = []
+
+        async def handler(request):
+            if self.answers:
+                status, text = self.answers.pop(0)
+                return web.Response(status=status, text=text, headers={'Retry-After': '0'} if status == 503 else {})
+            return web.Response(text='page')
+
+        app = web.Application()
+        app.router.add_get('/scholar', handler)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.url = f'http://127.0.0.1:{self.runner.addresses[0][1]}/scholar'
+
+    async def asyncTearDown(self):
+        await self.runner.cleanup()
+
+    async def test_retried_after_backoff(self):
+        self.answers = [(429, 'slow down'), (200, 'Please show you are not a robot'), (503, 'unavailable')]
+        controller = RateController(rate=100, jitter=0, backoff=0.01)
+        async with PageFetcher(robot_kw=['not a robot'], controller=controller) as fetcher:
+            self.assertEqual(await fetcher.fetch(self.url), b'page')
+        self.assertEqual(controller.metrics['requests'], 4)
+        self.assertEqual(controller.metrics['clean'], 1)
+        self.assertEqual(controller.metrics['backoff_seconds'], 0.03)
+        self.assertLess(controller.rate, 100)
+
+    async def test_fallback_after_retries(self):
+        self.answers = [(200, 'Please show you are not a robot')] * 3
+        controller = RateController(rate=100, jitter=0, backoff=0.01, max_retries=2)
+        async with PageFetcher(robot_kw=['not a robot'], controller=controller,
+                               fallback=lambda url: b'solved') as fetcher:
+            self.assertEqual(await fetcher.fetch(self.url), b'solved')
+        self.assertEqual(controller.metrics['throttled_robot'], 3)
+
+
+if __name__ == '__main__':
+    unittest.main()
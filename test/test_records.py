@@ -0,0 +1,43 @@
+import unittest
+
+from sortgs.records import COLUMNS, Paper, PaperTable
+
+
+def make_paper(i):
+    return Paper(f'paper_{i:04d}', 'A Author', f'Title {i}', 10 * i, 2000 + i, 'publisher.org', 'Venue',
+                 f'https://example.org/{i}', None, i, 'machine learning', '')
+
+
+class TestRecords(unittest.TestCase):
+    def test_row_round_trip(self):
+        paper = make_paper(1)
+        row = paper.to_row(**{'Download Status': True})
+        self.assertEqual(row['Title'], 'Title 1')
+        self.assertEqual(row['Download Status'], True)
+        self.assertEqual(Paper.from_row(row), paper)
+
+    def test_old_rows_without_query(self):
+        row = make_paper(1).to_row()
+        del row['Keyword'], row['Slice']
+        self.assertEqual(Paper.from_row(row, keyword='deep learning').query, ('deep learning', ''))
+
+    def test_table(self):
+        table = PaperTable()
+        for i in range(1, 6):
+            table.append(make_paper(i))
+        self.assertEqual(len(table), 5)
+        self.assertEqual(table[-1], make_paper(5))
+
+        data = table.to_frame()
+        self.assertEqual(list(data.columns), COLUMNS)
+        self.assertEqual(list(data['Citations']), [10, 20, 30, 40, 50])
+        self.assertEqual(str(data['Year'].dtype), 'int64')
+        self.assertEqual(list(data['ID']), [f'paper_{i:04d}' for i in range(1, 6)])
+
+    def test_slots(self):
+        with self.assertRaises(AttributeError):
+            make_paper(1).extra = True
+
+
+if __name__ == '__main__':
+    unittest.main()
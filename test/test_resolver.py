@@ -0,0 +1,99 @@
+import asyncio
+import os
+import tempfile
+import time
+import unittest
+
+import aiohttp
+from aiohttp import web
+
+from sortgs.resolver import LinkResolver, find_pdf_link
+
+
+class TestFindPdfLink(unittest.TestCase):
+    def test_relative_and_escaped_links(self):
+        page = b'<a href="/about">About</a><a class="x" href=\'/files/paper.PDF?a=1&amp;b=2\'>PDF</a>'
+        self.assertEqual(find_pdf_link('https://example.org/article/1', page),
+                         'https://example.org/files/paper.PDF?a=1&b=2')
+
+    def test_no_pdf(self):
+        self.assertIsNone(find_pdf_link('https://example.org/', b'<a href="/about">About</a>'))
+
+
+class TestLinkResolver(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.hits = []
+        self.release = asyncio.Event()
+
+        async def landing(request):
+            self.hits.append(request.path)
+            response = web.StreamResponse()
+            await response.prepare(request)
+            await response.write(b'<html><body>' + b'<p>text</p>' * 100 + b'<a href="/paper.pdf">PDF</a>')
+            # The rest of the page is slow, it should never be waited for
+            await self.release.wait()
+            await response.write(b'</body></html>')
+            return response
+
+        async def empty(request):
+            self.hits.append(request.path)
+            return web.Response(text='<a href="/about">About</a>', content_type='text/html')
+
+        async def slow(request):
+            await self.release.wait()
+            return web.Response(text='')
+
+        app = web.Application()
+        app.router.add_get('/landing', landing)
+        app.router.add_get('/empty', empty)
+        app.router.add_get('/slow', slow)
+        self.runner = web.AppRunner(app)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, '127.0.0.1', 0)
+        await site.start()
+        self.base = f'http://127.0.0.1:{self.runner.addresses[0][1]}'
+        self.tmp = tempfile.TemporaryDirectory()
+        self.cache_path = os.path.join(self.tmp.name, 'links.jsonl')
+        self.session = aiohttp.ClientSession()
+
+    async def asyncTearDown(self):
+        self.release.set()
+        await self.session.close()
+        await self.runner.cleanup()
+        self.tmp.cleanup()
+
+    async def test_stops_reading_once_pdf_found(self):
+        resolver = LinkResolver(self.session, self.cache_path)
+        start = time.perf_counter()
+        pdf_link = await resolver.resolve(f'{self.base}/landing')
+        self.assertEqual(pdf_link, f'{self.base}/paper.pdf')
+        self.assertLess(time.perf_counter() - start, 2)
+
+    async def test_cache_persists_across_resolvers(self):
+        links = [f'{self.base}/landing', f'{self.base}/empty']
+        resolver = LinkResolver(self.session, self.cache_path)
+        first = await asyncio.gather(*(resolver.resolve(link) for link in links + links))
+        self.assertEqual(len(self.hits), 2)
+
+        resolver = LinkResolver(self.session, self.cache_path)
+        second = await asyncio.gather(*(resolver.resolve(link) for link in links))
+        self.assertEqual(len(self.hits), 2)
+        self.assertEqual(second, first[:2])
+        self.assertIsNone(second[1])
+
+    async def test_own_session(self):
+        async with LinkResolver(cache_path=self.cache_path) as resolver:
+            session = resolver.session
+            self.assertIsNot(session, self.session)
+            self.assertEqual(await resolver.resolve(f'{self.base}/landing'), f'{self.base}/paper.pdf')
+        self.assertTrue(session.closed)
+
+    async def test_timeout(self):
+        resolver = LinkResolver(self.session, self.cache_path, timeout=0.2)
+        self.assertIsNone(await resolver.resolve(f'{self.base}/slow'))
+        # Failures are not cached, the page is tried again next time
+        self.assertNotIn(f'{self.base}/slow', resolver.cache)
+
+
+if __name__ == '__main__':
+    unittest.main()
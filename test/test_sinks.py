@@ -0,0 +1,152 @@
+import json
+import os
+import sqlite3
+import tempfile
+import unittest
+from unittest import mock
+
+import pandas as pd
+
+from sortgs.extsort import external_sort
+from sortgs.sinks import COLUMNS, MERGED_COLUMNS, open_sink, read_frame, write_rows
+
+try:
+    import pyarrow  # noqa: F401
+    FORMATS = ['csv', 'jsonl', 'sqlite', 'parquet']
+except ImportError:
+    FORMATS = ['csv', 'jsonl', 'sqlite']
+
+
+def make_row(rank, paper_id, citations):
+    return {'Rank': rank, 'ID': paper_id, 'Author': 'A Author', 'Title': f'Title {paper_id}', 'Citations': citations,
+            'Year': 2010, 'Publisher': 'publisher.org', 'Venue': 'Venue', 'Source': 'https://example.org',
+            'Download Link': None, 'cit/year': citations // 10}
+
+
+# Two pages in crawl order, paper_0002 is found twice
+PAGES = [
+    [make_row(1, 'paper_0001', 5), make_row(3, 'paper_0002', 50)],
+    [make_row(2, 'paper_0002', 50), make_row(4, 'paper_0003', 20), make_row(5, 'paper_0004', 20)],
+]
+
+
+class TestExternalSort(unittest.TestCase):
+    def test_spilled_runs(self):
+        rows = [{'i': i, 'key': i % 7} for i in range(100)]
+        with tempfile.TemporaryDirectory() as tmp:
+            result = list(external_sort(rows, key=lambda row: row['key'], run_size=8, tmp_dir=tmp))
+            self.assertEqual(os.listdir(tmp), [])
+        # Stable: rows with the same key keep their order
+        self.assertEqual(result, sorted(rows, key=lambda row: row['key']))
+
+    def test_reverse(self):
+        rows = [{'i': i, 'key': i % 3} for i in range(20)]
+        result = list(external_sort(rows, key=lambda row: row['key'], reverse=True, run_size=4))
+        self.assertEqual(result, sorted(rows, key=lambda row: row['key'], reverse=True))
+
+
+class TestSinks(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+
+    def write(self, fmt, **kwargs):
+        sink = open_sink(fmt, os.path.join(self.tmp.name, 'machine_learning'), **kwargs)
+        sink.write(PAGES[0])
+        # Rows are readable as soon as the page is written
+        if fmt in ('csv', 'jsonl'):
+            with open(sink.fpath) as f:
+                self.assertIn('paper_0002', f.read())
+        sink.write(PAGES[1])
+        sink.finalize()
+        return sink.fpath
+
+    def assert_ranked(self, df, ids=('paper_0002', 'paper_0003', 'paper_0004', 'paper_0001')):
+        self.assertEqual(list(df.ID), list(ids))
+        ranks = {'paper_0001': 1, 'paper_0002': 2, 'paper_0003': 3, 'paper_0004': 4}
+        self.assertEqual(list(df.Rank), [ranks[paper_id] for paper_id in ids])
+
+    def test_csv(self):
+        df = pd.read_csv(self.write('csv'))
+        self.assertEqual(list(df.columns)[:3], ['Rank', 'ID', 'Author'])
+        self.assert_ranked(df)
+        self.assertTrue(df['Download Link'].isna().all())
+
+    def test_jsonl(self):
+        with open(self.write('jsonl')) as f:
+            df = pd.DataFrame([json.loads(line) for line in f])
+        self.assert_ranked(df)
+
+    def test_sqlite(self):
+        fpath = self.write('sqlite', max_rank=3)
+        with sqlite3.connect(fpath) as db:
+            df = pd.read_sql('SELECT * FROM sorted', db)
+        db.close()
+        self.assert_ranked(df, ids=('paper_0002', 'paper_0003', 'paper_0001'))
+
+    def test_parquet(self):
+        try:
+            import pyarrow  # noqa: F401
+        except ImportError:
+            self.skipTest('pyarrow is not installed')
+        df = pd.read_parquet(self.write('parquet', sortby='cit/year'))
+        self.assert_ranked(df)
+        # Sorted a row group at a time, the file is never loaded whole
+        with mock.patch('pyarrow.parquet.read_table', side_effect=AssertionError):
+            fpath = self.write('parquet', max_rank=3)
+        self.assert_ranked(pd.read_parquet(fpath), ids=('paper_0002', 'paper_0003', 'paper_0001'))
+
+    def test_several_sort_columns(self):
+        ids = ('paper_0001', 'paper_0004', 'paper_0003', 'paper_0002')
+        self.assert_ranked(pd.read_csv(self.write('csv', sortby='Citations asc, Rank')), ids)
+        with sqlite3.connect(self.write('sqlite', sortby='Citations asc, Rank')) as db:
+            df = pd.read_sql('SELECT * FROM sorted', db)
+        db.close()
+        self.assert_ranked(df, ids)
+
+    def test_unknown_sort_column(self):
+        df = pd.read_csv(self.write('csv', sortby='Unknown'))
+        self.assert_ranked(df)
+
+    def test_read_back(self):
+        for fmt in FORMATS:
+            sink = open_sink(fmt, os.path.join(self.tmp.name, 'machine_learning'), sortby='Citations asc, Rank')
+            sink.write(PAGES[0])
+            sink.write(PAGES[1])
+            sink.finalize()
+            rows = list(sink.read())
+            self.assertEqual([row['ID'] for row in rows], ['paper_0001', 'paper_0004', 'paper_0003', 'paper_0002'])
+            self.assertEqual(rows[0]['Citations'], 5)
+
+    def test_score_column(self):
+        # Scores are added by the caller, the lowest citations score best here
+        pages = [[dict(row, Score=1000 / row['Citations']) for row in page] for page in PAGES]
+        for fmt in FORMATS:
+            sink = open_sink(fmt, os.path.join(self.tmp.name, 'machine_learning'), sortby='Score',
+                             columns=COLUMNS + ['Score'])
+            for page in pages:
+                sink.write(page)
+            sink.finalize()
+            rows = list(sink.read())
+            self.assertEqual([row['ID'] for row in rows], ['paper_0001', 'paper_0003', 'paper_0004', 'paper_0002'])
+            self.assertEqual([row['Score'] for row in rows], [200.0, 50.0, 50.0, 20.0])
+
+    def test_write_rows(self):
+        rows = [dict(make_row(rank, f'paper_{rank:04d}', 100 - rank), Keywords='a; b') for rank in range(1, 6)]
+        for fmt in FORMATS:
+            fpath_base = os.path.join(self.tmp.name, 'merged')
+            # Consumed as a stream
+            write_rows(iter(rows), fmt, fpath_base, MERGED_COLUMNS)
+            if fmt == 'sqlite':
+                with sqlite3.connect(fpath_base + '.sqlite') as db:
+                    df = pd.read_sql('SELECT * FROM results', db)
+                db.close()
+            else:
+                df = read_frame(f'{fpath_base}.{fmt}')
+            self.assertEqual(list(df.columns), MERGED_COLUMNS)
+            self.assertEqual(list(df.ID), [row['ID'] for row in rows])
+            self.assertEqual(set(df.Keywords), {'a; b'})
+
+
+if __name__ == '__main__':
+    unittest.main()
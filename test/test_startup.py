@@ -0,0 +1,46 @@
+'''Startup cost of the sortgs command line.'''
+import subprocess
+import sys
+import unittest
+
+IMPORT_BUDGET_MS = 100  # Cumulative import time allowed for the sortgs package
+HEAVY_MODULES = ['pandas', 'matplotlib', 'selenium', 'aiohttp', 'aiofiles', 'bs4', 'requests', 'asyncio']
+
+LIST_HEAVY = f'import sys; print(" ".join(m for m in {HEAVY_MODULES!r} if m in sys.modules))'
+
+
+def run_python(code, *args):
+    return subprocess.run([sys.executable, *args, '-c', code], capture_output=True, text=True, check=True)
+
+
+def import_time_ms():
+    '''Returns the cumulative import time of the sortgs package, from python -X importtime.'''
+    stderr = run_python('import sortgs', '-X', 'importtime').stderr
+    for line in stderr.splitlines():
+        # import time: self [us] | cumulative | imported package
+        fields = [field.strip() for field in line.split('|')]
+        if len(fields) == 3 and fields[2] == 'sortgs':
+            return int(fields[1]) / 1000
+    raise AssertionError('sortgs not found in the importtime output')
+
+
+class TestStartup(unittest.TestCase):
+    def test_import_skips_heavy_modules(self):
+        out = run_python('import sortgs; ' + LIST_HEAVY).stdout
+        self.assertEqual(out.split(), [])
+
+    def test_help_skips_heavy_modules(self):
+        code = ('import sys; sys.argv = ["sortgs", "--help"]; import sortgs\n'
+                'try:\n    sortgs.main()\nexcept SystemExit:\n    pass\n' + LIST_HEAVY)
+        out = run_python(code).stdout
+        self.assertIn('usage:', out)
+        self.assertEqual(out.split('\n')[-2].split(), [])
+
+    def test_import_time_budget(self):
+        # Best of a few runs, to keep the check stable on busy machines
+        best = min(import_time_ms() for _ in range(3))
+        self.assertLess(best, IMPORT_BUDGET_MS)
+
+
+if __name__ == '__main__':
+    unittest.main()